@@ -1,9 +1,20 @@
 # File: ace.py — ValgAce module for Klipper
 
+import collections
+import cProfile
+import ctypes
+import ctypes.util
+import heapq
 import logging
 import json
+import math
+import mmap
+import os
+import random
 import struct
 import queue
+import tempfile
+import time
 from typing import Optional, Dict, Any, Callable
 
 # Check for required libraries and raise an error if they are not available
@@ -16,12 +27,530 @@ except ImportError:
     raise ImportError("The 'pyserial' library is required for ValgAce module. Please install it using 'pip install pyserial'")
 
 
+# Типы записей бортового самописца
+# Flight recorder record kinds
+TRACE_TX = 1      # Кадр, отправленный в ACE / frame sent to the ACE
+TRACE_RX = 2      # Сырые байты, прочитанные из порта / raw bytes read from the port
+TRACE_EVENT = 3   # Событие состояния (парковка, переподключение) / state transition
+TRACE_KIND_NAMES = {TRACE_TX: 'tx', TRACE_RX: 'rx', TRACE_EVENT: 'event'}
+
+# Форматы статуса / status layouts for get_status
+STATUS_LAYOUTS = {'nested': 'nested', 'flat': 'flat', 'both': 'both'}
+_MISSING = object()
+
+
+class AceFlightRecorder:
+    """
+    Бортовой самописец: кольцевой буфер в memory-mapped файле.
+    Flight recorder: fixed-size ring of timestamped records in a memory-mapped file.
+
+    Файл отображается с MAP_SHARED, поэтому записанные данные остаются в файле
+    даже при аварийном завершении Klipper. При следующем запуске запись
+    продолжается с того же места.
+    The file is mapped MAP_SHARED, so records survive a Klipper crash and the
+    next start appends to the same ring.
+
+    Layout: 64-byte header, then ``capacity`` bytes of ring data.
+    Record: <timestamp f64><kind u8><reserved u8><length u16><payload>.
+    """
+    MAGIC = b'ACETRC01'
+    VERSION = 1
+    HEADER = struct.Struct('<8sIIQQd')   # magic, version, capacity, write_pos, tail_pos, wall_offset
+    HEADER_SIZE = 64
+    POSITIONS = struct.Struct('<QQ')     # write_pos, tail_pos at offset 16
+    RECORD = struct.Struct('<dBBH')
+    MAX_PAYLOAD = 0xffff
+
+    def __init__(self, path: str, capacity: int, wall_offset: float):
+        self.path = path
+        self.capacity = capacity
+        size = self.HEADER_SIZE + capacity
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+
+        magic, version, old_capacity, write_pos, tail_pos, _ = self.HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC or version != self.VERSION or old_capacity != capacity \
+                or tail_pos > write_pos or write_pos - tail_pos > capacity:
+            write_pos = tail_pos = 0
+        self.write_pos = write_pos
+        self.tail_pos = tail_pos
+        # wall_offset переводит время reactor в UNIX-время при экспорте
+        # wall_offset converts reactor time to UNIX time on export
+        self.HEADER.pack_into(self._mm, 0, self.MAGIC, self.VERSION, capacity,
+                              write_pos, tail_pos, wall_offset)
+
+    def close(self):
+        try:
+            self._mm.flush()
+            self._mm.close()
+        except (ValueError, OSError):
+            pass
+
+    def _write(self, pos: int, data):
+        off = pos % self.capacity
+        first = min(len(data), self.capacity - off)
+        base = self.HEADER_SIZE
+        self._mm[base + off:base + off + first] = data[:first]
+        if first < len(data):
+            self._mm[base:base + len(data) - first] = data[first:]
+
+    def _read(self, pos: int, size: int) -> bytes:
+        off = pos % self.capacity
+        first = min(size, self.capacity - off)
+        base = self.HEADER_SIZE
+        data = self._mm[base + off:base + off + first]
+        if first < size:
+            data += self._mm[base:base + size - first]
+        return data
+
+    def record(self, kind: int, data: bytes, eventtime: float):
+        """Добавить запись (горячий путь) / Append one record (hot path)"""
+        size = len(data)
+        if size > self.MAX_PAYLOAD:
+            data = data[:self.MAX_PAYLOAD]
+            size = self.MAX_PAYLOAD
+        end = self.write_pos + self.RECORD.size + size
+        if end - self.tail_pos > self.capacity:
+            # Освобождаем место, отбрасывая самые старые записи
+            # Make room by dropping the oldest records
+            tail = self.tail_pos
+            limit = end - self.capacity
+            while tail < limit:
+                tail += self.RECORD.size + self.RECORD.unpack(self._read(tail, self.RECORD.size))[3]
+            self.tail_pos = tail
+            # Хвост сохраняется до перезаписи данных, чтобы файл оставался читаемым после сбоя
+            # Persist the tail before overwriting so the file stays readable after a crash
+            self.POSITIONS.pack_into(self._mm, 16, self.write_pos, tail)
+        self._write(self.write_pos, self.RECORD.pack(eventtime, kind, 0, size))
+        self._write(self.write_pos + self.RECORD.size, data)
+        self.write_pos = end
+        self.POSITIONS.pack_into(self._mm, 16, end, self.tail_pos)
+
+    def records(self):
+        """Все записи от старых к новым: (eventtime, kind, payload)"""
+        return self.read_records(self._mm)
+
+    @classmethod
+    def read_file(cls, path: str):
+        """Прочитать самописец из файла (в том числе после сбоя) / Read a trace file"""
+        with open(path, 'rb') as f:
+            return cls.read_records(f.read())
+
+    @classmethod
+    def read_records(cls, buf):
+        magic, version, capacity, write_pos, tail_pos, wall_offset = cls.HEADER.unpack_from(buf, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("Not an ACE flight recorder file")
+        ring = bytes(buf[cls.HEADER_SIZE:cls.HEADER_SIZE + capacity])
+
+        def ring_slice(pos, size):
+            off = pos % capacity
+            if off + size <= capacity:
+                return ring[off:off + size]
+            return ring[off:] + ring[:size - (capacity - off)]
+
+        records = []
+        pos = tail_pos
+        while pos + cls.RECORD.size <= write_pos:
+            eventtime, kind, _, size = cls.RECORD.unpack(ring_slice(pos, cls.RECORD.size))
+            start = pos + cls.RECORD.size
+            if start + size > write_pos:
+                break
+            records.append((eventtime, kind, ring_slice(start, size)))
+            pos = start + size
+        return {'wall_offset': wall_offset, 'records': records}
+
+    @staticmethod
+    def export_jsonl(trace: Dict[str, Any], path: str) -> int:
+        """Экспорт в JSON Lines: одна запись на строку / Export as JSON Lines"""
+        wall_offset = trace['wall_offset']
+        with open(path, 'w') as f:
+            for eventtime, kind, payload in trace['records']:
+                entry = {
+                    't': round(eventtime, 6),
+                    'wall': round(eventtime + wall_offset, 6),
+                    'kind': TRACE_KIND_NAMES.get(kind, str(kind)),
+                }
+                if kind == TRACE_EVENT:
+                    entry['text'] = payload.decode('utf-8', 'replace')
+                else:
+                    entry['hex'] = payload.hex()
+                f.write(json.dumps(entry) + '\n')
+        return len(trace['records'])
+
+
+class AceEventLog:
+    """
+    Структурированный журнал событий: записи вида ``name key=value ...``.
+    Structured event log: compact ``name key=value ...`` records shared by
+    klippy.log, the flight recorder and the per-event counters.
+
+    Уровень проверяется до форматирования: отключённое событие стоит одно
+    сравнение и инкремент счётчика. ``sampled=True`` для частых событий
+    (каждый кадр статуса) пишет первое и затем каждое ``sample``-е.
+    The level is checked before anything is formatted, so a disabled event
+    costs one comparison and a counter increment. ``sampled=True`` logs the
+    first and then every ``sample``-th occurrence of a high-frequency event;
+    ``trace=True`` also records it in the flight recorder at any level.
+    """
+    LEVELS = {'DEBUG': logging.DEBUG, 'INFO': logging.INFO,
+              'WARNING': logging.WARNING, 'ERROR': logging.ERROR}
+
+    def __init__(self, logger, clock: Callable, level: Optional[int] = None, sample: int = 10):
+        self.logger = logger
+        self.clock = clock
+        self.recorder = None
+        self.sample = sample
+        self.counts = {}
+        self.level = logging.INFO
+        self.debug = False
+        if level is None:
+            self._apply_level(logger.getEffectiveLevel())
+        else:
+            self.set_level(level)
+
+    def _apply_level(self, level: int):
+        self.level = level
+        self.debug = level <= logging.DEBUG
+
+    def set_level(self, level: int):
+        """Сменить уровень во время работы / Change the level at runtime"""
+        self._apply_level(level)
+        self.logger.setLevel(level)
+
+    @staticmethod
+    def format(name: str, fields: Dict[str, Any]) -> str:
+        parts = [name]
+        for key, value in fields.items():
+            if isinstance(value, float):
+                value = f"{value:.3f}".rstrip('0').rstrip('.')
+            else:
+                value = str(value).replace(' ', '_')
+            parts.append(f"{key}={value}")
+        return ' '.join(parts)
+
+    def event(self, level: int, name: str, trace: bool = False, sampled: bool = False, **fields) -> bool:
+        """Учесть событие и записать его, если позволяет уровень; True если записано"""
+        count = self.counts.get(name, 0) + 1
+        self.counts[name] = count
+        log = level >= self.level and (not sampled or self.sample <= 1 or count % self.sample == 1)
+        record = trace and self.recorder is not None
+        if not (log or record):
+            return False
+        text = self.format(name, fields)
+        if record:
+            self.recorder.record(TRACE_EVENT, text.encode('utf-8'), self.clock())
+        if log:
+            self.logger.log(level, text)
+        return True
+
+    def trace(self, text: str):
+        """Готовая запись только для самописца / Pre-formatted flight recorder event"""
+        name = text.split(' ', 1)[0]
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if self.recorder is not None:
+            self.recorder.record(TRACE_EVENT, text.encode('utf-8'), self.clock())
+
+
+class AceProfiler:
+    """
+    Замер горячих путей на работающем принтере (ACE_PROFILE).
+    Wall-time samples per function for ACE_PROFILE.
+
+    Обёртки ставятся только на время замера, без него код не меняется.
+    Время включающее: _reader_loop содержит _process_messages и _handle_response.
+    Wrappers exist only while a capture runs, so there is no cost otherwise.
+    Times are inclusive: _reader_loop contains _process_messages, which
+    contains _handle_response.
+    """
+
+    def __init__(self, duration: float, cprofile=None):
+        self.duration = duration
+        self.cprofile = cprofile
+        self.samples = {}   # name -> [seconds]
+        self.started = time.perf_counter()
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+        samples = self.samples.setdefault(name, [])
+        perf_counter = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                samples.append(perf_counter() - start)
+        timed.__wrapped__ = func
+        return timed
+
+    def call(self, callback: Callable, eventtime: float):
+        """Вызов callback из AceScheduler с замером / Timed AceScheduler callback"""
+        name = getattr(callback, '__qualname__', type(callback).__name__)
+        name = 'timer ' + name.replace('ValgAce.', '').replace('.<locals>', '')
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = []
+        start = time.perf_counter()
+        try:
+            return callback(eventtime)
+        finally:
+            samples.append(time.perf_counter() - start)
+
+    @staticmethod
+    def _percentile(ordered, fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        """Строки отчёта, по убыванию суммарного времени / Report rows, by total time"""
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        rows = []
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            total = sum(ordered)
+            rows.append({
+                'name': name,
+                'count': len(ordered),
+                'total_ms': total * 1000.0,
+                'share': total / elapsed,
+                'max_ms': ordered[-1] * 1000.0,
+                'p50_ms': self._percentile(ordered, 0.50) * 1000.0,
+                'p90_ms': self._percentile(ordered, 0.90) * 1000.0,
+                'p99_ms': self._percentile(ordered, 0.99) * 1000.0,
+            })
+        rows.sort(key=lambda row: -row['total_ms'])
+        return rows
+
+
+class AceTimerHandle:
+    """Отложенный вызов в AceScheduler / Deferred call owned by AceScheduler"""
+    __slots__ = ('callback', 'waketime', 'cancelled')
+
+    def __init__(self, callback: Callable, waketime: float):
+        self.callback = callback
+        self.waketime = waketime
+        self.cancelled = False
+
+    def cancel(self):
+        """Отменить вызов; безопасно вызывать повторно и из самого callback"""
+        self.cancelled = True
+        self.callback = None
+
+
+class AceScheduler:
+    """
+    Все отложенные вызовы модуля на одном таймере reactor.
+    All of the module's deferred calls multiplexed onto one reactor timer.
+
+    Сроки хранятся в min-heap, reactor будится только к ближайшему. Каждый
+    ``dwell()`` раньше регистрировал таймер, который никогда не удалялся, и
+    Klipper перебирал их все при каждой проверке таймеров.
+    Every ``dwell()`` used to register a reactor timer that was never
+    unregistered, and Klipper walks its whole timer list on every check.
+
+    API повторяет ``reactor.register_timer``: callback(eventtime) возвращает
+    время следующего вызова или ``reactor.NEVER``. Отмененные и перенесенные
+    записи удаляются из кучи лениво.
+    """
+
+    def __init__(self, reactor):
+        self.reactor = reactor
+        self.NEVER = reactor.NEVER
+        self._heap = []     # (waketime, seq, handle)
+        self._seq = 0
+        self._armed = self.NEVER
+        self._timer = reactor.register_timer(self._run, self.NEVER)
+        # AceProfiler на время ACE_PROFILE / set while ACE_PROFILE runs
+        self.profiler = None
+
+    def register_timer(self, callback: Callable, waketime: Optional[float] = None) -> AceTimerHandle:
+        handle = AceTimerHandle(callback, self.NEVER)
+        self.update_timer(handle, self.NEVER if waketime is None else waketime)
+        return handle
+
+    def update_timer(self, handle: AceTimerHandle, waketime: float):
+        if handle.cancelled:
+            return
+        handle.waketime = waketime
+        if waketime >= self.NEVER:
+            return
+        self._seq += 1
+        heapq.heappush(self._heap, (waketime, self._seq, handle))
+        if waketime < self._armed:
+            self._armed = waketime
+            self.reactor.update_timer(self._timer, waketime)
+
+    def unregister_timer(self, handle: Optional[AceTimerHandle]):
+        if handle is not None:
+            handle.cancel()
+
+    def pending(self) -> int:
+        return sum(1 for waketime, _, handle in self._heap
+                   if not handle.cancelled and handle.waketime == waketime)
+
+    def _next_waketime(self) -> float:
+        heap = self._heap
+        while heap:
+            waketime, _, handle = heap[0]
+            if not handle.cancelled and handle.waketime == waketime:
+                return waketime
+            heapq.heappop(heap)
+        return self.NEVER
+
+    def _run(self, eventtime: float) -> float:
+        heap = self._heap
+        self._armed = self.NEVER
+        while heap and heap[0][0] <= eventtime:
+            waketime, _, handle = heapq.heappop(heap)
+            if handle.cancelled or handle.waketime != waketime:
+                continue
+            handle.waketime = self.NEVER
+            # Callback может уйти в reactor.pause() (G-code из таймера) —
+            # остальные сроки не должны ждать его завершения
+            # A callback may pause the reactor (G-code from a timer); keep the
+            # rest of the heap armed while it runs
+            self._armed = self._next_waketime()
+            if self._armed < self.NEVER:
+                self.reactor.update_timer(self._timer, self._armed)
+            try:
+                if self.profiler is None:
+                    next_time = handle.callback(eventtime)
+                else:
+                    next_time = self.profiler.call(handle.callback, eventtime)
+            except Exception:
+                logging.getLogger('ace').exception("Error in ACE scheduler callback")
+                next_time = self.NEVER
+            if handle.waketime == self.NEVER and next_time is not None:
+                # Не перенесен и не отменен изнутри callback
+                # Not rescheduled or cancelled from inside the callback
+                self.update_timer(handle, next_time)
+        self._armed = self._next_waketime()
+        return self._armed
+
+
+class AceHotplugWatcher:
+    """
+    Отслеживание появления порта через inotify (ctypes, без зависимостей).
+    Watches for the serial port to (re)appear using inotify through ctypes.
+
+    Наблюдает за ближайшим существующим каталогом на пути к порту: каталог
+    /dev/serial/by-id сам исчезает, когда в системе нет USB-serial устройств.
+    Watches the closest existing directory on the way to the port, because
+    /dev/serial/by-id itself disappears while no USB serial device is present.
+    ``available`` is False when inotify cannot be used; the caller then falls
+    back to polling os.path.exists().
+    """
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT = struct.Struct('iIII')   # wd, mask, cookie, len
+
+    def __init__(self, reactor, path: str, callback: Callable, logger):
+        self.reactor = reactor
+        self.path = path
+        self.callback = callback
+        self.logger = logger
+        self._fd = -1
+        self._fd_handle = None
+        self._watched = set()
+        self._present = os.path.exists(path)
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            self.logger.info(f"inotify unavailable ({e}), polling for {path}")
+            return
+        if fd < 0:
+            self.logger.info(f"inotify_init1 failed (errno {ctypes.get_errno()}), polling for {path}")
+            return
+        self._fd = fd
+        self._add_watch()
+        self._fd_handle = reactor.register_fd(fd, self._handle_events)
+
+    @property
+    def available(self) -> bool:
+        return self._fd >= 0
+
+    def _add_watch(self):
+        directory = os.path.dirname(self.path) or '.'
+        while not os.path.isdir(directory) and directory != os.path.dirname(directory):
+            directory = os.path.dirname(directory)
+        if directory in self._watched:
+            return
+        mask = (self.IN_CREATE | self.IN_ATTRIB | self.IN_MOVED_TO
+                | self.IN_DELETE | self.IN_MOVED_FROM)
+        if self._libc.inotify_add_watch(self._fd, directory.encode(), mask) < 0:
+            self.logger.info(f"inotify_add_watch({directory}) failed (errno {ctypes.get_errno()})")
+            return
+        self._watched.add(directory)
+
+    def _handle_events(self, eventtime):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.logger.info(f"inotify read error: {e}")
+            return
+        # Имя события не проверяем: для симлинков by-id и каталогов по пути
+        # к порту проще проверить сам путь. Callback - только при появлении.
+        # The path itself is checked instead of event names; the callback
+        # fires only on a missing -> present transition.
+        if data and len(data) >= self.EVENT.size:
+            self._add_watch()
+            present = os.path.exists(self.path)
+            if present and not self._present:
+                self.callback(eventtime)
+            self._present = present
+
+    def close(self):
+        if self._fd_handle is not None:
+            self.reactor.unregister_fd(self._fd_handle)
+            self._fd_handle = None
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
 class ValgAce:
     """
     Модуль ValgAce для Klipper
     Обеспечивает управление устройством автоматической смены филамента (ACE)
     Поддерживает до 4 слотов для катушек с возможностью сушки, подачи и обратной подачи филамента
     """
+    # Максимальная длина payload кадра; больше - считаем заголовок мусором
+    # Largest frame payload accepted; anything longer is a false header
+    MAX_FRAME_PAYLOAD = 4096
+    # Сколько шаблонов кадров держать (ключ - метод и параметры)
+    # Cached request frame templates, keyed by method and params
+    FRAME_TEMPLATE_LIMIT = 64
+    # Сторожевой таймер связи / link watchdog
+    LINK_WINDOW = 50              # событий в окне доли ошибок / outcomes in the error window
+    LINK_MIN_SAMPLES = 10         # меньше - оценку не делаем / fewer samples are not judged
+    LINK_RTT_ALPHA = 0.2          # вес нового замера RTT / EWMA weight of a new RTT sample
+    LINK_DEGRADED_HOLD = 5.0      # сколько секунд оценка должна быть низкой / seconds below threshold
+    LINK_RESTART_COOLDOWN = 60.0  # не чаще одного переподключения в минуту / restart rate limit
+    # Запас сверх max_parking_timeout, после которого незакрытая запись смены
+    # инструмента больше не считается идущей сменой (ретракт, макросы)
+    # Margin over max_parking_timeout after which an unclosed tool change record
+    # no longer counts as a running change (retract, macros)
+    TOOLCHANGE_STALE_MARGIN = 120.0
+    # Методы, которые ACE_PROFILE подменяет обёртками с замером
+    # Methods ACE_PROFILE replaces with timed wrappers
+    PROFILED_METHODS = ('_reader_loop', '_writer_loop', '_process_messages', '_handle_response', 'get_status')
+    # Период проверки программы сушки, сек / drying program check period
+    DRY_CHECK_INTERVAL = 5.0
+
     def __init__(self, config):
         self.printer = config.get_printer()
         self.toolhead = None
@@ -31,6 +560,16 @@ class ValgAce:
         # Initialize logger first
         self.logger = logging.getLogger('ace')
         self._name = 'ace'
+
+        # Журнал событий: уровень проверяется до форматирования, ACE_LOG меняет его на ходу
+        # Event log: level-gated before formatting, switchable at runtime with ACE_LOG
+        # Без log_level уровень берётся из Klipper (klippy -v включает DEBUG)
+        # Without log_level the level follows Klipper (klippy -v enables DEBUG)
+        log_level = config.get('log_level', '').upper()
+        if log_level and log_level not in AceEventLog.LEVELS:
+            raise self.printer.config_error(f"log_level must be one of {', '.join(AceEventLog.LEVELS)}")
+        self._events = AceEventLog(self.logger, self.reactor.monotonic, AceEventLog.LEVELS.get(log_level),
+                                   config.getint('log_sample', 10, minval=1))
         
         # Initialize filament sensor
         self.filament_sensor_name = config.get('filament_sensor', None)
@@ -61,9 +600,21 @@ class ValgAce:
         self._read_timeout = config.getfloat('read_timeout', 0.1)
         self._write_timeout = config.getfloat('write_timeout', 0.5)
         self._max_queue_size = config.getint('max_queue_size', 20)
+        # Режим низкого энергопотребления: reader/writer спят, пока нет запросов
+        # Low-power idle: reader/writer sleep while nothing is pending
+        self.low_power_idle = config.getboolean('low_power_idle', True)
+        # Сторожевой таймер связи: RTT запросов статуса и доля ошибок
+        # Link watchdog: status round-trip time and error rate
+        self.link_watchdog = config.getboolean('link_watchdog', True)
+        self.link_health_threshold = config.getint('link_health_threshold', 50, minval=0, maxval=100)
         # Устройство выбирается только из конфигурации
         # Device is selected only from configuration
         self.serial_name = config.get('serial', '/dev/ttyACM0')
+        # Переподключение: экспоненциальная задержка с jitter и отслеживание появления порта
+        # Reconnect: exponential backoff with jitter, plus hotplug detection
+        self.reconnect_delay_min = config.getfloat('reconnect_delay_min', 0.5, above=0.)
+        self.reconnect_delay_max = config.getfloat('reconnect_delay_max', 30., above=0.)
+        self.hotplug_detect = config.getboolean('hotplug_detect', True)
 
         self.baud = config.getint('baud', 115200)
 
@@ -75,6 +626,22 @@ class ValgAce:
         self.toolchange_retract_length = config.getint('toolchange_retract_length', 100)
         self.park_hit_count = config.getint('park_hit_count', 5)
         self.max_dryer_temperature = config.getint('max_dryer_temperature', 55)
+        # Период запроса статуса во время сушки: чаще обновляется temperature_ace
+        # Status poll period while drying, so temperature_ace reports faster
+        self.drying_status_interval = config.getfloat('drying_status_interval', 0.5, minval=0.2, maxval=1.0)
+        self._drying = False
+        # Программы сушки по типу филамента: drying_profile_petg: 45:20, 60:240, 35:15 (°C:минуты)
+        # Drying programs per filament type, stages as temp:minutes
+        self.drying_profiles = {}
+        for option in config.get_prefix_options('drying_profile_'):
+            name = option[len('drying_profile_'):].upper()
+            self.drying_profiles[name] = self._parse_drying_profile(option, config.get(option))
+        # Сколько принтер должен простаивать, прежде чем программа начнёт или продолжит сушку
+        # How long the printer must be idle before a program starts or resumes
+        self.drying_idle_delay = config.getfloat('drying_idle_delay', 60.0, minval=0.)
+        self._dry_program = None
+        self._dry_timer = None
+        self._dry_idle_since = None
         self.disable_assist_after_toolchange = config.getboolean('disable_assist_after_toolchange', True)
         self.infinity_spool_mode = config.getboolean ('infinity_spool_mode', False)
         self.ins_spool_work = False  # Флаг выполнения операции ACE_INFINITY_SPOOL
@@ -91,6 +658,18 @@ class ValgAce:
         # Макрос для паузы печати (по умолчанию PAUSE)
         self.pause_macro_name = config.get('set_pause_macro_name', 'PAUSE')
 
+        # Формат статуса: nested (slots/dryer, как раньше), flat (slot_0..3, dryer_*) или both
+        # Status layout: nested (slots/dryer, compatible), flat (slot_0..3, dryer_*) or both
+        self.status_layout = config.getchoice('status_layout', STATUS_LAYOUTS, 'nested')
+
+        # Бортовой самописец: кадры протокола и события в кольцевом буфере
+        # Flight recorder: protocol frames and events in a memory-mapped ring
+        self._recorder = None
+        if config.getboolean('flight_recorder', True):
+            trace_file = config.get('flight_recorder_file', '~/printer_data/logs/ace_trace.bin')
+            trace_size = config.getint('flight_recorder_size', 1024, minval=16)
+            self._open_flight_recorder(os.path.expanduser(trace_file), trace_size * 1024)
+
         # Добавляем возможность привязки к сенсору филамента
         # Optional filament sensor integration
 
@@ -98,6 +677,23 @@ class ValgAce:
         # Device state
         self._info = self._get_default_info()
         self._callback_map = {}
+        self._frame_templates = {}
+
+        # Снимок статуса для get_status: пересобирается только при изменениях
+        # Status snapshot for get_status, rebuilt only when something changed
+        self._status_snapshot = None
+        self._status_version = 0
+        self._status_dirty = True
+        # Текущая и последняя завершённая смена инструмента
+        self._toolchange = None
+        self._toolchange_seq = 0
+        self._last_toolchange = None
+        # Результат последней проверки ACE_PREFLIGHT
+        self._preflight = None
+        # Выполняющийся пакет /server/ace/batch: ответы G-code по командам
+        self._batch = None
+        self._status_dryer_raw = None
+        self._status_dryer = {}
         
         # Отображение индексов в слоты (по умолчанию 0→0, 1→1, 2→2, 3→3)
         # Index to slot mapping (default: 0→0, 1→1, 2→2, 3→3)
@@ -105,8 +701,9 @@ class ValgAce:
         self._request_id = 0
         self._connected = False
         self._manually_disconnected = False  # Track if disconnected by user command
-        self._connection_attempts = 0
-        self._max_connection_attempts = 5
+        self._connect_deadline = 0.
+        self._reconnecting = False     # Связь была и потеряна / link was up and got lost
+        self._port_present = None
 
         # Работа
         # Operation
@@ -132,15 +729,44 @@ class ValgAce:
         self._serial = None
         self._reader_timer = None
         self._writer_timer = None
+        self._reader_idle = False
+        self._writer_idle = False
+        self._last_tx_time = 0.
+        self._last_rx_time = 0.
+        # Пробуждения reader/writer за окно в 10 секунд
+        # Reader/writer wakeups, measured over 10 second windows
+        self._wakeup_count = 0
+        self._wakeup_window_start = self.reactor.monotonic()
+        self._link_status = {'state': 'connecting', 'reconnect_attempts': 0, 'retry_in': 0.0,
+                             'low_power_idle': self.low_power_idle, 'wakeups_per_sec': 0.0,
+                             'health': 100, 'rtt_ms': 0, 'degraded': False}
+        # Статистика связи за последние LINK_WINDOW событий
+        # Link statistics over the last LINK_WINDOW outcomes
+        self._inflight = {}            # id -> (время отправки, метод) / (send time, method)
+        self._link_outcomes = collections.deque()
+        self._link_error_count = 0
+        self._link_rtt = None          # EWMA RTT, секунды
+        self._link_degraded_since = None
+        self._link_last_restart = -self.LINK_RESTART_COOLDOWN
 
         # Регистрация событий
         # Register events
         self._register_handlers()
         self._register_gcode_commands()
 
-        # Подключение при запуске
-        # Connect on startup
-        self.reactor.register_timer(self._connect_check, self.reactor.NOW)
+        # Один таймер reactor для dwell, мониторинга парковки и infinity spool
+        # One reactor timer for dwell, parking monitors and infinity spool
+        self._scheduler = AceScheduler(self.reactor)
+        self._profiler = None
+
+        # Подключение при запуске; дальше таймер спит, пока связь есть
+        # Connect on startup; the timer then sleeps while the link is up
+        self._connect_timer = self._scheduler.register_timer(self._connect_check, self.reactor.NOW)
+        self._hotplug = None
+        if self.hotplug_detect:
+            watcher = AceHotplugWatcher(self.reactor, self.serial_name, self._handle_hotplug, self.logger)
+            if watcher.available:
+                self._hotplug = watcher
         
         # Инициализация флага для избежания дублирования dwell таймеров
         self._dwell_scheduled = False
@@ -158,14 +784,32 @@ class ValgAce:
 
         # Infinity Spool Auto-trigger state
         self.infsp_empty_detected = False        # Флаг обнаружения empty статуса
-        self.infsp_debounce_timer = None         # Reactor timer для debounce
-        self.infsp_sensor_monitor_timer = None   # Reactor timer для мониторинга датчика
+        self.infsp_debounce_timer = None         # AceTimerHandle для debounce
+        self.infsp_sensor_monitor_timer = None   # AceTimerHandle для мониторинга датчика
         self.infsp_last_active_status = None     # Последний известный статус активного слота
 
         # Infinity Spool Auto-trigger configuration parameters
         self.infinity_spool_debounce = config.getfloat('infinity_spool_debounce', 2.0)
         self.infinity_spool_pause_on_no_sensor = config.getboolean('infinity_spool_pause_on_no_sensor', True)
 
+    def _open_flight_recorder(self, path: str, capacity: int):
+        """Открыть файл самописца; при ошибке модуль работает без него"""
+        if not os.path.isdir(os.path.dirname(path) or '.'):
+            path = os.path.join(tempfile.gettempdir(), os.path.basename(path))
+        try:
+            wall_offset = time.time() - self.reactor.monotonic()
+            self._recorder = AceFlightRecorder(path, capacity, wall_offset)
+            self._events.recorder = self._recorder
+            self.logger.info(f"Flight recorder: {path} ({capacity // 1024} KB)")
+            self._trace_event("session_start")
+        except Exception as e:
+            self.logger.warning(f"Flight recorder disabled, cannot open {path}: {str(e)}")
+            self._recorder = None
+
+    def _trace_event(self, text: str):
+        """Записать событие состояния в самописец / Record a state transition"""
+        self._events.trace(text)
+
     def _get_default_info(self) -> Dict[str, Any]:
         return {
             'status': 'disconnected',
@@ -292,7 +936,7 @@ class ValgAce:
         # Преобразование через маппинг
         real_slot = self.index_to_slot[index]
         
-        self.logger.debug(f"INDEX validation: {index} → Slot {real_slot}")
+        self._events.event(logging.DEBUG, 'index_validated', index=index, slot=real_slot)
         return real_slot, None
 
     def _validate_slot_status(self, real_slot: int, required_status: str = 'ready') -> tuple:
@@ -378,6 +1022,9 @@ class ValgAce:
         """
         self.printer.register_event_handler('klippy:ready', self._handle_ready)
         self.printer.register_event_handler('klippy:disconnect', self._handle_disconnect)
+        # Ответы для пакетов /server/ace/batch собираются здесь, а не в Moonraker
+        self.gcode.register_output_handler(self._batch_output)
+        self.printer.register_event_handler('gcode:command_error', self._batch_command_error)
 
     def _register_gcode_commands(self):
         commands = [
@@ -385,6 +1032,9 @@ class ValgAce:
             ('ACE_STATUS', self.cmd_ACE_STATUS, "Get device status"),
             ('ACE_START_DRYING', self.cmd_ACE_START_DRYING, "Start drying"),
             ('ACE_STOP_DRYING', self.cmd_ACE_STOP_DRYING, "Stop drying"),
+            ('ACE_DRY_PROFILE', self.cmd_ACE_DRY_PROFILE, "Schedule a multi-stage drying program"),
+            ('ACE_DRY_SCHEDULE_STATUS', self.cmd_ACE_DRY_SCHEDULE_STATUS, "Show drying profiles and the scheduled program"),
+            ('ACE_DRY_CANCEL', self.cmd_ACE_DRY_CANCEL, "Cancel the scheduled drying program"),
             ('ACE_ENABLE_FEED_ASSIST', self.cmd_ACE_ENABLE_FEED_ASSIST, "Enable feed assist"),
             ('ACE_DISABLE_FEED_ASSIST', self.cmd_ACE_DISABLE_FEED_ASSIST, "Disable feed assist"),
             ('ACE_PARK_TO_TOOLHEAD', self.cmd_ACE_PARK_TO_TOOLHEAD, "Park filament to toolhead"),
@@ -399,6 +1049,7 @@ class ValgAce:
             ('ACE_SET_INFINITY_SPOOL_ORDER', self.cmd_ACE_SET_INFINITY_SPOOL_ORDER, "Set infinity spool slot order"),
             ('ACE_FILAMENT_INFO', self.cmd_ACE_FILAMENT_INFO, "Show filament info"),
             ('ACE_CHECK_FILAMENT_SENSOR', self.cmd_ACE_CHECK_FILAMENT_SENSOR, "Check filament sensor status"),
+            ('ACE_PREFLIGHT', self.cmd_ACE_PREFLIGHT, "Check that the given tools are ready before a print"),
             ('ACE_DISCONNECT', self.cmd_ACE_DISCONNECT, "Force disconnect device"),
             ('ACE_CONNECT', self.cmd_ACE_CONNECT, "Connect to device"),
             ('ACE_CONNECTION_STATUS', self.cmd_ACE_CONNECTION_STATUS, "Check connection status"),
@@ -409,18 +1060,71 @@ class ValgAce:
             ('ACE_RESET_SLOTMAPPING', self.cmd_ACE_RESET_SLOTMAPPING, "Reset slot mapping to defaults"),
             ('ACE_GET_CURRENT_INDEX', self.cmd_ACE_GET_CURRENT_INDEX, "Get current tool index"),
             ('ACE_SET_CURRENT_INDEX', self.cmd_ACE_SET_CURRENT_INDEX, "Set current tool index (for error recovery)"),
+            ('ACE_DUMP_TRACE', self.cmd_ACE_DUMP_TRACE, "Export flight recorder trace"),
+            ('ACE_LOG', self.cmd_ACE_LOG, "Show or change the ACE log level and event counters"),
+            ('ACE_PROFILE', self.cmd_ACE_PROFILE, "Measure ACE hot path timings for a number of seconds"),
+            ('ACE_BATCH_MARK', self.cmd_ACE_BATCH_MARK, "Command boundary marker for /server/ace/batch"),
         ]
         for name, func, desc in commands:
             self.gcode.register_command(name, func, desc=desc)
 
     def _connect_check(self, eventtime):
-        # Only auto-connect if the device is not connected and hasn't been manually disconnected
-        if not self._connected and not self._manually_disconnected:
-            # Try to connect
-            self._connect()
-        return eventtime + 1.0
+        """
+        Машина состояний подключения: одна попытка за вызов, между попытками
+        экспоненциальная задержка с jitter. Пока связь есть, таймер спит.
+        Connection state machine: one attempt per call with exponential
+        backoff and jitter in between; sleeps while the link is up.
+        """
+        if self._connected or self._manually_disconnected:
+            return self.reactor.NEVER
+        present = os.path.exists(self.serial_name)
+        appeared = present and self._port_present is False
+        self._port_present = present
+        if eventtime < self._connect_deadline and not appeared:
+            return self._next_connect_check(eventtime)
+        if appeared:
+            self.logger.info(f"Serial port {self.serial_name} appeared, connecting")
+        if self._connect():
+            return self.reactor.NEVER
+        delay = self._backoff_delay()
+        self._connect_deadline = eventtime + delay
+        self._set_link_status(retry_in=round(delay, 1))
+        self.logger.info(f"Failed to connect to ACE device, next attempt in {delay:.1f}s")
+        return self._next_connect_check(eventtime)
+
+    def _next_connect_check(self, eventtime) -> float:
+        if self._hotplug is None:
+            # Без inotify раз в секунду проверяем, не появился ли порт
+            # Without inotify, stat the port once a second to catch it appearing
+            return min(self._connect_deadline, eventtime + 1.0)
+        return self._connect_deadline
+
+    def _backoff_delay(self) -> float:
+        """Задержка перед следующей попыткой: 2^n с jitter / equal-jitter exponential backoff"""
+        exponent = min(self._reconnect_attempts - 1, 16)
+        delay = min(self.reconnect_delay_max, self.reconnect_delay_min * (2 ** max(exponent, 0)))
+        return delay / 2. + random.uniform(0., delay / 2.)
+
+    def _schedule_connect(self, delay: float = 0.):
+        """Запланировать попытку подключения / Schedule a connection attempt"""
+        waketime = self.reactor.monotonic() + delay
+        self._connect_deadline = waketime
+        self._scheduler.update_timer(self._connect_timer, waketime)
+
+    def _handle_hotplug(self, eventtime):
+        """Порт появился (inotify): подключаемся сразу, сбрасывая задержку"""
+        if self._connected or self._manually_disconnected:
+            return
+        self.logger.info(f"Serial port {self.serial_name} appeared, connecting")
+        self._trace_event(f"hotplug port={self.serial_name}")
+        self._reconnect_attempts = 0
+        self._port_present = True
+        # udev выставляет права и симлинки чуть позже создания узла
+        # udev finishes permissions and symlinks shortly after the node appears
+        self._schedule_connect(0.5)
 
     def _connect(self) -> bool:
+        """Одна попытка открыть порт / A single attempt to open the port"""
         if self._connected:
             return True
             
@@ -432,73 +1136,85 @@ class ValgAce:
                 pass
             self._serial = None
             
-        for attempt in range(self._max_connection_attempts):
-            try:
-                self.logger.info(f"Attempting to connect to ACE at {self.serial_name} (attempt {attempt + 1}/{self._max_connection_attempts})")
-                
-                self._serial = serial.Serial(
-                    port=self.serial_name,
-                    baudrate=self.baud,
-                    timeout=0,
-                    write_timeout=self._write_timeout
-                )
-                
-                if self._serial.is_open:
-                    self._connected = True
-                    self._info['status'] = 'ready'
-                    # Сбрасываем счётчик попыток при успешном подключении
-                    self._reconnect_attempts = 0
-                    self._connection_lost = False
-                    self.logger.info(f"Connected to ACE at {self.serial_name}")
-
-                    def info_callback(response):
-                        res = response['result']
-                        self.logger.info(f"Device info: {res.get('model', 'Unknown')} {res.get('firmware', 'Unknown')}")
-                        self.gcode.respond_info(f"Connected {res.get('model', 'Unknown')} {res.get('firmware', 'Unknown')}")
-
-                    self.send_request({"method": "get_info"}, info_callback)
-
-                    # Register timers if not already registered
-                    if self._reader_timer is None:
-                        self._reader_timer = self.reactor.register_timer(self._reader_loop, self.reactor.NOW)
-                    if self._writer_timer is None:
-                        self._writer_timer = self.reactor.register_timer(self._writer_loop, self.reactor.NOW)
-
-                    self.logger.info("Connection established successfully")
-                    return True
-                else:
-                    # Close the serial port if it wasn't opened properly
-                    if self._serial:
-                        self._serial.close()
-                        self._serial = None
-            except SerialException as e:
-                self.logger.info(f"Connection attempt {attempt + 1} failed: {str(e)}")
-                if self._serial:
-                    try:
-                        self._serial.close()
-                    except:
-                        pass
-                    self._serial = None
-                self.dwell(1.0, lambda: None)
-            except Exception as e:
-                self.logger.error(f"Unexpected error during connection: {str(e)}")
+        try:
+            self.logger.info(f"Attempting to connect to ACE at {self.serial_name} (attempt {self._reconnect_attempts + 1})")
+            
+            self._serial = serial.Serial(
+                port=self.serial_name,
+                baudrate=self.baud,
+                timeout=0,
+                write_timeout=self._write_timeout
+            )
+            
+            if self._serial.is_open:
+                self._connected = True
+                self._info['status'] = 'ready'
+                self._status_dirty = True
+                # Сбрасываем счётчик попыток при успешном подключении
+                self._reconnect_attempts = 0
+                self._reconnecting = False
+                self._connection_lost = False
+                self._reset_link_stats()
+                self._set_link_status(state='connected', reconnect_attempts=0, retry_in=0.0,
+                                      health=100, rtt_ms=0, degraded=False)
+                self.logger.info(f"Connected to ACE at {self.serial_name}")
+                self._trace_event(f"connected port={self.serial_name}")
+
+                def info_callback(response):
+                    res = response['result']
+                    self.logger.info(f"Device info: {res.get('model', 'Unknown')} {res.get('firmware', 'Unknown')}")
+                    self.gcode.respond_info(f"Connected {res.get('model', 'Unknown')} {res.get('firmware', 'Unknown')}")
+
+                self.send_request({"method": "get_info"}, info_callback)
+
+                # Register timers if not already registered
+                if self._reader_timer is None:
+                    self._reader_timer = self.reactor.register_timer(self._reader_loop, self.reactor.NOW)
+                if self._writer_timer is None:
+                    self._writer_timer = self.reactor.register_timer(self._writer_loop, self.reactor.NOW)
+
+                self.logger.info("Connection established successfully")
+                return True
+            else:
+                # Close the serial port if it wasn't opened properly
                 if self._serial:
-                    try:
-                        self._serial.close()
-                    except:
-                        pass
+                    self._serial.close()
                     self._serial = None
-                self.dwell(1.0, lambda: None)
-                
-        self.logger.info("Failed to connect to ACE device")
+        except SerialException as e:
+            self.logger.info(f"Connection attempt {self._reconnect_attempts + 1} failed: {str(e)}")
+        except Exception as e:
+            self.logger.error(f"Unexpected error during connection: {str(e)}")
+        if self._serial:
+            try:
+                self._serial.close()
+            except:
+                pass
+            self._serial = None
+        self._connect_failed()
         return False
 
+    def _connect_failed(self):
+        """
+        Учёт неудачной попытки. Попытки не прекращаются никогда; после
+        _max_reconnect_attempts подряд при потерянной связи выставляется
+        _connection_lost (уведомление и пауза печати).
+        Attempts never stop; after _max_reconnect_attempts failures on a
+        lost link, _connection_lost is raised (notification and pause).
+        """
+        self._reconnect_attempts += 1
+        self._set_link_status(state='connecting', reconnect_attempts=self._reconnect_attempts)
+        if (self._reconnecting and not self._connection_lost
+                and self._reconnect_attempts >= self._max_reconnect_attempts):
+            self._connection_lost = True
+            self._notify_connection_lost()
+
     def _disconnect(self):
         """Gracefully disconnect from the device and stop all timers"""
         if not self._connected:
             return
             
         self.logger.info("Disconnecting from ACE device...")
+        self._trace_event("disconnected")
         
         # Stop all timers
         if self._reader_timer:
@@ -517,9 +1233,20 @@ class ValgAce:
         finally:
             self._serial = None
         
+        # Недочитанный кадр старого соединения не должен склеиться с новым потоком.
+        # Очистка на месте: если это вызвано из _handle_response, цикл
+        # _process_messages просто не найдёт больше кадров
+        # A partial frame from the old link must not be glued to the new stream;
+        # cleared in place, so a running _process_messages finds no more frames
+        del self.read_buffer[:]
+        
         # Update connection status
         self._connected = False
+        self._reader_idle = False
+        self._writer_idle = False
         self._info['status'] = 'disconnected'
+        self._status_dirty = True
+        self._set_link_status(state='disconnected')
         
         # Clear any pending requests
         try:
@@ -559,6 +1286,8 @@ class ValgAce:
     def _handle_disconnect(self):
         # When klipper disconnects, reset the manually disconnected flag so auto-reconnect can work after restart
         self._manually_disconnected = False
+        # Незавершённый пакет /server/ace/batch больше не получит END / an open batch will never end
+        self._batch = None
 
         # Проверяем состояние печати и вызываем паузу если нужно
         printer_state = self._get_printer_state()
@@ -570,39 +1299,80 @@ class ValgAce:
                 self.logger.error(f"Error triggering {self.pause_macro_name} during klipper disconnect: {str(e)}")
 
         self._disconnect()
+        if self._hotplug is not None:
+            self._hotplug.close()
+            self._hotplug = None
+        if self._recorder is not None:
+            self._events.recorder = None
+            self._recorder.close()
+            self._recorder = None
 
     def get_status(self, eventtime):
         """Возвращает статус для Moonraker API через query_objects"""
         # Klipper автоматически вызывает этот метод при запросе через query_objects
         # Moonraker автоматически оборачивает результат в ключ с именем модуля ('ace')
-        
+        #
+        # Klipper вызывает get_status для каждого подписчика, поэтому возвращается
+        # готовый снимок. Снимок никогда не изменяется на месте: webhooks сравнивает
+        # новый результат с предыдущим, поэтому при изменениях собирается новый dict.
+        # Klipper calls this for every subscriber, so a prebuilt snapshot is returned.
+        # The snapshot is never mutated in place (webhooks diffs against the previous
+        # result object); any change produces a new top-level dict.
+        filament_sensor_status = self._get_filament_sensor_status(eventtime)
+        snapshot = self._status_snapshot
+        if (snapshot is not None and not self._status_dirty
+                and snapshot['feed_assist_slot'] == self._feed_assist_index
+                and snapshot['slot_mapping'] == self.index_to_slot
+                and snapshot['filament_sensor'] == filament_sensor_status):
+            return snapshot
+        return self._rebuild_status(filament_sensor_status)
+
+    def _get_filament_sensor_status(self, eventtime):
+        """Статус сенсора филамента, если он настроен"""
+        if not self.filament_sensor:
+            return None
+        try:
+            return self.filament_sensor.get_status(eventtime)
+        except Exception as e:
+            self.logger.warning(f"Error getting filament sensor status: {str(e)}")
+            return {"filament_detected": False, "enabled": False}
+
+    def _normalize_dryer(self, dryer_data):
+        """Нормализация данных сушилки для статуса"""
+        # Нормализуем время: конвертируем секунды в минуты если нужно
+        if not isinstance(dryer_data, dict):
+            return {}
+        dryer_normalized = dryer_data.copy()
+
+        # remain_time всегда приходит в секундах - конвертируем в минуты
+        remain_time_raw = dryer_normalized.get('remain_time', 0)
+        if remain_time_raw > 0:
+            dryer_normalized['remain_time'] = remain_time_raw / 60  # Сохраняем дробную часть для секунд
+
+        # duration всегда приходит в минутах - оставляем как есть
+        # (ничего не делаем, уже в правильном формате)
+        return dryer_normalized
+
+    def _rebuild_status(self, filament_sensor_status):
+        """
+        Пересобрать снимок статуса. Неизменившиеся части переиспользуются,
+        версия увеличивается только если что-то действительно изменилось.
+        Rebuild the status snapshot, reusing unchanged parts; the version only
+        moves when a value actually changed.
+        """
+        old = self._status_snapshot
+        self._status_dirty = False
+
         # Получаем данные о сушилке
         dryer_data = self._info.get('dryer', {}) or self._info.get('dryer_status', {})
-        
-        # Нормализуем время: конвертируем секунды в минуты если нужно
-        if isinstance(dryer_data, dict):
-            dryer_normalized = dryer_data.copy()
-            
-            # remain_time всегда приходит в секундах - конвертируем в минуты
-            remain_time_raw = dryer_normalized.get('remain_time', 0)
-            if remain_time_raw > 0:
-                dryer_normalized['remain_time'] = remain_time_raw / 60  # Сохраняем дробную часть для секунд
-            
-            # duration всегда приходит в минутах - оставляем как есть
-            # (ничего не делаем, уже в правильном формате)
+        if old is not None and dryer_data == self._status_dryer_raw:
+            dryer_normalized = self._status_dryer
         else:
-            dryer_normalized = {}
-        
-        # Получаем статус сенсора филамента, если он настроен
-        filament_sensor_status = None
-        if self.filament_sensor:
-            try:
-                filament_sensor_status = self.filament_sensor.get_status(eventtime)
-            except Exception as e:
-                self.logger.warning(f"Error getting filament sensor status: {str(e)}")
-                filament_sensor_status = {"filament_detected": False, "enabled": False}
-        
-        return {
+            dryer_normalized = self._normalize_dryer(dryer_data)
+            self._status_dryer = dryer_normalized
+            self._status_dryer_raw = dryer_data.copy() if isinstance(dryer_data, dict) else dryer_data
+
+        status = {
             'status': self._info.get('status', 'unknown'),
             'model': self._info.get('model', ''),
             'firmware': self._info.get('firmware', ''),
@@ -617,16 +1387,57 @@ class ValgAce:
             'dryer_status': dryer_normalized,
             'slots': self._info.get('slots', []),
             'filament_sensor': filament_sensor_status,
-            'slot_mapping': self.index_to_slot.copy()  # Отображение индексов в слоты
+            'slot_mapping': self.index_to_slot.copy(),  # Отображение индексов в слоты
+            'last_toolchange': self._last_toolchange,  # Последняя смена инструмента (с seq)
+            'preflight': self._preflight,  # Результат последнего ACE_PREFLIGHT
+            'link': self._link_status,  # Состояние транспорта (пробуждения в секунду)
+            'drying_program': self._drying_program_status(),  # Программа ACE_DRY_PROFILE
         }
-
-    def _calc_crc(self, buffer: bytes) -> int:
+        if self.status_layout != 'nested':
+            self._add_flat_status(status)
+        if old is not None:
+            changed = False
+            for key, value in status.items():
+                old_value = old.get(key, _MISSING)
+                if old_value == value:
+                    status[key] = old_value
+                else:
+                    changed = True
+            if not changed:
+                return old
+        self._status_version += 1
+        status['status_version'] = self._status_version
+        self._status_snapshot = status
+        return status
+
+    def _add_flat_status(self, status):
+        """
+        Плоские ключи статуса: slot_0..slot_3 и dryer_*.
+        Klipper сравнивает статус по ключам верхнего уровня, поэтому изменение
+        одного слота или таймера сушки отправляет подписчикам только этот ключ.
+        Flat status keys. Klipper diffs status by top-level key, so a change in
+        one slot or the drying countdown sends subscribers just that key.
+        """
+        flat_only = self.status_layout == 'flat'
+        slots = status.pop('slots') if flat_only else status['slots']
+        for i in range(4):
+            status[f'slot_{i}'] = slots[i] if i < len(slots) else {}
+        dryer = status['dryer']
+        status['dryer_state'] = dryer.get('status', 'stop')
+        status['dryer_target_temp'] = dryer.get('target_temp', 0)
+        status['dryer_duration'] = dryer.get('duration', 0)
+        status['dryer_remaining'] = dryer.get('remain_time', 0)
+        if flat_only:
+            del status['dryer']
+            del status['dryer_status']
+
+    def _calc_crc(self, buffer: bytes, crc: int = 0xffff) -> int:
         """
         Вычисление CRC для буфера данных
         :param buffer: Байтовый буфер для вычисления CRC
+        :param crc: Начальное значение - CRC предыдущей части буфера, если считаем по частям
         :return: Значение CRC
         """
-        crc = 0xffff
         for byte in buffer:
             data = byte ^ (crc & 0xff)
             data ^= (data & 0x0f) << 4
@@ -645,6 +1456,11 @@ class ValgAce:
                         pass
         request['id'] = self._get_next_request_id()
         self._queue.put((request, callback))
+        if self._writer_idle and self._writer_timer is not None:
+            # Writer спит до следующего запроса статуса - будим сразу
+            # Writer is sleeping until the next status poll; wake it now
+            self._writer_idle = False
+            self.reactor.update_timer(self._writer_timer, self.reactor.NOW)
 
     def _get_next_request_id(self) -> int:
         self._request_id += 1
@@ -652,25 +1468,84 @@ class ValgAce:
             self._request_id = 0
         return self._request_id
 
-    def _send_request(self, request: Dict[str, Any]) -> bool:
+    def _frame_template(self, request: Dict[str, Any]):
+        """
+        Шаблон кадра для запросов вида {"method", ["params"], "id"}: JSON до id
+        кодируется один раз, CRC по нему тоже считается один раз.
+        Template for {"method", ["params"], "id"} requests: the JSON up to the
+        id and its CRC are computed once per method and params.
+        :return: (prefix, prefix_crc) или None, если запрос другой формы
+        """
+        keys = tuple(request)
+        if keys == ('method', 'id'):
+            key = request['method']
+        elif keys == ('method', 'params', 'id') and type(request['params']) is dict:
+            # Тип в ключе: True и 1 равны, но кодируются по-разному
+            key = (request['method'],) + tuple((k, type(v), v) for k, v in request['params'].items())
+        else:
+            return None
+        templates = self._frame_templates
         try:
+            template = templates.get(key)
+        except TypeError:
+            return None  # Нехешируемые параметры (списки, словари)
+        if template is None:
+            head = dict(request)
+            del head['id']
+            prefix = json.dumps(head)[:-1].encode('utf-8') + b', "id": '
+            template = (prefix, self._calc_crc(prefix))
+            if len(templates) >= self.FRAME_TEMPLATE_LIMIT:
+                templates.clear()
+            templates[key] = template
+        return template
+
+    def _build_frame(self, request: Dict[str, Any]) -> bytearray:
+        """
+        Кадр запроса: 0xFF 0xAA, длина, JSON, CRC, 0xFE - в одном bytearray.
+        Для запросов фиксированной формы кодируются и считаются в CRC только
+        цифры id (см. _frame_template); результат совпадает с json.dumps.
+        Request frame assembled in one bytearray; for fixed-shape requests only
+        the id digits are encoded and run through the CRC.
+        """
+        request_id = request.get('id')
+        template = self._frame_template(request) if type(request_id) is int else None
+        if template is not None:
+            prefix, prefix_crc = template
+            tail = b'%d}' % request_id
+            payload_len = len(prefix) + len(tail)
+            crc = self._calc_crc(tail, prefix_crc)
+            frame = bytearray(b'\xff\xaa\x00\x00')
+            frame += prefix
+            frame += tail
+        else:
             payload = json.dumps(request).encode('utf-8')
+            payload_len = len(payload)
+            crc = self._calc_crc(payload)
+            frame = bytearray(b'\xff\xaa\x00\x00')
+            frame += payload
+        frame += b'\x00\x00\xfe'
+        struct.pack_into('<H', frame, 2, payload_len)
+        struct.pack_into('<H', frame, 4 + payload_len, crc)
+        return frame
+
+    def _send_request(self, request: Dict[str, Any]) -> bool:
+        try:
+            packet = self._build_frame(request)
         except Exception as e:
             self.logger.info(f"JSON encoding error: {str(e)}")
             return False
 
-        crc = self._calc_crc(payload)
-        packet = (
-            bytes([0xFF, 0xAA]) +
-            struct.pack('<H', len(payload)) +
-            payload +
-            struct.pack('<H', crc) +
-            bytes([0xFE])
-        )
+        if self._recorder is not None:
+            self._recorder.record(TRACE_TX, packet, self.reactor.monotonic())
 
         try:
             if self._serial and self._serial.is_open:
                 self._serial.write(packet)
+                self._last_tx_time = self.reactor.monotonic()
+                self._inflight[request.get('id')] = (self._last_tx_time, request.get('method'))
+                if self._reader_idle and self._reader_timer is not None:
+                    self._reader_idle = False
+                    self.reactor.update_timer(self._reader_timer, self.reactor.NOW)
                 return True
             else:
                 raise SerialException("Serial port closed")
@@ -680,57 +1555,231 @@ class ValgAce:
             return False
 
     def _reader_loop(self, eventtime):
+        self._count_wakeup(eventtime)
+        self._reader_idle = False
         if not self._connected or not self._serial or not self._serial.is_open:
             return eventtime + 0.01
         try:
-            raw_bytes = self._serial.read(16)
-            if raw_bytes:
-                self.read_buffer.extend(raw_bytes)
-                self._process_messages()
-        except SerialException as e:
+            # Читаем всё, что накопилось в порту: по 16 байт за 10 мс чтение
+            # отставало от кадров статуса (~700 байт несколько раз в секунду)
+            # Drain everything buffered: 16 bytes per 10 ms fell behind the
+            # ~700 byte status frames
+            waiting = self._serial.in_waiting
+            if waiting:
+                raw_bytes = self._serial.read(waiting)
+                if raw_bytes:
+                    self._last_rx_time = eventtime
+                    if self._recorder is not None:
+                        self._recorder.record(TRACE_RX, raw_bytes, eventtime)
+                    self.read_buffer.extend(raw_bytes)
+                    self._process_messages()
+        except (SerialException, OSError) as e:
             self.logger.info(f"Read error: {str(e)}")
             self._reconnect()
+        if self.low_power_idle and not self._reader_busy(eventtime):
+            # Ответов не ждём: спим, _send_request разбудит reader
+            # Nothing outstanding: sleep until _send_request wakes us
+            self._reader_idle = True
+            return eventtime + 1.0
         return eventtime + 0.01
 
+    def _reader_busy(self, eventtime) -> bool:
+        """Ждём ли ответ или остаток кадра / Whether a reply or a partial frame is pending"""
+        if not self._inflight and not self.read_buffer:
+            return False
+        return eventtime - max(self._last_tx_time, self._last_rx_time) < self._response_timeout
+
+    def _status_interval(self) -> float:
+        """Период запроса статуса (heartbeat) / Status poll (heartbeat) period"""
+        if self._park_in_progress:
+            return 0.2
+        return self.drying_status_interval if self._drying else 1.0
+
+    def _count_wakeup(self, eventtime):
+        """Учёт пробуждений reader/writer для link.wakeups_per_sec"""
+        self._wakeup_count += 1
+        elapsed = eventtime - self._wakeup_window_start
+        if elapsed < 10.:
+            return
+        rate = round(self._wakeup_count / elapsed, 1)
+        self._wakeup_count = 0
+        self._wakeup_window_start = eventtime
+        self._set_link_status(wakeups_per_sec=rate)
+
+    def _link_outcome(self, error: bool):
+        """Учесть исход обмена (ответ или ошибка) в окне / Record a link outcome"""
+        outcomes = self._link_outcomes
+        outcomes.append(error)
+        self._link_error_count += error
+        if len(outcomes) > self.LINK_WINDOW:
+            self._link_error_count -= outcomes.popleft()
+
+    def _link_rtt_sample(self, rtt: float):
+        if self._link_rtt is None:
+            self._link_rtt = rtt
+        else:
+            self._link_rtt += self.LINK_RTT_ALPHA * (rtt - self._link_rtt)
+        self._link_outcome(False)
+
+    def _link_health(self) -> int:
+        """
+        Оценка связи 0..100: доля успешных обменов, умноженная на запас по
+        задержке (RTT до четверти response_timeout - полный, у таймаута - ноль).
+        Link score 0..100: success ratio times latency headroom (full up to a
+        quarter of response_timeout, zero at the timeout).
+        """
+        samples = len(self._link_outcomes)
+        if not samples:
+            return 100
+        success = 1. - self._link_error_count / samples
+        latency = 1.
+        if self._link_rtt is not None:
+            good = self._response_timeout / 4.
+            latency = (self._response_timeout - self._link_rtt) / (self._response_timeout - good)
+            latency = min(1., max(0., latency))
+        return int(round(100. * success * latency))
+
+    def _toolchange_running(self) -> bool:
+        """
+        Идёт ли смена инструмента. Запись закрывается в cmd_ACE_CHANGE_TOOL
+        (try/finally); если она всё же осталась дольше разумного, не держим из-за
+        неё сторожевой таймер и планировщик сушки.
+        Whether a tool change is running; a record older than any real change
+        no longer blocks the link watchdog and the drying scheduler.
+        """
+        record = self._toolchange
+        if record is None:
+            return False
+        age = self.reactor.monotonic() - record['start']
+        if age <= self.max_parking_timeout + self.TOOLCHANGE_STALE_MARGIN:
+            return True
+        if not record.get('stale'):
+            record['stale'] = True
+            self.logger.warning(f"Tool change {record['from']} -> {record['to']} still open after {age:.0f}s, "
+                                f"no longer treated as running")
+        return False
+
+    def _link_safe_point(self) -> bool:
+        """Можно ли переподключаться: ни парковки, ни смены, ни движения филамента"""
+        return (not self._park_in_progress and not self._toolchange_running()
+                and not self.ins_spool_work and not self._post_toolchange_running
+                and self._info.get('status') != 'busy')
+
+    def _check_link_health(self, eventtime):
+        """
+        Вызывается из writer на каждом запросе статуса: запросы без ответа
+        дольше response_timeout считаются ошибками, при стойком падении оценки связь переподключается,
+        но только в безопасной точке.
+        Called from the writer once per status poll: overdue replies count as
+        errors, and a persistently low score triggers a reconnect, only at a
+        safe point.
+        """
+        timeout = self._response_timeout
+        overdue = [rid for rid, sent in self._inflight.items() if eventtime - sent[0] > timeout]
+        for rid in overdue:
+            del self._inflight[rid]
+            self._link_outcome(True)
+        health = self._link_health()
+        judged = len(self._link_outcomes) >= self.LINK_MIN_SAMPLES
+        degraded = judged and health < self.link_health_threshold
+        rtt_ms = int(round(self._link_rtt * 100)) * 10 if self._link_rtt is not None else 0
+        if degraded and self._link_degraded_since is None:
+            self._link_degraded_since = eventtime
+            self.logger.warning(f"ACE link degraded: health {health}, RTT {rtt_ms} ms, "
+                                f"{self._link_error_count}/{len(self._link_outcomes)} errors")
+            self._trace_event(f"link_degraded health={health} rtt_ms={rtt_ms}")
+        elif not degraded:
+            self._link_degraded_since = None
+        self._set_link_status(health=health - health % 5, rtt_ms=rtt_ms, degraded=degraded)
+        if (degraded and self.link_watchdog
+                and eventtime - self._link_degraded_since >= self.LINK_DEGRADED_HOLD
+                and eventtime - self._link_last_restart >= self.LINK_RESTART_COOLDOWN
+                and self._link_safe_point()):
+            self._link_last_restart = eventtime
+            self.logger.info(f"Link watchdog: reconnecting (health {health})")
+            self.gcode.respond_info(f"ACE: Link degraded (health {health}), reconnecting")
+            self._trace_event(f"link_restart health={health}")
+            self._reset_link_stats()
+            self._restart_link()
+
+    def _reset_link_stats(self):
+        self._inflight.clear()
+        self._link_outcomes.clear()
+        self._link_error_count = 0
+        self._link_rtt = None
+        self._link_degraded_since = None
+
+    def _set_link_status(self, **fields):
+        """Обновить link в статусе новым dict (снимок не меняется на месте)"""
+        if any(self._link_status.get(k) != v for k, v in fields.items()):
+            self._link_status = dict(self._link_status, **fields)
+            self._status_dirty = True
+
     def _process_messages(self):
-        incomplete_message_count = 0
-        max_incomplete_messages_before_reset = 10
-        while self.read_buffer:
-            end_idx = self.read_buffer.find(b'\xfe')
-            if end_idx == -1:
+        """
+        Разбор кадров по полю длины: байт 0xFE встречается и внутри CRC,
+        поэтому деление буфера по 0xFE теряло такие кадры.
+        Frames are cut by their length field; 0xFE also occurs inside the
+        CRC, so splitting the buffer on it dropped those frames.
+        """
+        buf = self.read_buffer
+        pos = 0
+        bad_frame_count = 0
+        max_bad_frames_before_reset = 10
+        while True:
+            start = buf.find(b'\xff\xaa', pos)
+            if start == -1:
+                # Последний 0xFF может оказаться началом следующего заголовка
+                pos = len(buf) - 1 if buf.endswith(b'\xff') else len(buf)
                 break
-            msg = self.read_buffer[:end_idx+1]
-            self.read_buffer = self.read_buffer[end_idx+1:]
-            if len(msg) < 7 or msg[0:2] != bytes([0xFF, 0xAA]):
-                continue
-            payload_len = struct.unpack('<H', msg[2:4])[0]
-            expected_length = 4 + payload_len + 3
-            if len(msg) < expected_length:
-                self.logger.info(f"Incomplete message received (expected {expected_length}, got {len(msg)})")
-                incomplete_message_count += 1
-                if incomplete_message_count > max_incomplete_messages_before_reset:
-                    self.logger.info("Too many incomplete messages, resetting connection")
+            if start + 4 > len(buf):
+                pos = start
+                break
+            payload_len = struct.unpack_from('<H', buf, start + 2)[0]
+            end = start + 4 + payload_len + 3
+            if payload_len <= self.MAX_FRAME_PAYLOAD and end > len(buf):
+                # Кадр ещё не дочитан / wait for the rest of the frame
+                pos = start
+                break
+            if payload_len > self.MAX_FRAME_PAYLOAD or buf[end - 1] != 0xFE:
+                self.logger.info(f"Malformed frame header (length {payload_len}), resyncing")
+                self._link_outcome(True)
+                bad_frame_count += 1
+                if bad_frame_count > max_bad_frames_before_reset:
+                    self.logger.info("Too many malformed frames, resetting connection")
+                    del buf[:]
                     self._reset_connection()
-                    incomplete_message_count = 0
+                    return
+                pos = start + 1
                 continue
-            incomplete_message_count = 0
-            payload = msg[4:4+payload_len]
-            crc = struct.unpack('<H', msg[4+payload_len:4+payload_len+2])[0]
+            pos = end
+            payload = bytes(buf[start + 4:start + 4 + payload_len])
+            crc = struct.unpack_from('<H', buf, start + 4 + payload_len)[0]
             if crc != self._calc_crc(payload):
-                return
+                self.logger.info(f"CRC mismatch, dropping {end - start} byte frame")
+                self._link_outcome(True)
+                continue
             try:
                 response = json.loads(payload.decode('utf-8'))
                 self._handle_response(response)
             except json.JSONDecodeError as je:
-                self.logger.info(f"JSON decode error: {str(je)} Data: {msg}")
+                self.logger.info(f"JSON decode error: {str(je)} Data: {payload}")
             except Exception as e:
-                self.logger.info(f"Message processing error: {str(e)} Data: {msg}")
+                self.logger.info(f"Message processing error: {str(e)} Data: {payload}")
+        if pos:
+            del buf[:pos]
 
     def _writer_loop(self, eventtime):
+        self._count_wakeup(eventtime)
+        self._writer_idle = False
         if not self._connected:
             return eventtime + 0.05
         now = eventtime
-        if now - self._last_status_request > (0.2 if self._park_in_progress else 1.0):
+        if now - self._last_status_request >= self._status_interval():
+            self._check_link_health(now)
+            if not self._connected:
+                # Сторожевой таймер переподключил связь / the watchdog restarted the link
+                return self.reactor.NEVER
             self._request_status()
             self._last_status_request = now
         if not self._queue.empty():
@@ -741,23 +1790,33 @@ class ValgAce:
                 if not self._send_request(request):
                     self.logger.info("Failed to send request, requeuing...")
                     self._queue.put(task)
-        return eventtime + 0.05
+        if not self.low_power_idle or not self._queue.empty():
+            return eventtime + 0.05
+        # Очередь пуста: спим до следующего запроса статуса, send_request разбудит раньше
+        # Queue is empty: sleep until the next status poll unless send_request wakes us
+        self._writer_idle = True
+        return max(self._last_status_request + self._status_interval(), eventtime + 0.05)
 
     def _request_status(self):
         def status_callback(response):
             if 'result' in response:
                 self._info.update(response['result'])
-        if self.reactor.monotonic() - self._last_status_request > (0.2 if self._park_in_progress else 1.0):
+        if self.reactor.monotonic() - self._last_status_request >= self._status_interval():
             try:
-                self.send_request({
-                    "id": self._get_next_request_id(),
-                    "method": "get_status"
-                }, status_callback)
+                self.send_request({"method": "get_status"}, status_callback)
                 self._last_status_request = self.reactor.monotonic()
             except Exception as e:
                 self.logger.info(f"Status request error: {str(e)}")
 
     def _handle_response(self, response: dict):
+        if self._inflight:
+            sent = self._inflight.pop(response.get('id'), None)
+            if sent is not None:
+                if sent[1] == 'get_status':
+                    # RTT считаем только по запросам статуса (heartbeat)
+                    self._link_rtt_sample(self.reactor.monotonic() - sent[0])
+                else:
+                    self._link_outcome(False)
         if 'id' in response:
             callback = self._callback_map.pop(response['id'], None)
             if callback:
@@ -768,18 +1827,22 @@ class ValgAce:
         if 'result' in response and isinstance(response['result'], dict):
             result = response['result']
             
-            # ОТЛАДКА: Выводим сырой JSON для всех ответов со статусом
-            # Проверяем наличие данных о сушилке как признак ответа на get_status
-            if 'dryer' in result or 'dryer_status' in result or 'slots' in result:
-#                self.logger.info(f"RAW JSON response from device (get_status): {json.dumps(response, indent=2)}")
-                if 'dryer' in result or 'dryer_status' in result:
-                    dryer_data = result.get('dryer') or result.get('dryer_status', {})
-#                    self.logger.info(f"RAW dryer data: {json.dumps(dryer_data, indent=2)}")
+            # Наличие данных о сушилке или слотах - признак ответа на get_status
+            # Dryer or slot data marks a get_status reply
+            status_frame = 'dryer' in result or 'dryer_status' in result or 'slots' in result
             
             # Нормализация данных о сушилке: если приходит dryer_status, сохраняем также как dryer
             if 'dryer_status' in result and isinstance(result['dryer_status'], dict):
                 result['dryer'] = result['dryer_status']
             self._info.update(result)
+            self._status_dirty = True
+
+            if status_frame:
+                dryer = self._info.get('dryer')
+                self._drying = isinstance(dryer, dict) and dryer.get('status') == 'drying'
+                # Подписчики (temperature_ace) получают время чтения кадра, без своего опроса
+                # Subscribers (temperature_ace) get the frame's read time instead of polling
+                self.printer.send_event('ace:status_frame', self._last_rx_time, self._info, self._name)
             
             # Infinity Spool Auto-trigger: проверка empty статуса при печати
             # ВАЖНО: Не запускать мониторинг если уже идёт смена слота (ins_spool_work=True)
@@ -793,15 +1856,18 @@ class ValgAce:
                 current_assist_count = result.get('feed_assist_count', 0)
                 elapsed_time = self.reactor.monotonic() - self._park_start_time
 
-                # Определяем режим парковки
-                parking_mode = "sensor" if self._sensor_parking_active else ("traditional" if self._sensor_parking_completed else "normal")
-                self.logger.debug(f"Parking check ({parking_mode}): slot {self._park_index}, count={current_assist_count}, " +
-                                f"last={self._last_assist_count}, hits={self._assist_hit_count}, elapsed={elapsed_time:.1f}s")
+                # Кадр статуса приходит 5 раз в секунду: запись только при DEBUG и с прореживанием
+                # Status frames arrive 5 times a second: log only at DEBUG, sampled
+                if self._events.debug:
+                    parking_mode = "sensor" if self._sensor_parking_active else ("traditional" if self._sensor_parking_completed else "normal")
+                    self._events.event(logging.DEBUG, 'park_check', sampled=True, mode=parking_mode,
+                                       slot=self._park_index, count=current_assist_count,
+                                       last=self._last_assist_count, hits=self._assist_hit_count,
+                                       elapsed=round(elapsed_time, 1))
                 
                 # Skip count monitoring during sensor-based parking - it has its own timer
                 # Sensor-based parking is managed by _monitor_filament_sensor_for_parking()
                 if self._sensor_parking_active:
-                    self.logger.debug(f"Skipping count check during sensor-based parking for slot {self._park_index}")
                     return
                 
                 if current_status == 'ready':
@@ -811,7 +1877,8 @@ class ValgAce:
                         # Mark that count has increased at least once
                         if current_assist_count > 0:
                             self._park_count_increased = True
-                            self.logger.info(f"Feed assist working for slot {self._park_index}, count: {current_assist_count}")
+                            self._events.event(logging.INFO, 'park_assist_working', sampled=True,
+                                               slot=self._park_index, count=current_assist_count)
                     else:
                         self._assist_hit_count += 1
 
@@ -820,6 +1887,7 @@ class ValgAce:
                         if not self._sensor_parking_active and elapsed_time > 3.0 and not self._park_count_increased:
                             # 3 seconds passed and count never increased - feed assist not working
                             self.logger.error(f"Feed assist for slot {self._park_index} not working - count stayed at {current_assist_count}")
+                            self._trace_event(f"park_error slot={self._park_index} reason=assist_not_working")
                             self._park_error = True  # Mark as error BEFORE resetting flag
                             self._park_in_progress = False
                             self._park_index = -1
@@ -835,6 +1903,7 @@ class ValgAce:
                             else:
                                 self.logger.warning(f"Parking check completed but count never increased (stayed at {current_assist_count})")
                                 # Mark as error and abort
+                                self._trace_event(f"park_error slot={self._park_index} reason=count_never_increased")
                                 self._park_error = True
                                 self._park_in_progress = False
                                 # Сбрасываем флаги сенсорной парковки
@@ -851,6 +1920,7 @@ class ValgAce:
         if not self._park_in_progress:
             return
         self.logger.info(f"Parking completed for slot {self._park_index}")
+        self._trace_event(f"park_complete slot={self._park_index}")
         
         # Останавливаем feed assist для указанного слота
         def stop_feed_assist_callback(response):
@@ -885,7 +1955,9 @@ class ValgAce:
         # Сбрасываем флаги сенсорной парковки
         self._sensor_parking_active = False
         self._sensor_parking_completed = False
-        # Очищаем ссылки на таймеры для предотвращения утечек
+        # Отменяем таймеры мониторинга парковки
+        # Cancel parking monitor timers
+        self._scheduler.unregister_timer(self._sensor_monitor_timer)
         self._park_monitor_timer = None
         self._sensor_monitor_timer = None
         if self.disable_assist_after_toolchange:
@@ -910,7 +1982,7 @@ class ValgAce:
                     self.logger.error(f"Error in dwell callback: {e}")
             return self.reactor.NEVER
         
-        self.reactor.register_timer(timer_handler, self.reactor.monotonic() + delay)
+        self._scheduler.register_timer(timer_handler, self.reactor.monotonic() + delay)
 
 
     def _get_printer_state(self):
@@ -935,71 +2007,49 @@ class ValgAce:
 
     def _notify_connection_lost(self):
         """Уведомить пользователя о потере связи и вызвать паузу при печати"""
-        self.gcode.respond_raw("ACE: CRITICAL - Connection lost after maximum attempts")
+        self._trace_event("connection_lost")
+        self.gcode.respond_raw("ACE: CRITICAL - Connection lost after maximum attempts, still retrying")
         self._pause_print_if_needed()
 
     def _reconnect(self):
-        # Проверяем, не достигнут ли лимит попыток
-        if self._connection_lost:
-            return  # Уже превышен лимит, не пытаемся подключиться
-        
-        self._reconnect_attempts += 1
-        
-        if self._reconnect_attempts > self._max_reconnect_attempts:
-            # Превышен лимит попыток
-            self._connection_lost = True
-            self._notify_connection_lost()
-            return
-        
-        # Уведомляем о попытке переподключения
-        self.logger.info(f"Attempting to reconnect to ACE (attempt {self._reconnect_attempts}/{self._max_reconnect_attempts})")
-        
-        # During automatic reconnect, reset the manually disconnected flag
-        self._manually_disconnected = False
-        self._disconnect()
-        self.dwell(1.0, lambda: None)
-        self._connect()
+        """Связь потеряна: закрыть порт и переподключаться в фоне / Link lost, retry in the background"""
+        self.logger.info(f"Attempting to reconnect to ACE (attempt {self._reconnect_attempts + 1})")
+        self._trace_event(f"reconnect attempt={self._reconnect_attempts + 1}")
+        self._restart_link()
 
     def _reset_connection(self):
-        # Во время сброса соединения также проверяем лимит попыток
-        if self._connection_lost:
-            return  # Уже превышен лимит
-        
-        self._reconnect_attempts += 1
-        
-        if self._reconnect_attempts > self._max_reconnect_attempts:
-            # Превышен лимит попыток
-            self._connection_lost = True
-            self._notify_connection_lost()
-            return
-        
-        self.logger.info(f"Resetting ACE connection (attempt {self._reconnect_attempts}/{self._max_reconnect_attempts})")
-        
-        # During connection reset, reset the manually disconnected flag
+        self.logger.info(f"Resetting ACE connection (attempt {self._reconnect_attempts + 1})")
+        self._trace_event(f"reset_connection attempt={self._reconnect_attempts + 1}")
+        self._restart_link()
+
+    def _restart_link(self):
+        # During automatic reconnect, reset the manually disconnected flag
         self._manually_disconnected = False
+        self._reconnecting = True
         self._disconnect()
-        self.dwell(1.0, lambda: None)
-        self._connect()
+        self._set_link_status(state='connecting')
+        # Первая попытка - через reconnect_delay_min, дальше backoff в _connect_check
+        # First attempt after reconnect_delay_min, then backoff in _connect_check
+        self._schedule_connect(self.reconnect_delay_min)
 
     def cmd_ACE_STATUS(self, gcmd):
         try:
             # Запрашиваем свежий статус перед выводом
             # Request fresh status before output
             def status_callback(response):
-                # ОТЛАДКА: Выводим сырой JSON ответа
-                self.logger.info(f"RAW JSON response in ACE_STATUS callback: {json.dumps(response, indent=2)}")
+                # ОТЛАДКА: сырой JSON ответа, только при ACE_LOG LEVEL=DEBUG
+                # Raw response dump, only at ACE_LOG LEVEL=DEBUG
+                if self._events.debug:
+                    self.logger.debug(f"RAW JSON response in ACE_STATUS callback: {json.dumps(response)}")
                 
                 if 'result' in response:
                     result = response['result']
-                    # ОТЛАДКА: Выводим данные о сушилке
-                    if 'dryer' in result or 'dryer_status' in result:
-                        dryer_data = result.get('dryer') or result.get('dryer_status', {})
-                        self.logger.info(f"RAW dryer data in callback: {json.dumps(dryer_data, indent=2)}")
                     
                     # ��ормализация данных о сушилке
                     if 'dryer_status' in result and isinstance(result['dryer_status'], dict):
                         result['dryer'] = result['dryer_status']
                     self._info.update(result)
+                    self._status_dirty = True
                     # Выводим статус после обновления
                     self._output_status(gcmd)
             
@@ -1190,6 +2240,107 @@ class ValgAce:
             self.logger.info(f"Filament info error: {str(e)}")
             self.gcode.respond_info('Error: ' + str(e))
  
+    def cmd_ACE_PREFLIGHT(self, gcmd):
+        """
+        Проверка перед печатью: один свежий статус устройства, все проблемы
+        выбранных инструментов сообщаются сразу.
+        Pre-print check: one fresh status, every problem reported at once.
+
+        Параметры / Parameters:
+          TOOLS   - инструменты печати через запятую (индексы Klipper), например 0,2,3
+          ON_FAIL - report (по умолчанию) / pause (вызвать макрос паузы) /
+                    error (ошибка G-code - прерывает вызвавший макрос и печать)
+        """
+        tools_str = gcmd.get('TOOLS')
+        on_fail = gcmd.get('ON_FAIL', 'report').lower()
+        if on_fail not in ('report', 'pause', 'error'):
+            gcmd.respond_raw("ACE Error: ON_FAIL must be report, pause or error")
+            return
+        tools = []
+        for item in tools_str.replace(' ', '').split(','):
+            if not item:
+                continue
+            try:
+                tool = int(item)
+            except ValueError:
+                tool = -1
+            if not 0 <= tool <= 3:
+                gcmd.respond_raw(f"ACE Error: Invalid tool '{item}' in TOOLS (expected 0-3)")
+                return
+            if tool not in tools:
+                tools.append(tool)
+
+        problems = []
+        status = self._preflight_status(problems)
+        if status is not None:
+            device_status = status.get('status', 'unknown')
+            if device_status not in ('ready', 'busy'):
+                problems.append(f"ACE status is '{device_status}'")
+            dryer = status.get('dryer') or status.get('dryer_status') or {}
+            if isinstance(dryer, dict) and dryer.get('status') == 'drying':
+                remain = self._normalize_dryer(dryer).get('remain_time', 0)
+                problems.append(f"Dryer is running ({dryer.get('target_temp', 0)}°C, "
+                                f"{int(remain)} min left)")
+            slots = status.get('slots') or []
+            used_by = {}
+            for tool in tools:
+                slot = self._get_real_slot(tool)
+                if not 0 <= slot <= 3:
+                    problems.append(f"T{tool}: mapped to invalid slot {slot}")
+                    continue
+                if slot in used_by:
+                    problems.append(f"T{tool}: slot {slot} is also mapped to T{used_by[slot]}")
+                used_by.setdefault(slot, tool)
+                slot_info = slots[slot] if slot < len(slots) and isinstance(slots[slot], dict) else {}
+                slot_status = slot_info.get('status', 'unknown')
+                if slot_status != 'ready':
+                    problems.append(f"T{tool}: slot {slot} is {slot_status}")
+
+        ok = not problems
+        self._preflight = {
+            'ok': ok,
+            'tools': tools,
+            'problems': problems,
+            'time': time.time(),
+        }
+        self._status_dirty = True
+        self._trace_event(f"preflight tools={','.join(map(str, tools))} problems={len(problems)}")
+
+        if ok:
+            mapped = ', '.join(f"T{t}->slot {self._get_real_slot(t)}" for t in tools)
+            gcmd.respond_info(f"ACE preflight OK: {mapped}")
+            return
+        report = "\n".join(f"  - {p}" for p in problems)
+        gcmd.respond_raw(f"ACE Error: Preflight found {len(problems)} problem(s):\n{report}")
+        if on_fail == 'pause':
+            self._pause_print_if_needed()
+        elif on_fail == 'error':
+            raise gcmd.error(f"ACE preflight failed: {'; '.join(problems)}")
+
+    def _preflight_status(self, problems):
+        """Запросить свежий статус и дождаться ответа (до 3 с)"""
+        if not self._connected:
+            problems.append("ACE is not connected")
+            return None
+        reply = {}
+
+        def callback(response):
+            reply['response'] = response
+
+        self.send_request({"method": "get_status"}, callback)
+        timeout = self.reactor.monotonic() + 3.0
+        while 'response' not in reply:
+            if self.reactor.monotonic() > timeout or not self.toolhead:
+                problems.append("No status response from ACE")
+                return None
+            self.toolhead.dwell(0.1)
+        response = reply['response']
+        result = response.get('result')
+        if response.get('code', 0) != 0 or not isinstance(result, dict):
+            problems.append(f"Status request failed: {response.get('msg', 'no result')}")
+            return None
+        return result
+
     def cmd_ACE_CHECK_FILAMENT_SENSOR(self, gcmd):
         """Command to check the filament sensor status"""
         if self.filament_sensor:
@@ -1214,6 +2365,9 @@ class ValgAce:
     def cmd_ACE_START_DRYING(self, gcmd):
          temperature = gcmd.get_int('TEMP', minval=20, maxval=self.max_dryer_temperature)
          duration = gcmd.get_int('DURATION', 240, minval=1)
+         # Ручной запуск заменяет программу / a manual start replaces the program
+         if self._dry_cancel("manual"):
+             gcmd.respond_info("ACE: Drying program cancelled")
          def callback(response):
              if response.get('code', 0) != 0:
                  gcmd.respond_raw(f"ACE Error: {response.get('msg', 'Unknown error')}")
@@ -1229,12 +2383,245 @@ class ValgAce:
          }, callback)
  
     def cmd_ACE_STOP_DRYING(self, gcmd):
+        if self._dry_cancel("manual"):
+            gcmd.respond_info("ACE: Drying program cancelled")
         def callback(response):
             if response.get('code', 0) != 0:
                 gcmd.respond_raw(f"ACE Error: {response.get('msg', 'Unknown error')}")
             else:
                 gcmd.respond_info("Drying stopped")
         self.send_request({"method": "drying_stop"}, callback)
+
+    def _parse_drying_profile(self, option: str, value: str) -> list:
+        """'45:20, 60:240, 35:15' -> [(45, 20), (60, 240), (35, 15)]"""
+        stages = []
+        for item in value.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            try:
+                temp_str, minutes_str = item.split(':')
+                temp, minutes = int(temp_str), int(minutes_str)
+            except ValueError:
+                raise self.printer.config_error(f"{option}: stage '{item}' must be <temp>:<minutes>")
+            if not 20 <= temp <= self.max_dryer_temperature:
+                raise self.printer.config_error(
+                    f"{option}: {temp}°C is outside 20-{self.max_dryer_temperature}°C (max_dryer_temperature)")
+            if not 1 <= minutes <= 240:
+                raise self.printer.config_error(f"{option}: stage '{item}' must last 1-240 minutes")
+            stages.append((temp, minutes))
+        if not stages:
+            raise self.printer.config_error(f"{option}: no stages")
+        return stages
+
+    def _drying_profile_for(self, material: str) -> Optional[str]:
+        """Профиль для типа филамента: 'PLA+' и 'PLA Silk' используют PLA, если нет своего"""
+        name = material.strip().upper()
+        if name in self.drying_profiles:
+            return name
+        base = name.split(' ')[0].rstrip('+') if name else ''
+        return base if base in self.drying_profiles else None
+
+    def _drying_program_status(self):
+        program = self._dry_program
+        if program is None:
+            return None
+        return {
+            'profile': program['profile'],
+            'state': program['state'],
+            'reason': program['reason'],
+            'stage': program['stage'],
+            'stages': [list(stage) for stage in program['stages']],
+            'wait_idle': program['wait_idle'],
+        }
+
+    def cmd_ACE_DRY_PROFILE(self, gcmd):
+        """
+        Запланировать многоступенчатую программу сушки.
+        Schedule a multi-stage drying program.
+
+        Параметры / Parameters:
+          PROFILE - имя профиля (drying_profile_<имя>); по умолчанию по типам филамента
+                    в слотах - самый мягкий из подходящих профилей, сушилка общая
+          WHEN    - idle (по умолчанию): только пока принтер простаивает, с паузой на
+                    время печати; now: сразу и без пауз
+        """
+        if self._dry_program is not None:
+            gcmd.respond_raw(f"ACE Error: Drying program '{self._dry_program['profile']}' is already "
+                             f"scheduled, use ACE_DRY_CANCEL first")
+            return
+        if not self.drying_profiles:
+            gcmd.respond_raw("ACE Error: No drying_profile_<name> options in [ace]")
+            return
+        when = gcmd.get('WHEN', 'idle').lower()
+        if when not in ('idle', 'now'):
+            gcmd.respond_raw("ACE Error: WHEN must be idle or now")
+            return
+        profile = gcmd.get('PROFILE', None)
+        if profile is not None:
+            profile = profile.upper()
+            if profile not in self.drying_profiles:
+                gcmd.respond_raw(f"ACE Error: Unknown drying profile '{profile}' "
+                                 f"(available: {', '.join(sorted(self.drying_profiles))})")
+                return
+        else:
+            # Сушилка одна на все слоты: берём профиль с самой низкой температурой,
+            # чтобы не перегреть самый чувствительный филамент
+            # One dryer for all slots: pick the profile with the lowest peak
+            # temperature so the most sensitive filament is not overheated
+            candidates = set()
+            for slot in self._info.get('slots', []):
+                if isinstance(slot, dict) and slot.get('status') == 'ready' and slot.get('type'):
+                    name = self._drying_profile_for(slot['type'])
+                    if name is not None:
+                        candidates.add(name)
+            if not candidates:
+                gcmd.respond_raw(f"ACE Error: No drying profile matches the loaded filament, "
+                                 f"use PROFILE= ({', '.join(sorted(self.drying_profiles))})")
+                return
+            profile = min(sorted(candidates), key=lambda n: max(t for t, _ in self.drying_profiles[n]))
+
+        stages = self.drying_profiles[profile]
+        self._dry_program = {
+            'profile': profile,
+            'stages': stages,
+            'stage': 0,
+            'remaining': stages[0][1] * 60.,
+            'stage_end': 0.,
+            'state': 'waiting',
+            'reason': 'idle' if when == 'idle' else '',
+            'wait_idle': when == 'idle',
+        }
+        self._dry_idle_since = None
+        self._status_dirty = True
+        self._events.event(logging.INFO, 'dry_scheduled', trace=True, profile=profile, when=when)
+        self._dry_timer = self._scheduler.register_timer(self._dry_check, self.reactor.NOW)
+        plan = ', '.join(f"{t}°C {m} min" for t, m in stages)
+        gcmd.respond_info(f"ACE: Drying program {profile} scheduled ({plan}), "
+                          f"{'starts when the printer is idle' if when == 'idle' else 'starting now'}")
+
+    def cmd_ACE_DRY_SCHEDULE_STATUS(self, gcmd):
+        """Профили сушки и состояние программы / Drying profiles and program state"""
+        output = ["Drying profiles:"]
+        for name in sorted(self.drying_profiles):
+            stages = ', '.join(f"{t}°C {m} min" for t, m in self.drying_profiles[name])
+            output.append(f"  {name}: {stages}")
+        if not self.drying_profiles:
+            output.append("  (none, add drying_profile_<name> to [ace])")
+        program = self._dry_program
+        if program is None:
+            output.append("Program: none")
+        else:
+            temp, minutes = program['stages'][program['stage']]
+            remaining = program['remaining']
+            if program['state'] == 'running':
+                remaining = max(0., program['stage_end'] - self.reactor.monotonic())
+            line = (f"Program: {program['profile']} {program['state']}"
+                    f"{' (' + program['reason'] + ')' if program['state'] != 'running' and program['reason'] else ''}, "
+                    f"stage {program['stage'] + 1}/{len(program['stages'])} at {temp}°C, "
+                    f"{remaining / 60.:.1f} of {minutes} min left")
+            output.append(line)
+        gcmd.respond_info("\n".join(output))
+
+    def cmd_ACE_DRY_CANCEL(self, gcmd):
+        """Отменить программу сушки и выключить сушилку / Cancel the program and stop the dryer"""
+        if self._dry_cancel("cancelled"):
+            gcmd.respond_info("ACE: Drying program cancelled")
+        else:
+            gcmd.respond_info("ACE: No drying program scheduled")
+
+    def _dry_cancel(self, reason: str) -> bool:
+        program = self._dry_program
+        if program is None:
+            return False
+        self._scheduler.unregister_timer(self._dry_timer)
+        self._dry_timer = None
+        self._dry_program = None
+        self._status_dirty = True
+        self._events.event(logging.INFO, 'dry_cancel', trace=True, profile=program['profile'], reason=reason)
+        if program['state'] == 'running' and reason != 'manual' and self._connected:
+            self.send_request({"method": "drying_stop"}, lambda response: None)
+        return True
+
+    def _dry_printer_idle(self, eventtime) -> bool:
+        """Принтер простаивает не меньше drying_idle_delay / Idle for drying_idle_delay"""
+        busy = (self._get_printer_state() in ('printing', 'paused')
+                or self._toolchange_running() or self._park_in_progress)
+        if busy:
+            self._dry_idle_since = None
+            return False
+        if self._dry_idle_since is None:
+            self._dry_idle_since = eventtime
+        return eventtime - self._dry_idle_since >= self.drying_idle_delay
+
+    def _dry_check(self, eventtime):
+        """
+        Шаг программы сушки: старт ступени в простое, пауза на печать и потерю
+        связи с сохранением остатка ступени, переход к следующей ступени.
+        Drying program step: start a stage while idle, pause for prints and lost
+        links keeping the stage remainder, advance to the next stage.
+        """
+        program = self._dry_program
+        if program is None:
+            return self.reactor.NEVER
+        idle = self._dry_printer_idle(eventtime) if program['wait_idle'] else True
+
+        if program['state'] == 'running':
+            if not self._connected:
+                self._dry_pause(program, eventtime, 'disconnected')
+            elif not idle:
+                self._dry_pause(program, eventtime, 'printing')
+                self.send_request({"method": "drying_stop"}, lambda response: None)
+            elif eventtime >= program['stage_end']:
+                if program['stage'] + 1 >= len(program['stages']):
+                    self._events.event(logging.INFO, 'dry_done', trace=True, profile=program['profile'])
+                    self.gcode.respond_info(f"ACE: Drying program {program['profile']} finished")
+                    self.send_request({"method": "drying_stop"}, lambda response: None)
+                    self._dry_program = None
+                    self._dry_timer = None
+                    self._status_dirty = True
+                    return self.reactor.NEVER
+                program['stage'] += 1
+                program['remaining'] = program['stages'][program['stage']][1] * 60.
+                self._dry_start_stage(program, eventtime)
+            return eventtime + self.DRY_CHECK_INTERVAL
+
+        # waiting / paused
+        if self._connected and idle:
+            self._dry_start_stage(program, eventtime)
+        return eventtime + self.DRY_CHECK_INTERVAL
+
+    def _dry_start_stage(self, program, eventtime):
+        temp = min(program['stages'][program['stage']][0], self.max_dryer_temperature)
+        # Устройство считает в минутах; точный конец ступени отслеживаем сами
+        # The device counts whole minutes; the exact stage end is tracked here
+        minutes = max(1, math.ceil(program['remaining'] / 60.))
+        profile = program['profile']
+
+        def callback(response):
+            if response.get('code', 0) != 0:
+                self.logger.warning(f"Drying program {profile}: device rejected stage: "
+                                    f"{response.get('msg', 'Unknown error')}")
+
+        self.send_request({
+            "method": "drying",
+            "params": {"temp": temp, "fan_speed": 7000, "duration": minutes}
+        }, callback)
+        program['state'] = 'running'
+        program['reason'] = ''
+        program['stage_end'] = eventtime + program['remaining']
+        self._status_dirty = True
+        self._events.event(logging.INFO, 'dry_stage', trace=True, profile=profile,
+                           stage=program['stage'] + 1, temp=temp, minutes=minutes)
+
+    def _dry_pause(self, program, eventtime, reason: str):
+        program['remaining'] = max(0., program['stage_end'] - eventtime)
+        program['state'] = 'paused'
+        program['reason'] = reason
+        self._status_dirty = True
+        self._events.event(logging.INFO, 'dry_pause', trace=True, profile=program['profile'],
+                           stage=program['stage'] + 1, reason=reason,
+                           remaining_min=round(program['remaining'] / 60., 1))
  
     def cmd_ACE_ENABLE_FEED_ASSIST(self, gcmd):
         index = gcmd.get_int('INDEX', minval=0, maxval=3)
@@ -1446,6 +2833,7 @@ class ValgAce:
             if response.get('code', 0) != 0:
                 self.logger.error(f"Error starting feed for distance-based parking: {response.get('msg', 'Unknown error')}")
                 self._park_in_progress = False
+                self._trace_event(f"park_error slot={index} reason=feed_start_failed")
                 self._park_error = True
                 self._sensor_parking_active = False
                 return
@@ -1491,6 +2879,7 @@ class ValgAce:
         if elapsed > max_wait_time:
             self.logger.error(f"Distance-based parking timeout for slot {index} after {elapsed:.1f}s")
             self._park_in_progress = False
+            self._trace_event(f"park_error slot={index} reason=distance_timeout")
             self._park_error = True
             self._sensor_parking_active = False
             self._sensor_parking_completed = False
@@ -1498,7 +2887,7 @@ class ValgAce:
             return
         
         # Continue polling
-        self.logger.debug(f"Slot {index} not ready yet (status: {slot_status}), waiting...")
+        self._events.event(logging.DEBUG, 'park_wait_ready', sampled=True, slot=index, status=slot_status)
         self.dwell(0.5, lambda: self._check_slot_status_for_parking(index))
 
     def _sensor_based_parking(self, index: int):
@@ -1531,6 +2920,7 @@ class ValgAce:
             if response.get('code', 0) != 0:
                 self.logger.error(f"Error starting feed for sensor-based parking: {response.get('msg', 'Unknown error')}")
                 self._park_in_progress = False
+                self._trace_event(f"park_error slot={index} reason=feed_start_failed")
                 self._park_error = True
                 # Очищаем ссылки на таймеры
                 self._park_monitor_timer = None
@@ -1583,6 +2973,7 @@ class ValgAce:
                 }, lambda r: None)
                 
                 self._park_in_progress = False
+                self._trace_event(f"park_error slot={index} reason=sensor_timeout")
                 self._park_error = True
                 # Сбрасываем флаги сенсорной парковки
                 self._sensor_parking_active = False
@@ -1599,15 +2990,24 @@ class ValgAce:
                 
                 if filament_detected:
                     self.logger.info(f"Filament detected by sensor for slot {index}, switching to traditional parking")
+                    self._trace_event(f"park_phase slot={index} phase=sensor_triggered")
                     # Stop feeding filament and potentially any active feed assist
                     self.send_request({
                         "method": "stop_feed_filament",
                         "params": {"index": index}
                     }, lambda r: None)
                     
-                    # Переключаем флаги: сенсорная парковка завершена, запускаем традиционную
+                    # Переключаем флаги: сенсорная парковка завершена, запускаем традиционную.
+                    # Отсчёт проверки feed assist (3 с без роста счётчика) сбрасывается здесь же:
+                    # иначе кадр статуса до _switch_to_traditional_parking видит время
+                    # сенсорной фазы и считает feed assist неработающим
+                    # Reset the feed assist check together with the flag, otherwise a status
+                    # frame before _switch_to_traditional_parking sees the sensor phase time
                     self._sensor_parking_active = False
                     self._sensor_parking_completed = True
+                    self._park_start_time = self.reactor.monotonic()
+                    self._park_count_increased = False
+                    self._assist_hit_count = 0
                     
                     # Цикл ожидания статуса устройства (ready) перед переключением на традиционную парковку
                     # Интервал опроса: 0.2 секунды, тайм-аут: 5 секунд
@@ -1638,7 +3038,7 @@ class ValgAce:
                         return eventtime + status_poll_interval
                     
                     # Запускаем таймер опроса статуса
-                    self.reactor.register_timer(wait_for_device_ready, self.reactor.NOW)
+                    self._scheduler.register_timer(wait_for_device_ready, self.reactor.NOW)
                     return self.reactor.NEVER
                 else:
                     # Continue monitoring
@@ -1658,6 +3058,7 @@ class ValgAce:
                 }, lambda r: None)
                 
                 self._park_in_progress = False
+                self._trace_event(f"park_error slot={index} reason=sensor_error")
                 self._park_error = True
                 # Сбрасываем флаги сенсорной парковки
                 self._sensor_parking_active = False
@@ -1668,7 +3069,7 @@ class ValgAce:
                 return self.reactor.NEVER
 
         # Register the timer to monitor the sensor and save reference
-        self._sensor_monitor_timer = self.reactor.register_timer(check_sensor, self.reactor.NOW)
+        self._sensor_monitor_timer = self._scheduler.register_timer(check_sensor, self.reactor.NOW)
 
     def _switch_to_traditional_parking(self, index: int):
         """
@@ -1677,6 +3078,7 @@ class ValgAce:
         using the traditional algorithm (feed_assist_count tracking).
         """
         self.logger.info(f"Switching to traditional parking for slot {index} after sensor detection")
+        self._trace_event(f"park_phase slot={index} phase=traditional")
 
         # CRITICAL: Reset timers and counters for the new parking phase
         # This is necessary because elapsed_time and hit_count were accumulated
@@ -1699,12 +3101,16 @@ class ValgAce:
             def start_feed_callback(response):
                 if response.get('code', 0) != 0:
                     self.logger.error(f"Error starting feed assist for traditional parking: {response.get('msg', 'Unknown error')}")
+                    self._trace_event(f"park_error slot={index} reason=assist_start_failed")
                     self._park_error = True
                     self._park_in_progress = False
                     return
 
                 # Получаем начальный счетчик feed_assist_count
                 self._last_assist_count = response.get('result', {}).get('feed_assist_count', 0)
+                # 3 секунды на рост счётчика считаются от запуска feed assist, а не от
+                # срабатывания датчика: ожидание ready может длиться до 5 секунд
+                self._park_start_time = self.reactor.monotonic()
                 self.logger.info(f"Traditional parking started for slot {index}, initial count: {self._last_assist_count}")
                 # Дальше мониторинг будет происходить в _reader_loop через _handle_response
 
@@ -1735,12 +3141,18 @@ class ValgAce:
             # Check if filament sensor is configured and available
             if self.filament_sensor:
                 self.logger.info(f"Using sensor-based aggressive parking for slot {index}")
+                self._trace_event(f"park_start slot={index} mode=sensor")
+                self._toolchange_note_park_mode('sensor')
                 self._sensor_based_parking(index)
             else:
                 self.logger.info(f"Using distance-based aggressive parking for slot {index} (no filament sensor)")
+                self._trace_event(f"park_start slot={index} mode=distance")
+                self._toolchange_note_park_mode('distance')
                 self._distance_based_parking(index)
         else:
             self.logger.info(f"Starting traditional parking for slot {index}")
+            self._trace_event(f"park_start slot={index} mode=traditional")
+            self._toolchange_note_park_mode('traditional')
 
             def callback(response):
                 if response.get('code', 0) != 0:
@@ -1749,6 +3161,7 @@ class ValgAce:
                     else:
                         self.logger.error(f"ACE Error starting feed assist: {response.get('msg', 'Unknown error')}")
                     # Reset parking flag on error since device won't start feeding
+                    self._trace_event(f"park_error slot={index} reason=assist_start_failed")
                     self._park_in_progress = False
                     self._park_monitor_timer = None
                     self._sensor_monitor_timer = None
@@ -1759,6 +3172,63 @@ class ValgAce:
                 self.dwell(0.3, lambda: None)
             self.send_request({"method": "start_feed_assist", "params": {"index": index}}, callback)
 
+    def _toolchange_begin(self, was: int, tool: int, real_tool: int):
+        """Начать запись смены инструмента для last_toolchange / Start a tool change record"""
+        now = self.reactor.monotonic()
+        self._toolchange = {
+            'time': time.time(),
+            'from': was,
+            'to': tool,
+            'real_slot': real_tool,
+            'park_mode': None,
+            'infinity_spool': bool(self.ins_spool_work),
+            'phases': {},
+            'start': now,
+            'mark': now,
+        }
+
+    def _toolchange_phase(self, phase: str):
+        """Длительность фазы с конца предыдущей / Duration since the previous phase ended"""
+        record = self._toolchange
+        if record is None:
+            return
+        now = self.reactor.monotonic()
+        record['phases'][phase] = round(now - record['mark'], 3)
+        record['mark'] = now
+
+    def _toolchange_note_park_mode(self, mode: str):
+        if self._toolchange is not None:
+            self._toolchange['park_mode'] = mode
+
+    def _toolchange_end(self, was: int, tool: int, reason: Optional[str] = None):
+        """
+        Завершить смену инструмента: событие самописца и запись last_toolchange
+        в статусе (с номером seq), которую сохраняет компонент Moonraker.
+        """
+        if reason is None:
+            self._trace_event(f"toolchange_done from={was} to={tool}")
+        else:
+            self._trace_event(f"toolchange_error from={was} to={tool} reason={reason}")
+        record = self._toolchange
+        self._toolchange = None
+        if record is None:
+            return
+        self._toolchange_seq += 1
+        self._last_toolchange = {
+            'seq': self._toolchange_seq,
+            'time': record['time'],
+            'from': record['from'],
+            'to': record['to'],
+            'real_slot': record['real_slot'],
+            'park_mode': record['park_mode'],
+            'infinity_spool': record['infinity_spool'],
+            'success': reason is None,
+            'error': reason,
+            'duration': round(self.reactor.monotonic() - record['start'], 3),
+            'phases': record['phases'],
+        }
+        self._status_dirty = True
+
     def cmd_ACE_CHANGE_TOOL(self, gcmd):
         tool = gcmd.get_int('TOOL', minval=-1, maxval=3)
         was = self.variables.get('ace_current_index', -1)
@@ -1766,13 +3236,31 @@ class ValgAce:
         if was == tool:
             gcmd.respond_info(f"Tool already set to {tool}")
             return
+        self._trace_event(f"toolchange_start from={was} to={tool}")
 
         # Преобразуем индексы Klipper в реальные слоты устройства
         # Convert Klipper indices to real device slots
         real_tool = self._get_real_slot(tool) if tool != -1 else -1
         real_was = self._get_real_slot(was) if was != -1 else -1
+        self._toolchange_begin(was, tool, real_tool)
+        # Запись смены закрывается всегда, иначе _link_safe_point и планировщик
+        # сушки считали бы принтер занятым навсегда
+        # Always close the record, otherwise the link watchdog and the drying
+        # scheduler would see the printer as busy for good
+        try:
+            self._change_tool(gcmd, was, tool, real_was, real_tool)
+        except Exception as e:
+            if self._toolchange is not None:
+                self._toolchange_end(was, tool, f"exception: {e}")
+            raise
+        finally:
+            if self._toolchange is not None:
+                self._toolchange_end(was, tool, "aborted")
 
+    def _change_tool(self, gcmd, was: int, tool: int, real_was: int, real_tool: int):
+        """Тело ACE_CHANGE_TOOL; каждый выход вызывает _toolchange_end"""
         if tool != -1 and self._info['slots'][real_tool]['status'] != 'ready':
+            self._toolchange_end(was, tool, "slot_not_ready")
             self.gcode.run_script_from_command(f"_ACE_ON_EMPTY_ERROR INDEX={tool}")
             return
 
@@ -1785,6 +3273,7 @@ class ValgAce:
         self._park_previous_tool = was
         if self.toolhead:
             self.toolhead.wait_moves()
+        self._toolchange_phase('pre_macro')
         self.variables['ace_current_index'] = tool
         self._save_variable('ace_current_index', tool)
 
@@ -1820,10 +3309,12 @@ class ValgAce:
                 while self._info['slots'][real_was]['status'] != 'ready':
                     if self.reactor.monotonic() > timeout:
                         gcmd.respond_raw(f"ACE Error: Timeout waiting for slot {real_was} to be ready")
+                        self._toolchange_end(was, tool, "retract_timeout")
                         return
                     if self.toolhead:
                         self.toolhead.dwell(1.0)
                 
+                self._toolchange_phase('retract')
                 self.logger.info(f"Slot {real_was} is ready, parking new tool {tool} (real slot {real_tool})")
             else:
                 self.logger.info(f"Skipping retract for infinity spool - slot {real_was} is empty, parking new tool {tool} (real slot {real_tool})")
@@ -1839,18 +3330,32 @@ class ValgAce:
                 while self._park_in_progress:
                     if self._connection_lost:
                         gcmd.respond_raw(f"ACE Error: Connection lost during parking for slot {real_tool}")
+                        self._toolchange_end(was, tool, "connection_lost")
                         self._pause_print_if_needed()
                         return
                     if self._park_error:
                         gcmd.respond_raw(f"ACE Error: Parking failed for slot {real_tool}")
+                        self._toolchange_end(was, tool, "park_failed")
+                        self._pause_print_if_needed()
                         return
                     if self.reactor.monotonic() > timeout:
                         gcmd.respond_raw(f"ACE Error: Timeout waiting for parking to complete ({self.max_parking_timeout}s)")
+                        self._toolchange_end(was, tool, "timeout")
                         self._pause_print_if_needed()
                         return
                     if self.toolhead:
                         self.toolhead.dwell(1.0)
+                # Ветки ошибок парковки сбрасывают _park_in_progress вместе с _park_error,
+                # поэтому цикл выше может завершиться, не увидев ошибку
+                # Park error paths clear _park_in_progress together with _park_error,
+                # so the loop above can exit without seeing the error
+                if self._park_error:
+                    gcmd.respond_raw(f"ACE Error: Parking failed for slot {real_tool}")
+                    self._toolchange_end(was, tool, "park_failed")
+                    self._pause_print_if_needed()
+                    return
 
+                self._toolchange_phase('park')
                 self.logger.info(f"Parking completed, executing post-toolchange")
                 if self.toolhead:
                     self.toolhead.wait_moves()
@@ -1862,7 +3367,9 @@ class ValgAce:
                     self.gcode.run_script_from_command(f'_ACE_POST_TOOLCHANGE FROM={was} TO={tool}')
                 if self.toolhead:
                     self.toolhead.wait_moves()
+                self._toolchange_phase('post_macro')
                 gcmd.respond_info(f"Tool changed from {was} to {tool} (real slot {real_tool})")
+                self._toolchange_end(was, tool)
             else:
                 # Unloading only, no new tool
                 if self.ins_spool_work:
@@ -1871,7 +3378,9 @@ class ValgAce:
                     self.gcode.run_script_from_command(f'_ACE_POST_TOOLCHANGE FROM={was} TO={tool}')
                 if self.toolhead:
                     self.toolhead.wait_moves()
+                self._toolchange_phase('post_macro')
                 gcmd.respond_info(f"Tool changed from {was} to {tool}")
+                self._toolchange_end(was, tool)
         else:
             # No previous tool, just park the new one (используем реальный слот)
             # No previous tool, just park the new one (use real slot)
@@ -1884,18 +3393,28 @@ class ValgAce:
             while self._park_in_progress:
                 if self._connection_lost:
                     gcmd.respond_raw(f"ACE Error: Connection lost during parking for slot {real_tool}")
+                    self._toolchange_end(was, tool, "connection_lost")
                     self._pause_print_if_needed()
                     return
                 if self._park_error:
                     gcmd.respond_raw(f"ACE Error: Parking failed for slot {real_tool}")
+                    self._toolchange_end(was, tool, "park_failed")
+                    self._pause_print_if_needed()
                     return
                 if self.reactor.monotonic() > timeout:
                     gcmd.respond_raw(f"ACE Error: Timeout waiting for parking to complete ({self.max_parking_timeout}s)")
+                    self._toolchange_end(was, tool, "timeout")
                     self._pause_print_if_needed()
                     return
                 if self.toolhead:
                     self.toolhead.dwell(1.0)
+            if self._park_error:
+                gcmd.respond_raw(f"ACE Error: Parking failed for slot {real_tool}")
+                self._toolchange_end(was, tool, "park_failed")
+                self._pause_print_if_needed()
+                return
             
+            self._toolchange_phase('park')
             self.logger.info(f"Parking completed, executing post-toolchange")
             if self.toolhead:
                 self.toolhead.wait_moves()
@@ -1907,7 +3426,9 @@ class ValgAce:
                 self.gcode.run_script_from_command(f'_ACE_POST_TOOLCHANGE FROM={was} TO={tool}')
             if self.toolhead:
                 self.toolhead.wait_moves()
+            self._toolchange_phase('post_macro')
             gcmd.respond_info(f"Tool changed from {was} to {tool} (real slot {real_tool})")
+            self._toolchange_end(was, tool)
      
     def cmd_ACE_DISCONNECT(self, gcmd):
         """G-code command to force disconnect from the device"""
@@ -1938,8 +3459,9 @@ class ValgAce:
                     gcmd.respond_info("ACE device connected successfully")
                     self.logger.info("Device manually connected via ACE_CONNECT command")
                 else:
-                    gcmd.respond_raw("Failed to connect to ACE device")
+                    gcmd.respond_raw("Failed to connect to ACE device, will retry automatically")
                     self.logger.error("Manual connection attempt failed")
+                    self._schedule_connect(self._backoff_delay())
         except Exception as e:
             self.logger.error(f"Error during manual connect: {str(e)}")
             gcmd.respond_raw(f"Error connecting: {str(e)}")
@@ -1958,14 +3480,22 @@ class ValgAce:
                     gcmd.respond_info(f"Device: {model}, Firmware: {firmware}")
                 except Exception:
                     gcmd.respond_info("Device: connected (details unavailable)")
+                link = self._link_status
+                gcmd.respond_info(f"Link health: {self._link_health()} (RTT {link['rtt_ms']} ms, "
+                                  f"errors {self._link_error_count}/{len(self._link_outcomes)}, "
+                                  f"{link['wakeups_per_sec']} wakeups/s)")
             else:
                 gcmd.respond_info(f"Serial Port: {self.serial_name}")
                 gcmd.respond_info(f"Baud Rate: {self.baud}")
+                if not self._manually_disconnected:
+                    retry_in = max(0., self._connect_deadline - self.reactor.monotonic())
+                    watch = "inotify" if self._hotplug is not None else "polling"
+                    gcmd.respond_info(f"Reconnecting: attempt {self._reconnect_attempts + 1} in {retry_in:.1f}s (port watch: {watch})")
             
             # Дополнительная информация о состоянии обрыва связи
             if self._connection_lost:
-                gcmd.respond_raw(f"ACE: Connection lost flag is set (attempts: {self._reconnect_attempts}/{self._max_reconnect_attempts})")
-                gcmd.respond_info("Try ACE_RECONNECT to reset the connection")
+                gcmd.respond_raw(f"ACE: Connection lost flag is set (failed attempts: {self._reconnect_attempts}), still retrying")
+                gcmd.respond_info("Try ACE_RECONNECT to retry immediately")
         except Exception as e:
             self.logger.error(f"Error checking connection status: {str(e)}")
             gcmd.respond_raw(f"Error checking status: {str(e)}")
@@ -1981,17 +3511,197 @@ class ValgAce:
             # Пробуем подключиться
             self._manually_disconnected = False
             self._disconnect()
-            self.dwell(1.0, lambda: None)
             
             success = self._connect()
             if success:
                 gcmd.respond_info("ACE: Reconnection successful")
             else:
                 gcmd.respond_raw("ACE: Reconnection failed, will retry automatically")
+                self._schedule_connect(self._backoff_delay())
         except Exception as e:
             self.logger.error(f"Error during manual reconnect: {str(e)}")
             gcmd.respond_raw(f"Error reconnecting: {str(e)}")
 
+    def cmd_ACE_DUMP_TRACE(self, gcmd):
+        """
+        Экспорт бортового самописца в JSON Lines.
+        Export the flight recorder ring as JSON Lines.
+
+        Параметры / Parameters:
+          FILE - путь к файлу (по умолчанию рядом с файлом самописца)
+        """
+        if self._recorder is None:
+            gcmd.respond_raw("ACE: Flight recorder is disabled")
+            return
+        base = os.path.splitext(self._recorder.path)[0]
+        default_path = f"{base}_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+        path = os.path.expanduser(gcmd.get('FILE', default_path))
+        try:
+            count = AceFlightRecorder.export_jsonl(self._recorder.records(), path)
+            gcmd.respond_info(f"ACE: Trace exported ({count} records) to {path}")
+        except Exception as e:
+            self.logger.error(f"Error exporting flight recorder trace: {str(e)}")
+            gcmd.respond_raw(f"Error exporting trace: {str(e)}")
+
+    def cmd_ACE_LOG(self, gcmd):
+        """
+        Уровень журнала ace и счётчики событий.
+        Show or change the ace log level and print the event counters.
+
+        Параметры / Parameters:
+          LEVEL  - DEBUG, INFO, WARNING или ERROR
+          SAMPLE - для частых событий писать каждое N-е / log every Nth high-frequency event
+        """
+        level_name = gcmd.get('LEVEL', None)
+        if level_name is not None:
+            level = AceEventLog.LEVELS.get(level_name.upper())
+            if level is None:
+                gcmd.respond_raw(f"ACE Error: LEVEL must be one of {', '.join(AceEventLog.LEVELS)}")
+                return
+            self._events.set_level(level)
+        sample = gcmd.get_int('SAMPLE', None, minval=1)
+        if sample is not None:
+            self._events.sample = sample
+
+        output = [f"ACE log: level={logging.getLevelName(self._events.level)} sample={self._events.sample}"]
+        counts = sorted(self._events.counts.items(), key=lambda item: -item[1])
+        if counts:
+            output.append("Events:")
+            output.extend(f"  {name}: {count}" for name, count in counts[:20])
+        gcmd.respond_info("\n".join(output))
+
+    def cmd_ACE_PROFILE(self, gcmd):
+        """
+        Замер времени горячих путей ValgACE внутри reactor.
+        Time the ValgACE hot paths inside the reactor for DURATION seconds.
+
+        Параметры / Parameters:
+          DURATION - длительность замера, сек (30)
+          OUTPUT   - pstats: дополнительно cProfile всего потока reactor
+          FILE     - файл pstats (по умолчанию рядом с файлом самописца)
+        """
+        if self._profiler is not None:
+            gcmd.respond_raw("ACE Error: Profiling is already running")
+            return
+        duration = gcmd.get_float('DURATION', 30.0, minval=1.0, maxval=600.0)
+        output = gcmd.get('OUTPUT', '').lower()
+        if output not in ('', 'pstats'):
+            gcmd.respond_raw("ACE Error: OUTPUT must be pstats")
+            return
+        cprofile = None
+        if output == 'pstats':
+            base = os.path.splitext(self._recorder.path)[0] if self._recorder is not None \
+                else os.path.expanduser('~/printer_data/logs/ace')
+            default_path = f"{base}_profile_{time.strftime('%Y%m%d_%H%M%S')}.pstats"
+            cprofile = (cProfile.Profile(), os.path.expanduser(gcmd.get('FILE', default_path)))
+
+        profiler = AceProfiler(duration, cprofile)
+        for name in self.PROFILED_METHODS:
+            setattr(self, name, profiler.wrap(name, getattr(self, name)))
+        self._profiler = profiler
+        self._scheduler.profiler = profiler
+        # reactor держит ссылку на исходные методы - перерегистрируем таймеры
+        # The reactor holds the original bound methods, so re-register its timers
+        self._rearm_link_timers()
+        if cprofile is not None:
+            cprofile[0].enable()
+        self._scheduler.register_timer(self._finish_profile, self.reactor.monotonic() + duration)
+        gcmd.respond_info(f"ACE: Profiling for {duration:.0f} s")
+
+    def _rearm_link_timers(self):
+        if self._reader_timer is not None:
+            self.reactor.unregister_timer(self._reader_timer)
+            self._reader_timer = self.reactor.register_timer(self._reader_loop, self.reactor.NOW)
+        if self._writer_timer is not None:
+            self.reactor.unregister_timer(self._writer_timer)
+            self._writer_timer = self.reactor.register_timer(self._writer_loop, self.reactor.NOW)
+
+    def _finish_profile(self, eventtime):
+        profiler = self._profiler
+        if profiler is None:
+            return self.reactor.NEVER
+        if profiler.cprofile is not None:
+            profiler.cprofile[0].disable()
+        self._profiler = None
+        self._scheduler.profiler = None
+        for name in self.PROFILED_METHODS:
+            self.__dict__.pop(name, None)
+        self._rearm_link_timers()
+
+        output = [f"ACE profile: {profiler.duration:.0f} s, inclusive times in ms",
+                  f"{'function':<44} {'calls':>6} {'total':>9} {'%':>6} {'p50':>7} {'p90':>7} {'p99':>7} {'max':>7}"]
+        for row in profiler.summary():
+            output.append(f"{row['name'][:44]:<44} {row['count']:>6} {row['total_ms']:>9.1f} "
+                          f"{row['share'] * 100:>6.2f} {row['p50_ms']:>7.3f} {row['p90_ms']:>7.3f} "
+                          f"{row['p99_ms']:>7.3f} {row['max_ms']:>7.3f}")
+        if profiler.cprofile is not None:
+            profile, path = profiler.cprofile
+            try:
+                profile.dump_stats(path)
+                output.append(f"pstats written to {path}")
+            except Exception as e:
+                self.logger.error(f"Error writing profile {path}: {str(e)}")
+                output.append(f"Error writing pstats: {str(e)}")
+        report = "\n".join(output)
+        self.logger.info(report)
+        self.gcode.respond_info(report)
+        return self.reactor.NEVER
+
+    def cmd_ACE_BATCH_MARK(self, gcmd):
+        """
+        Граница команды в пакете Moonraker /server/ace/batch. Ничего не выводит:
+        ответы G-code между метками собираются здесь, а по последней метке (END=1)
+        или по ошибке, прервавшей скрипт, уходят в компонент ace_status одним
+        вызовом remote method.
+        Silent boundary marker for /server/ace/batch: responses between marks are
+        collected here and sent to Moonraker as one remote method call.
+        """
+        token = gcmd.get('TOKEN')
+        index = gcmd.get_int('INDEX', minval=0)
+        end = gcmd.get_int('END', 0, minval=0, maxval=1)
+        batch = self._batch
+        if batch is not None and batch['token'] != token:
+            # Предыдущий пакет не дошёл до END=1 и не был прерван ошибкой
+            # (например, Moonraker отключился): его ответы уже никто не ждёт
+            # The previous batch never ended; nobody is waiting for it any more
+            self.logger.info(f"Batch {batch['token']} left unfinished at command {batch['index']}, dropped")
+            self._batch = batch = None
+        if batch is None:
+            batch = self._batch = {'token': token, 'index': index, 'responses': []}
+        batch['index'] = index
+        if end:
+            self._finish_batch(failed=False)
+            return
+        responses = batch['responses']
+        while len(responses) <= index:
+            responses.append([])
+
+    def _batch_output(self, msg: str):
+        """Обработчик вывода G-code: ответ текущей команды пакета"""
+        batch = self._batch
+        if batch is not None and batch['index'] < len(batch['responses']):
+            batch['responses'][batch['index']].append(msg)
+
+    def _batch_command_error(self):
+        """Klipper прервал скрипт: пакет завершён на текущей команде"""
+        if self._batch is not None:
+            self._finish_batch(failed=True)
+
+    def _finish_batch(self, failed: bool):
+        batch = self._batch
+        self._batch = None
+        if batch is None:
+            return
+        webhooks = self.printer.lookup_object('webhooks', None)
+        if webhooks is None:
+            return
+        try:
+            webhooks.call_remote_method('ace_batch_result', token=batch['token'], index=batch['index'],
+                                        failed=failed, responses=batch['responses'])
+        except self.printer.command_error as e:
+            # Компонент ace_status не загружен / Moonraker component not loaded
+            self.logger.warning(f"Batch {batch['token']}: result not delivered: {e}")
+
     def cmd_ACE_SET_INFINITY_SPOOL_ORDER(self, gcmd):
         """Set the order of slots for infinity spool mode"""
         order_str = gcmd.get('ORDER', '')
@@ -2054,18 +3764,12 @@ class ValgAce:
         # 2. Отменить все активные таймеры мониторинга перед началом смены
         if self.infsp_debounce_timer is not None:
             self.logger.info("ACE_INFINITY_SPOOL: Cancelling debounce timer")
-            try:
-                self.reactor.unregister_timer(self.infsp_debounce_timer)
-            except:
-                pass
+            self.infsp_debounce_timer.cancel()
             self.infsp_debounce_timer = None
         
         if self.infsp_sensor_monitor_timer is not None:
             self.logger.info("ACE_INFINITY_SPOOL: Cancelling sensor monitor timer")
-            try:
-                self.reactor.unregister_timer(self.infsp_sensor_monitor_timer)
-            except:
-                pass
+            self.infsp_sensor_monitor_timer.cancel()
             self.infsp_sensor_monitor_timer = None
         
         # 3. Сбросить флаг empty_detected
@@ -2074,6 +3778,7 @@ class ValgAce:
         # 4. Установить флаг работы
         self.ins_spool_work = True
         self.logger.info("ACE_INFINITY_SPOOL: STARTED - ins_spool_work set to True")
+        self._trace_event("infsp_start")
         
         try:
             # 3. Проверка infinity_spool_mode
@@ -2178,6 +3883,7 @@ Information Commands:
   ACE_STATUS                - Get full ACE device status
   ACE_FILAMENT_INFO         - Get filament info from slot (requires RFID)
   ACE_CHECK_FILAMENT_SENSOR - Check external filament sensor status
+  ACE_PREFLIGHT             - Check tools before a print (TOOLS=0,2,3 ON_FAIL=report|pause|error)
 
 Tool Management:
   ACE_CHANGE_TOOL           - Change tool (auto load/unload filament)
@@ -2198,6 +3904,9 @@ Feed Assist:
 Drying Control:
   ACE_START_DRYING          - Start filament drying process
   ACE_STOP_DRYING           - Stop filament drying process
+  ACE_DRY_PROFILE           - Run a drying profile in idle time ([PROFILE=<name>] [WHEN=idle|now])
+  ACE_DRY_SCHEDULE_STATUS   - Show drying profiles and the scheduled program
+  ACE_DRY_CANCEL            - Cancel the drying program and stop the dryer
 
 Connection:
   ACE_DISCONNECT            - Force disconnect from ACE device
@@ -2220,6 +3929,10 @@ Index Management:
 
 Debug:
   ACE_DEBUG                 - Debug command for direct device interaction
+  ACE_DUMP_TRACE            - Export flight recorder (raw frames and events)
+  ACE_LOG                   - Log level and event counters (LEVEL=DEBUG|INFO|WARNING|ERROR SAMPLE=N)
+  ACE_PROFILE               - Time ACE hot paths (DURATION=30 [OUTPUT=pstats FILE=...])
+  ACE_BATCH_MARK            - Command boundary marker (used by /server/ace/batch)
 
 ===================================
 
@@ -2350,16 +4063,17 @@ Debug:
         
         # ВАЖНО: Не запускать мониторинг если уже идёт смена слота
         if self.ins_spool_work:
-            self.logger.debug(f"_check_slot_empty_status: SKIP - ins_spool_work is True")
             return False
 
         current_status = self._get_active_slot_status()
-        self.logger.debug(f"_check_slot_empty_status: current_status={current_status}, last_status={self.infsp_last_active_status}, ins_spool_work={self.ins_spool_work}")
+        self._events.event(logging.DEBUG, 'infsp_check', sampled=True, status=current_status,
+                           last=self.infsp_last_active_status)
 
         # Обнаружен переход в empty
         if current_status == 'empty' and self.infsp_last_active_status != 'empty':
             self.infsp_last_active_status = current_status
             self.logger.info(f"_check_slot_empty_status: EMPTY detected! ins_spool_work={self.ins_spool_work}")
+            self._trace_event(f"infsp_empty index={self._get_active_slot_index()}")
             return True
 
         self.infsp_last_active_status = current_status
@@ -2376,14 +4090,11 @@ Debug:
         
         if self.infsp_debounce_timer is not None:
             self.logger.info("_start_empty_slot_monitoring: Cancelling existing debounce timer")
-            try:
-                self.reactor.unregister_timer(self.infsp_debounce_timer)
-            except:
-                pass
+            self.infsp_debounce_timer.cancel()
             self.infsp_debounce_timer = None
 
         self.infsp_empty_detected = True
-        self.infsp_debounce_timer = self.reactor.register_timer(
+        self.infsp_debounce_timer = self._scheduler.register_timer(
             self._monitor_empty_slot_debounce,
             self.reactor.monotonic() + self.infinity_spool_debounce
         )
@@ -2438,7 +4149,7 @@ Debug:
         if self.infsp_sensor_monitor_timer is not None:
             self.infsp_sensor_monitor_timer.cancel()
 
-        self.infsp_sensor_monitor_timer = self.reactor.register_timer(
+        self.infsp_sensor_monitor_timer = self._scheduler.register_timer(
             self._check_filament_sensor_trigger,
             self.reactor.monotonic() + 1.0  # Проверка каждую секунду
         )
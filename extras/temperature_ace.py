@@ -5,15 +5,82 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 #
 # This module provides temperature sensor for Anycubic Color Engine (ACE)
-# Reads temperature from ACE device status
+# Values are pushed by the ace module on every status frame
+# (ace:status_frame event), so there is no polling timer here
 
+import collections
 import logging
 
-ACE_REPORT_TIME = 1.0  # Report temperature every second
+ACE_REPORT_TIME = 1.0  # ACE status poll period outside drying and parking
+
+
+def _dryer(info):
+    dryer = info.get('dryer')
+    return dryer if isinstance(dryer, dict) else {}
+
+
+def _dryer_remaining(info):
+    # remain_time comes in seconds, report minutes like the ace status does
+    return _dryer(info).get('remain_time', 0) / 60.
+
+
+# Channels of the ACE status frame that can be exposed as sensors
+ACE_CHANNELS = {
+    'temp': lambda info: info.get('temp', 0.0),
+    'dryer_target': lambda info: _dryer(info).get('target_temp', 0),
+    'dryer_remaining': _dryer_remaining,
+    'fan_speed': lambda info: info.get('fan_speed', 0),
+}
+
+
+class RollingWindow:
+    """
+    Rolling min/max/avg over the last `span` seconds
+    Monotonic deques keep the min and max candidates and a running sum
+    gives the average, so each sample costs O(1) amortized
+    """
+
+    def __init__(self, span):
+        self.span = span
+        self._samples = collections.deque()   # (eventtime, value)
+        self._min = collections.deque()       # increasing values
+        self._max = collections.deque()       # decreasing values
+        self._sum = 0.
+
+    def add(self, eventtime, value):
+        self._samples.append((eventtime, value))
+        self._sum += value
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((eventtime, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((eventtime, value))
+        self.expire(eventtime)
+
+    def expire(self, eventtime):
+        limit = eventtime - self.span
+        samples = self._samples
+        while samples and samples[0][0] < limit:
+            self._sum -= samples.popleft()[1]
+        if not samples:
+            self._sum = 0.
+        while self._min and self._min[0][0] < limit:
+            self._min.popleft()
+        while self._max and self._max[0][0] < limit:
+            self._max.popleft()
+
+    def stats(self):
+        """(min, max, avg) or None when the window is empty"""
+        if not self._samples:
+            return None
+        return self._min[0][1], self._max[0][1], self._sum / len(self._samples)
+
 
 class TemperatureACE:
     """
-    Temperature sensor that reads temperature from ACE device
+    Sensor that reads one channel of the ACE status: temperature, dryer
+    target, dryer remaining time or fan speed
     Integrates with Klipper's temperature monitoring system
     """
     
@@ -22,6 +89,11 @@ class TemperatureACE:
         self.reactor = self.printer.get_reactor()
         self.name = config.get_name().split()[-1]
         
+        # Which ACE unit (printer object name) and which status field
+        self.ace_name = config.get('ace_name', 'ace')
+        self.channel = config.getchoice('ace_channel', {c: c for c in ACE_CHANNELS}, 'temp')
+        self._read_channel = ACE_CHANNELS[self.channel]
+        
         # ACE module reference (will be set in handle_ready)
         self.ace = None
         
@@ -32,21 +104,30 @@ class TemperatureACE:
         self.measured_min = 99999999.
         self.measured_max = 0.
         
+        # Rolling statistics, e.g. "stats_windows: 60, 600" (seconds)
+        self._windows = []
+        for span in config.getintlist('stats_windows', (60, 600)):
+            if span <= 0:
+                raise config.error("stats_windows must be positive")
+            self._windows.append((RollingWindow(span), 'min_%ds' % span,
+                                  'max_%ds' % span, 'avg_%ds' % span))
+        
         # Callback for temperature updates
         self._callback = None
+        # MCU used to convert the frame time, looked up once on connect
+        self._mcu = None
+        self._sample_logged = False
         
         # Register object
         self.printer.add_object("temperature_ace " + self.name, self)
         
-        # Skip timer setup if in debug mode
+        # Skip reporting if in debug mode
         if self.printer.get_start_args().get('debugoutput') is not None:
             return
         
-        # Register timer for periodic temperature reading
-        self.sample_timer = self.reactor.register_timer(
-            self._sample_ace_temperature)
-        
-        # Register event handler to start after connection
+        # ValgAce publishes every status frame with the time it was read
+        self.printer.register_event_handler("ace:status_frame",
+                                            self._handle_status_frame)
         self.printer.register_event_handler("klippy:connect",
                                             self.handle_connect)
         self.printer.register_event_handler("klippy:ready",
@@ -55,23 +136,18 @@ class TemperatureACE:
     def handle_ready(self):
         """Get reference to ACE module when Klipper is ready"""
         try:
-            self.ace = self.printer.lookup_object('ace')
-            logging.info("ACE temperature sensor: ACE module found and linked")
+            self.ace = self.printer.lookup_object(self.ace_name)
+            logging.info(f"ACE temperature sensor: {self.ace_name} found and linked ({self.channel})")
         except self.printer.config_error:
-            logging.warning("ACE temperature sensor: ACE module not found, sensor will report 0")
+            logging.warning(f"ACE temperature sensor: {self.ace_name} not found, sensor will report 0")
             self.ace = None
         except Exception as e:
             logging.error(f"ACE temperature sensor: Error linking to ACE module: {e}")
             self.ace = None
-        
-        # Start temperature sampling timer (if not in debug mode)
-        if hasattr(self, 'sample_timer'):
-            self.reactor.update_timer(self.sample_timer, self.reactor.NOW)
     
     def handle_connect(self):
-        """Start temperature sampling when Klipper connects"""
-        if hasattr(self, 'sample_timer'):
-            self.reactor.update_timer(self.sample_timer, self.reactor.NOW)
+        """Cache the MCU used for print time conversion"""
+        self._mcu = self.printer.lookup_object('mcu')
     
     def setup_minmax(self, min_temp, max_temp):
         """Setup min/max temperature limits (required by heaters system)"""
@@ -86,30 +162,29 @@ class TemperatureACE:
         """Return time interval between temperature reports (required by heaters system)"""
         return ACE_REPORT_TIME
     
-    def _sample_ace_temperature(self, eventtime):
-        """Periodic temperature sampling from ACE device"""
-        # Log first successful sample
-        if not hasattr(self, '_sample_logged'):
-            self._sample_logged = False
-        
+    def _handle_status_frame(self, eventtime, info, unit='ace'):
+        """Take the channel value from an ACE status frame read at eventtime"""
+        if unit != self.ace_name:
+            return
         try:
-            if self.ace and hasattr(self.ace, '_info'):
-                # Get temperature from ACE device info
-                ace_temp = self.ace._info.get('temp', 0.0)
-                
-                # Log first successful temperature reading
-                if not self._sample_logged and ace_temp > 0:
-                    logging.info(f"ACE temperature sensor: Started sampling, current temp={ace_temp}°C")
-                    self._sample_logged = True
-                
-                self.temp = float(ace_temp)
-                
-                # Track min/max
-                if self.temp > 0:  # Only track valid temperatures
-                    self.measured_min = min(self.measured_min, self.temp)
-                    self.measured_max = max(self.measured_max, self.temp)
-                
-                # Check temperature limits
+            value = float(self._read_channel(info))
+            
+            # Log first successful reading
+            if not self._sample_logged and value > 0:
+                logging.info(f"ACE temperature sensor: Started sampling, current {self.channel}={value}")
+                self._sample_logged = True
+            
+            self.temp = value
+            
+            # Track min/max; a temperature of 0 means no reading yet
+            if self.temp > 0 or self.channel != 'temp':
+                self.measured_min = min(self.measured_min, self.temp)
+                self.measured_max = max(self.measured_max, self.temp)
+                for window, _, _, _ in self._windows:
+                    window.add(eventtime, self.temp)
+            
+            # Check temperature limits (the other channels are not temperatures)
+            if self.channel == 'temp':
                 if self.temp < self.min_temp and self.temp > 0:
                     self.printer.invoke_shutdown(
                         "ACE temperature %.1f below minimum temperature of %.1f"
@@ -118,24 +193,13 @@ class TemperatureACE:
                     self.printer.invoke_shutdown(
                         "ACE temperature %.1f above maximum temperature of %.1f"
                         % (self.temp, self.max_temp))
-            else:
-                # ACE not available, report 0
-                if not hasattr(self, '_warning_shown'):
-                    logging.warning(f"temperature_ace: ACE module not available or _info not set (ace={self.ace}, has_info={hasattr(self.ace, '_info') if self.ace else False})")
-                    self._warning_shown = True
-                self.temp = 0.0
         except Exception:
-            logging.exception("temperature_ace: Error reading temperature from ACE")
+            logging.exception("temperature_ace: Error reading %s from ACE" % (self.channel,))
             self.temp = 0.0
         
-        # Call temperature callback if set
-        if self._callback:
-            mcu = self.printer.lookup_object('mcu')
-            measured_time = self.reactor.monotonic()
-            self._callback(mcu.estimated_print_time(measured_time), self.temp)
-        
-        # Schedule next sample
-        return eventtime + ACE_REPORT_TIME
+        # Report with the time the frame was read, not the time we got to it
+        if self._callback and self._mcu is not None:
+            self._callback(self._mcu.estimated_print_time(eventtime), self.temp)
     
     def get_temp(self, eventtime):
         """Get current temperature (required for temperature_sensor compatibility)"""
@@ -143,15 +207,24 @@ class TemperatureACE:
     
     def stats(self, eventtime):
         """Return statistics string for logging"""
-        return False, 'temperature_ace %s: temp=%.1f' % (self.name, self.temp)
+        return False, 'temperature_ace %s: %s=%.1f' % (self.name, self.channel, self.temp)
     
     def get_status(self, eventtime):
         """Return status for Moonraker/API"""
-        return {
+        status = {
             'temperature': round(self.temp, 2),
             'measured_min_temp': round(self.measured_min, 2),
             'measured_max_temp': round(self.measured_max, 2),
+            'channel': self.channel,
         }
+        for window, min_key, max_key, avg_key in self._windows:
+            window.expire(eventtime)
+            stats = window.stats()
+            if stats is not None:
+                status[min_key] = round(stats[0], 2)
+                status[max_key] = round(stats[1], 2)
+                status[avg_key] = round(stats[2], 2)
+        return status
 
 
 def load_config(config):
@@ -159,4 +232,3 @@ def load_config(config):
     # Register sensor factory with heaters system
     pheaters = config.get_printer().load_object(config, "heaters")
     pheaters.add_sensor_factory("temperature_ace", TemperatureACE)
-
@@ -7,17 +7,359 @@ Moonraker API Extension для ValgACE
 1. Скопируйте в ~/moonraker/moonraker/components/ace_status.py
 2. Добавьте в moonraker.conf:
    [ace_status]
+   # Необязательно: сколько секунд статус из кэша считается свежим, пока нет
+   # подписки на объект ace (с подпиской кэш свежий всегда)
+   # status_max_age: 5.0
+   # Необязательно: минимальный интервал между событиями обновления (сек)
+   # event_min_interval: 0.5
+   # Необязательно: максимальное время ожидания для ?wait_for_version (сек)
+   # long_poll_max_timeout: 120
+   # Необязательно: база истории (телеметрия и смены инструмента)
+   # database_path: ~/printer_data/database/ace_status.db
+   # Необязательно: история телеметрии в SQLite (/server/ace/telemetry)
+   # telemetry: True
+   # telemetry_sample_interval: 2.0
+   # telemetry_raw_retention: 6      (часы)
+   # telemetry_10s_retention: 48     (часы)
+   # telemetry_1m_retention: 30      (дни)
+   # Необязательно: журнал смен инструмента (/server/ace/toolchanges)
+   # toolchange_history: True
 """
 
 from __future__ import annotations
+import asyncio
+import json
 import logging
-from typing import TYPE_CHECKING, Optional, Dict, Any
+import os
+import re
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Tuple
 if TYPE_CHECKING:
     from confighelper import ConfigHelper
     from websockets import WebRequest
     from . import klippy_apis
     APIComp = klippy_apis.KlippyAPI
 
+# Пакет команд /server/ace/batch
+BATCH_MAX_COMMANDS = 64
+# Сколько ждать результат пакета (remote method ace_batch_result) после
+# завершения скрипта: он может прийти позже ответа run_gcode
+BATCH_SETTLE_TIME = .25
+# Команды, доступные в пакете, и их параметры - те, что читают обработчики
+# в extras/ace.py (gcmd.get*). Команда должна быть ещё и зарегистрирована
+# в Klippy (printer.gcode.commands). При добавлении команды в ace.py
+# дополните таблицу
+BATCH_COMMANDS: Dict[str, Tuple[str, ...]] = {
+    'ACE_STATUS': (),
+    'ACE_START_DRYING': ('TEMP', 'DURATION'),
+    'ACE_STOP_DRYING': (),
+    'ACE_DRY_PROFILE': ('PROFILE', 'WHEN'),
+    'ACE_DRY_SCHEDULE_STATUS': (),
+    'ACE_DRY_CANCEL': (),
+    'ACE_ENABLE_FEED_ASSIST': ('INDEX',),
+    'ACE_DISABLE_FEED_ASSIST': ('INDEX',),
+    'ACE_PARK_TO_TOOLHEAD': ('INDEX',),
+    'ACE_FEED': ('INDEX', 'LENGTH', 'SPEED'),
+    'ACE_UPDATE_FEEDING_SPEED': ('INDEX', 'SPEED'),
+    'ACE_STOP_FEED': ('INDEX',),
+    'ACE_RETRACT': ('INDEX', 'LENGTH', 'SPEED', 'MODE'),
+    'ACE_UPDATE_RETRACT_SPEED': ('INDEX', 'SPEED'),
+    'ACE_STOP_RETRACT': ('INDEX',),
+    'ACE_CHANGE_TOOL': ('TOOL',),
+    'ACE_INFINITY_SPOOL': (),
+    'ACE_SET_INFINITY_SPOOL_ORDER': ('ORDER',),
+    'ACE_FILAMENT_INFO': ('INDEX',),
+    'ACE_CHECK_FILAMENT_SENSOR': (),
+    'ACE_PREFLIGHT': ('TOOLS', 'ON_FAIL'),
+    'ACE_DISCONNECT': (),
+    'ACE_CONNECT': (),
+    'ACE_CONNECTION_STATUS': (),
+    'ACE_RECONNECT': (),
+    'ACE_GET_HELP': (),
+    'ACE_GET_SLOTMAPPING': (),
+    'ACE_SET_SLOTMAPPING': ('INDEX', 'SLOT'),
+    'ACE_RESET_SLOTMAPPING': (),
+    'ACE_GET_CURRENT_INDEX': (),
+    'ACE_SET_CURRENT_INDEX': ('INDEX',),
+    'ACE_DUMP_TRACE': ('FILE',),
+    'ACE_LOG': ('LEVEL', 'SAMPLE'),
+    'ACE_DEBUG': ('METHOD', 'PARAMS'),
+}
+_BATCH_BAD_VALUE_RE = re.compile(r'[\s;]')
+# Ответы Klipper, означающие ошибку команды
+_BATCH_ERROR_PREFIXES = ('!!', 'Error')
+_BATCH_ERROR_MARKERS = ('ACE Error', 'Unknown command')
+
+
+# Телеметрия: числовые ряды, которые пишутся из кэша статуса
+SLOT_STATUS_CODES = {'empty': 0, 'ready': 1, 'busy': 2}
+TELEMETRY_METRICS = (
+    'temp', 'fan_speed', 'feed_assist_count',
+    'dryer_target_temp', 'dryer_remain_time',
+    'slot_0_status', 'slot_1_status', 'slot_2_status', 'slot_3_status',
+)
+# Записи копятся в памяти и пишутся в базу одной транзакцией раз в N секунд
+TELEMETRY_FLUSH_INTERVAL = 10.
+TELEMETRY_PRUNE_INTERVAL = 600.
+
+
+class AceTelemetryStore:
+    """
+    Ряды телеметрии в SQLite с понижением разрешения: сырые отсчёты ->
+    10-секундные -> минутные корзины (count/sum/min/max), у каждого уровня
+    свой срок хранения. Методы синхронные - вызываются из отдельного потока.
+    """
+    # (имя, ширина корзины в секундах, таблица)
+    RESOLUTIONS = (('raw', 0, 'telemetry_raw'),
+                   ('10s', 10, 'telemetry_10s'),
+                   ('1m', 60, 'telemetry_1m'))
+
+    def __init__(self, db: sqlite3.Connection, retention: Dict[str, float]):
+        self.db = db
+        self.retention = retention
+        self._last_prune = 0.
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS telemetry_raw "
+                "(metric TEXT NOT NULL, ts REAL NOT NULL, value REAL NOT NULL)")
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS telemetry_raw_metric_ts "
+                "ON telemetry_raw (metric, ts)")
+            for _, _, table in self.RESOLUTIONS[1:]:
+                self.db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} "
+                    "(metric TEXT NOT NULL, bucket INTEGER NOT NULL, count INTEGER NOT NULL, "
+                    "sum REAL NOT NULL, min REAL NOT NULL, max REAL NOT NULL, "
+                    "PRIMARY KEY (metric, bucket)) WITHOUT ROWID")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS telemetry_meta (key TEXT PRIMARY KEY, value REAL)")
+
+    def _get_meta(self, key: str) -> Optional[float]:
+        row = self.db.execute("SELECT value FROM telemetry_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: float) -> None:
+        self.db.execute("INSERT OR REPLACE INTO telemetry_meta (key, value) VALUES (?, ?)",
+                        (key, value))
+
+    def append(self, rows: List[Tuple[str, float, float]], now: float) -> None:
+        """Записать отсчёты (metric, ts, value) и свернуть закрытые корзины"""
+        with self.db:
+            if rows:
+                self.db.executemany(
+                    "INSERT INTO telemetry_raw (metric, ts, value) VALUES (?, ?, ?)", rows)
+            self._rollup(now)
+            if now - self._last_prune >= TELEMETRY_PRUNE_INTERVAL:
+                self._prune(now)
+                self._last_prune = now
+
+    def _rollup(self, now: float) -> None:
+        # Сворачиваются только закрытые корзины: [отметка, начало текущей корзины)
+        end_10s = int(now // 10) * 10
+        mark = self._get_meta('rollup_10s')
+        if mark is None:
+            first = self.db.execute("SELECT MIN(ts) FROM telemetry_raw").fetchone()[0]
+            mark = int(first // 10) * 10 if first is not None else end_10s
+        if end_10s > mark:
+            self.db.execute(
+                "INSERT OR REPLACE INTO telemetry_10s (metric, bucket, count, sum, min, max) "
+                "SELECT metric, CAST(ts / 10 AS INTEGER) * 10 AS b, COUNT(*), SUM(value), "
+                "MIN(value), MAX(value) FROM telemetry_raw "
+                "WHERE ts >= ? AND ts < ? GROUP BY metric, b", (mark, end_10s))
+            self._set_meta('rollup_10s', end_10s)
+
+        end_1m = int(now // 60) * 60
+        mark = self._get_meta('rollup_1m')
+        if mark is None:
+            first = self.db.execute("SELECT MIN(bucket) FROM telemetry_10s").fetchone()[0]
+            mark = int(first // 60) * 60 if first is not None else end_1m
+        # Минутная корзина закрыта, когда закрыты все её 10-секундные
+        end_1m = min(end_1m, int(end_10s // 60) * 60)
+        if end_1m > mark:
+            self.db.execute(
+                "INSERT OR REPLACE INTO telemetry_1m (metric, bucket, count, sum, min, max) "
+                "SELECT metric, (bucket / 60) * 60 AS b, SUM(count), SUM(sum), MIN(min), MAX(max) "
+                "FROM telemetry_10s WHERE bucket >= ? AND bucket < ? GROUP BY metric, b",
+                (mark, end_1m))
+            self._set_meta('rollup_1m', end_1m)
+
+    def _prune(self, now: float) -> None:
+        self.db.execute("DELETE FROM telemetry_raw WHERE ts < ?",
+                        (now - self.retention['raw'],))
+        for name, _, table in self.RESOLUTIONS[1:]:
+            self.db.execute(f"DELETE FROM {table} WHERE bucket < ?",
+                            (now - self.retention[name],))
+
+    def choose_resolution(self, start: float, end: float, now: float,
+                          sample_interval: float, max_points: int) -> str:
+        """Самое подробное разрешение, которое покрывает диапазон и укладывается в max_points"""
+        span = max(end - start, 0.)
+        for name, width, _ in self.RESOLUTIONS:
+            step = width or sample_interval
+            if start >= now - self.retention[name] and span / step <= max_points:
+                return name
+        return self.RESOLUTIONS[-1][0]
+
+    def query(self, metrics: List[str], start: float, end: float,
+              resolution: str) -> Dict[str, List[List[float]]]:
+        """Ряды [ts, avg, min, max] для каждой метрики"""
+        series: Dict[str, List[List[float]]] = {}
+        for metric in metrics:
+            if resolution == 'raw':
+                rows = self.db.execute(
+                    "SELECT ts, value FROM telemetry_raw "
+                    "WHERE metric = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                    (metric, start, end))
+                series[metric] = [[ts, v, v, v] for ts, v in rows]
+            else:
+                table = {name: t for name, _, t in self.RESOLUTIONS}[resolution]
+                rows = self.db.execute(
+                    f"SELECT bucket, sum / count, min, max FROM {table} "
+                    "WHERE metric = ? AND bucket >= ? AND bucket < ? ORDER BY bucket",
+                    (metric, start, end))
+                series[metric] = [list(row) for row in rows]
+        return series
+
+
+class AceToolchangeStore:
+    """
+    Журнал смен инструмента. Агрегаты (по слоту и режиму парковки, по печати)
+    обновляются при каждой записи, поэтому статистика не требует полного
+    просмотра журнала. Методы синхронные - вызываются из потока базы.
+    """
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self.current_print_id: Optional[int] = None
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS toolchanges ("
+                "id INTEGER PRIMARY KEY, time REAL NOT NULL, seq INTEGER NOT NULL, "
+                "print_id INTEGER, from_tool INTEGER, to_tool INTEGER, real_slot INTEGER, "
+                "park_mode TEXT, infinity_spool INTEGER, success INTEGER NOT NULL, "
+                "error TEXT, duration REAL, phases TEXT, UNIQUE (time, seq))")
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS toolchanges_print ON toolchanges (print_id)")
+            # Счётчики по физическому слоту и режиму парковки
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS toolchange_stats ("
+                "real_slot INTEGER NOT NULL, park_mode TEXT NOT NULL, "
+                "count INTEGER NOT NULL, failures INTEGER NOT NULL, "
+                "duration_sum REAL NOT NULL, "
+                "PRIMARY KEY (real_slot, park_mode)) WITHOUT ROWID")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS prints ("
+                "id INTEGER PRIMARY KEY, filename TEXT, start REAL NOT NULL, end REAL, "
+                "state TEXT, toolchanges INTEGER NOT NULL DEFAULT 0, "
+                "failures INTEGER NOT NULL DEFAULT 0)")
+            # Печать, прерванная перезапуском Moonraker, не продолжается
+            self.db.execute(
+                "UPDATE prints SET state = 'interrupted' WHERE end IS NULL AND state = 'printing'")
+
+    def start_print(self, filename: Optional[str], start: float) -> None:
+        with self.db:
+            cur = self.db.execute(
+                "INSERT INTO prints (filename, start, state) VALUES (?, ?, 'printing')",
+                (filename, start))
+        self.current_print_id = cur.lastrowid
+
+    def end_print(self, state: str, end: float) -> None:
+        if self.current_print_id is None:
+            return
+        with self.db:
+            self.db.execute("UPDATE prints SET end = ?, state = ? WHERE id = ?",
+                            (end, state, self.current_print_id))
+        self.current_print_id = None
+
+    def add(self, record: Dict[str, Any]) -> bool:
+        """Записать смену инструмента; False, если она уже в журнале"""
+        success = bool(record.get('success'))
+        duration = record.get('duration') or 0.
+        real_slot = record.get('real_slot', -1)
+        park_mode = record.get('park_mode') or 'none'
+        with self.db:
+            cur = self.db.execute(
+                "INSERT OR IGNORE INTO toolchanges (time, seq, print_id, from_tool, to_tool, "
+                "real_slot, park_mode, infinity_spool, success, error, duration, phases) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (record.get('time'), record.get('seq'), self.current_print_id,
+                 record.get('from'), record.get('to'), real_slot, park_mode,
+                 int(bool(record.get('infinity_spool'))), int(success), record.get('error'),
+                 duration, json.dumps(record.get('phases') or {})))
+            if cur.rowcount != 1:
+                return False
+            self.db.execute(
+                "INSERT INTO toolchange_stats (real_slot, park_mode, count, failures, duration_sum) "
+                "VALUES (?, ?, 1, ?, ?) ON CONFLICT (real_slot, park_mode) DO UPDATE SET "
+                "count = count + 1, failures = failures + excluded.failures, "
+                "duration_sum = duration_sum + excluded.duration_sum",
+                (real_slot, park_mode, int(not success), duration if success else 0.))
+            if self.current_print_id is not None:
+                self.db.execute(
+                    "UPDATE prints SET toolchanges = toolchanges + 1, "
+                    "failures = failures + ? WHERE id = ?",
+                    (int(not success), self.current_print_id))
+        return True
+
+    def history(self, limit: int, before: Optional[int],
+                print_id: Optional[int]) -> List[Dict[str, Any]]:
+        where, args = [], []
+        if before is not None:
+            where.append("id < ?")
+            args.append(before)
+        if print_id is not None:
+            where.append("print_id = ?")
+            args.append(print_id)
+        sql = ("SELECT id, time, seq, print_id, from_tool, to_tool, real_slot, park_mode, "
+               "infinity_spool, success, error, duration, phases FROM toolchanges")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        args.append(limit)
+        keys = ('id', 'time', 'seq', 'print_id', 'from', 'to', 'real_slot', 'park_mode',
+                'infinity_spool', 'success', 'error', 'duration', 'phases')
+        result = []
+        for row in self.db.execute(sql, args):
+            entry = dict(zip(keys, row))
+            entry['infinity_spool'] = bool(entry['infinity_spool'])
+            entry['success'] = bool(entry['success'])
+            entry['phases'] = json.loads(entry['phases'] or '{}')
+            result.append(entry)
+        return result
+
+    def stats(self, prints_limit: int) -> Dict[str, Any]:
+        """Агрегаты из счётчиков: среднее время по слоту, доля ошибок по режиму парковки"""
+        def _summary(rows):
+            out = []
+            for key, count, failures, duration_sum in rows:
+                ok = count - failures
+                out.append({
+                    'key': key, 'count': count, 'failures': failures,
+                    'failure_rate': round(failures / count, 4) if count else 0.,
+                    'mean_duration': round(duration_sum / ok, 3) if ok else None,
+                })
+            return out
+        per_slot = _summary(self.db.execute(
+            "SELECT real_slot, SUM(count), SUM(failures), SUM(duration_sum) "
+            "FROM toolchange_stats GROUP BY real_slot ORDER BY real_slot"))
+        per_mode = _summary(self.db.execute(
+            "SELECT park_mode, SUM(count), SUM(failures), SUM(duration_sum) "
+            "FROM toolchange_stats GROUP BY park_mode ORDER BY park_mode"))
+        for entry in per_slot:
+            entry['real_slot'] = entry.pop('key')
+        for entry in per_mode:
+            entry['park_mode'] = entry.pop('key')
+        prints = [
+            {'id': pid, 'filename': filename, 'start': start, 'end': end, 'state': state,
+             'toolchanges': toolchanges, 'failures': failures}
+            for pid, filename, start, end, state, toolchanges, failures in self.db.execute(
+                "SELECT id, filename, start, end, state, toolchanges, failures "
+                "FROM prints ORDER BY id DESC LIMIT ?", (prints_limit,))
+        ]
+        return {'per_slot': per_slot, 'per_park_mode': per_mode, 'prints': prints}
+
 
 class AceStatus:
     def __init__(self, config: ConfigHelper):
@@ -25,8 +367,46 @@ class AceStatus:
         self.server = config.get_server()
         self.logger = logging.getLogger(__name__)
         
+        self.eventloop = self.server.get_event_loop()
+
         # Получаем klippy_apis компонент
         self.klippy_apis: APIComp = self.server.lookup_component('klippy_apis')
+
+        # Сколько секунд кэш считается свежим без повторного запроса в Klippy,
+        # если подписки на объект ace нет. С подпиской Klipper присылает каждое
+        # изменение, и кэш свежий, пока Klippy подключен, даже если ACE простаивает.
+        # 0 - запрашивать Klippy на каждый HTTP-запрос (как раньше)
+        self.status_max_age = config.getfloat('status_max_age', 5., minval=0.)
+        # Минимальный интервал между событиями ace:status_update / ace:status_delta.
+        # Во время парковки статус меняется 5 раз в секунду - изменения копятся
+        # и отправляются одним событием. 0 - без ограничения
+        self.event_min_interval = config.getfloat('event_min_interval', .5, minval=0.)
+        # Верхняя граница timeout для долгого опроса /server/ace/status?wait_for_version=N
+        self.long_poll_max_timeout = config.getfloat('long_poll_max_timeout', 120., minval=1.)
+
+        # История телеметрии (SQLite). База общая для всех таблиц компонента,
+        # запросы к ней выполняются в одном отдельном потоке
+        self.telemetry_enabled = config.getboolean('telemetry', True)
+        self.telemetry_sample_interval = config.getfloat(
+            'telemetry_sample_interval', 2., minval=.5)
+        self.telemetry_retention = {
+            'raw': config.getfloat('telemetry_raw_retention', 6., minval=.1) * 3600.,
+            '10s': config.getfloat('telemetry_10s_retention', 48., minval=1.) * 3600.,
+            '1m': config.getfloat('telemetry_1m_retention', 30., minval=1.) * 86400.,
+        }
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_executor: Optional[ThreadPoolExecutor] = None
+        self._telemetry: Optional[AceTelemetryStore] = None
+        self._telemetry_pending: List[Tuple[str, float, float]] = []
+        self._telemetry_last_flush: float = 0.
+        self._telemetry_timer = None
+        # Журнал смен инструмента: записи last_toolchange из статуса ace
+        self.toolchange_history = config.getboolean('toolchange_history', True)
+        self._toolchanges: Optional[AceToolchangeStore] = None
+        self._last_toolchange_key: Optional[Tuple[Any, Any]] = None
+        self._print_active = False
+        if self.telemetry_enabled or self.toolchange_history:
+            self._open_database(config)
         
         # Регистрация API эндпоинтов
         self.server.register_endpoint(
@@ -44,40 +424,228 @@ class AceStatus:
             ['POST'],
             self.handle_command_request
         )
+        self.server.register_endpoint(
+            "/server/ace/batch",
+            ['POST'],
+            self.handle_batch_request
+        )
+        if self._telemetry is not None:
+            self.server.register_endpoint(
+                "/server/ace/telemetry",
+                ['GET'],
+                self.handle_telemetry_request
+            )
+            self._telemetry_timer = self.eventloop.register_timer(self._handle_telemetry_timer)
+        if self._toolchanges is not None:
+            self.server.register_endpoint(
+                "/server/ace/toolchanges",
+                ['GET'],
+                self.handle_toolchanges_request
+            )
+            self.server.register_endpoint(
+                "/server/ace/toolchanges/stats",
+                ['GET'],
+                self.handle_toolchange_stats_request
+            )
+            # Границы печати - события компонента job_state
+            self.server.register_event_handler(
+                "job_state:state_changed", self._handle_job_state_changed)
         
         # Подписка на обновления статуса принтера
         self.server.register_event_handler(
             "server:status_update",
             self._handle_status_update
         )
+        self.server.register_event_handler(
+            "server:klippy_ready",
+            self._handle_klippy_ready
+        )
+        self.server.register_event_handler(
+            "server:klippy_disconnect",
+            self._handle_klippy_disconnect
+        )
+        # ace.py отдаёт ответы команд пакета одним вызовом, без вывода в консоль
+        self.server.register_remote_method(
+            "ace_batch_result",
+            self._handle_batch_result
+        )
+
+        # События для клиентов WebSocket: notify_ace_status_update (полный статус)
+        # и notify_ace_status_delta (только изменившиеся поля с номером последовательности)
+        self.server.register_notification("ace:status_update")
+        self.server.register_notification("ace:status_delta")
         
-        # Кэш последнего статуса
+        # Кэш последнего статуса (полное состояние, частичные обновления вливаются в него)
         self._last_status: Optional[Dict[str, Any]] = None
+        self._status_view: Optional[Dict[str, Any]] = None
+        self._status_time: float = 0.
+        # Подписка на объект ace активна: кэш получает каждое изменение
+        self._subscribed = False
+        # Общий запрос в Klippy для одновременных HTTP-запросов при устаревшем кэше
+        self._status_query: Optional[asyncio.Future] = None
+
+        # Версия статуса: растёт только при изменении содержимого кэша.
+        # ETag = "<метка запуска>-<версия>", чтобы после перезапуска Moonraker
+        # старый ETag клиента не совпал с новой версией случайно
+        self._status_version: int = 0
+        self._etag_prefix: str = f"{int(time.time()):x}"
+        # Ожидающие долгие опросы: один Future на всех, заменяется при изменении
+        self._version_waiter: Optional[asyncio.Future] = None
+
+        # Выполняющиеся пакеты: token -> Future с результатом от ace (ace_batch_result)
+        self._batches: Dict[str, asyncio.Future] = {}
+        # Команды ACE, зарегистрированные в Klippy; None - ещё не запрошены
+        self._klippy_commands: Optional[set] = None
+
+        # Состояние, отправленное клиентам последним событием, и номер события
+        self._emitted_view: Optional[Dict[str, Any]] = None
+        self._delta_seq: int = 0
+        self._last_emit_time: float = float('-inf')
+        self._emit_handle: Optional[asyncio.TimerHandle] = None
         
         self.logger.info("ACE Status API extension loaded")
+
+    def _open_database(self, config: ConfigHelper) -> None:
+        """Открыть базу компонента; при ошибке компонент работает без истории"""
+        default_dir = os.path.join(
+            self.server.get_app_args().get('data_path', os.path.expanduser('~/printer_data')),
+            'database')
+        path = os.path.expanduser(
+            config.get('database_path', os.path.join(default_dir, 'ace_status.db')))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            if self.telemetry_enabled:
+                self._telemetry = AceTelemetryStore(self._db, self.telemetry_retention)
+            if self.toolchange_history:
+                self._toolchanges = AceToolchangeStore(self._db)
+        except Exception as e:
+            self.logger.warning(f"ACE history disabled, cannot open {path}: {e}")
+            self._db = self._telemetry = self._toolchanges = None
+            return
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ace_db")
+        self.logger.info(f"ACE history database: {path}")
+
+    async def _run_db(self, func, *args):
+        """Выполнить запрос к базе в потоке базы, не блокируя event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, func, *args)
+
+    async def component_init(self) -> None:
+        if self._telemetry_timer is not None:
+            self._telemetry_timer.start(delay=self.telemetry_sample_interval)
     
-    async def handle_status_request(self, webrequest: WebRequest) -> Dict[str, Any]:
-        """Обработка запроса статуса ACE"""
+    def _set_status(self, ace_data: Dict[str, Any], partial: bool = False) -> None:
+        """Обновить кэш: полный статус заменяет его, частичный вливается"""
+        old = self._last_status
+        if partial and old is not None:
+            # Klipper присылает только изменившиеся ключи верхнего уровня
+            changed = any(k not in old or old[k] != v for k, v in ace_data.items())
+            if changed:
+                self._last_status = {**old, **ace_data}
+        else:
+            changed = old != ace_data
+            if changed:
+                self._last_status = dict(ace_data)
+        self._status_time = self.eventloop.get_loop_time()
+        if changed:
+            self._status_view = None
+            self._bump_version()
+            if self._toolchanges is not None:
+                self._check_toolchange(ace_data.get('last_toolchange'))
+
+    def _bump_version(self) -> None:
+        self._status_version += 1
+        waiter = self._version_waiter
+        self._version_waiter = None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(self._status_version)
+
+    @property
+    def _etag(self) -> str:
+        return f'"{self._etag_prefix}-{self._status_version}"'
+
+    async def _wait_for_change(self, version: int, timeout: float) -> None:
+        """Ждать, пока версия статуса отличается от version, но не дольше timeout"""
+        if self._status_version != version or timeout <= 0:
+            return
+        if self._version_waiter is None:
+            self._version_waiter = self.eventloop.create_future()
+        try:
+            # shield: таймаут одного клиента не отменяет общий Future
+            await asyncio.wait_for(asyncio.shield(self._version_waiter), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _cache_is_fresh(self) -> bool:
+        if self._last_status is None or self.status_max_age <= 0:
+            return False
+        if self._subscribed:
+            # Klipper присылает подписанные объекты только при изменениях:
+            # тишина означает, что статус не менялся
+            return True
+        age = self.eventloop.get_loop_time() - self._status_time
+        return age <= self.status_max_age
+
+    async def _query_status(self) -> Optional[Dict[str, Any]]:
         try:
             # Получаем данные напрямую из модуля ace через query_objects
-            # Модуль ace экспортирует данные через register_status_handler
-            try:
-                result = await self.klippy_apis.query_objects({'ace': None})
-                ace_data = result.get('ace')
-                
-                if ace_data and isinstance(ace_data, dict):
-                    self._last_status = ace_data
-                    return ace_data
-                else:
-                    self.logger.debug("ACE data not found in query_objects response")
-            
-            except Exception as e:
-                self.logger.debug(f"Could not get ACE data from query_objects: {e}")
-            
-            # Fallback: используем кэшированный статус если есть
-            if self._last_status:
-                self.logger.debug("Using cached ACE status")
-                return self._last_status
+            # Модуль ace экспортирует данные через get_status
+            result = await self.klippy_apis.query_objects({'ace': None})
+            ace_data = result.get('ace')
+            if ace_data and isinstance(ace_data, dict):
+                self._set_status(ace_data)
+            else:
+                self.logger.debug("ACE data not found in query_objects response")
+        except Exception as e:
+            self.logger.debug(f"Could not get ACE data from query_objects: {e}")
+        finally:
+            self._status_query = None
+        return self._last_status
+
+    async def _get_status(self) -> Optional[Dict[str, Any]]:
+        """
+        Статус из кэша, если он свежий. Иначе один общий запрос в Klippy
+        для всех одновременно пришедших HTTP-запросов.
+        """
+        if not self._cache_is_fresh():
+            if self._status_query is None:
+                self._status_query = self.eventloop.create_task(self._query_status())
+            # shield: отмена одного HTTP-запроса не отменяет общий запрос
+            await asyncio.shield(self._status_query)
+        if self._last_status is None:
+            return None
+        if self._status_view is None:
+            self._status_view = self._nested_view(self._last_status)
+        return self._status_view
+
+    async def handle_status_request(self, webrequest: WebRequest) -> Dict[str, Any]:
+        """
+        Обработка запроса статуса ACE.
+
+        ?if_none_match=<etag> - если статус не менялся, вернуть только
+        {"version", "etag", "not_modified": true} без тела статуса.
+        ?wait_for_version=N[&timeout=30] - долгий опрос: ответить, когда версия
+        станет отличной от N, или по истечении timeout (тогда not_modified).
+        """
+        try:
+            wait_for = webrequest.get_int('wait_for_version', None)
+            if_none_match = webrequest.get_str('if_none_match', None)
+            ace_data = await self._get_status()
+            if wait_for is not None and ace_data:
+                timeout = webrequest.get_float('timeout', 30.)
+                timeout = min(max(timeout, 0.), self.long_poll_max_timeout)
+                await self._wait_for_change(wait_for, timeout)
+                if self._status_version == wait_for:
+                    return self._not_modified()
+                ace_data = await self._get_status()
+            if ace_data:
+                if if_none_match is not None and if_none_match.strip() == self._etag:
+                    return self._not_modified()
+                # Копия: кэш отдаётся и событиям, его нельзя дополнять на месте
+                return {**ace_data, "version": self._status_version, "etag": self._etag}
             
             # Если данных нет, возвращаем структуру по умолчанию
             self.logger.warning("No ACE data available, returning default structure")
@@ -106,6 +674,29 @@ class AceStatus:
             self.logger.error(f"Traceback: {traceback.format_exc()}")
             return {"error": str(e)}
     
+    def _not_modified(self) -> Dict[str, Any]:
+        return {"version": self._status_version, "etag": self._etag, "not_modified": True}
+
+    @staticmethod
+    def _nested_view(ace_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Восстановить slots/dryer из плоских ключей (status_layout: flat),
+        чтобы REST API отдавал один и тот же формат при любой настройке.
+        """
+        if 'slots' in ace_data or 'slot_0' not in ace_data:
+            return ace_data
+        nested = dict(ace_data)
+        nested['slots'] = [ace_data.get(f'slot_{i}', {}) for i in range(4)]
+        dryer = {
+            'status': ace_data.get('dryer_state', 'stop'),
+            'target_temp': ace_data.get('dryer_target_temp', 0),
+            'duration': ace_data.get('dryer_duration', 0),
+            'remain_time': ace_data.get('dryer_remaining', 0),
+        }
+        nested['dryer'] = dryer
+        nested['dryer_status'] = dryer
+        return nested
+
     async def handle_slots_request(self, webrequest: WebRequest) -> Dict[str, Any]:
         """Обработка запроса информации о слотах"""
         try:
@@ -122,20 +713,38 @@ class AceStatus:
             self.logger.error(f"Error getting slots: {e}")
             return {"error": str(e)}
     
+    @staticmethod
+    async def _read_json_body(webrequest: WebRequest) -> Dict[str, Any]:
+        try:
+            json_body = await webrequest.get_json()
+        except Exception:
+            return {}
+        return json_body if isinstance(json_body, dict) else {}
+
+    @staticmethod
+    def _format_gcode(command: str, params: Dict[str, Any]) -> str:
+        """Сформировать строку G-code: значения без лишних кавычек, bool -> 1/0"""
+        if not params:
+            return command
+        def _fmt_val(val):
+            if isinstance(val, bool):
+                return '1' if val else '0'
+            return str(val)
+        param_str = " ".join([f"{k}={_fmt_val(v)}" for k, v in params.items()])
+        return f"{command} {param_str}"
+
     async def handle_command_request(self, webrequest: WebRequest) -> Dict[str, Any]:
         """Обработка выполнения команды ACE"""
         try:
+            # JSON body разбирается один раз
+            json_body = await self._read_json_body(webrequest)
+
             # Получаем параметры из запроса
             command = webrequest.get_str("command", None)
             
             # Если команда не в query параметрах, пытаемся получить из JSON body
             if not command:
-                try:
-                    json_body = await webrequest.get_json()
-                    if isinstance(json_body, dict):
-                        command = json_body.get("command")
-                except Exception:
-                    pass
+                command = json_body.get("command")
             
             if not command:
                 return {"error": "Command parameter is required"}
@@ -144,14 +753,9 @@ class AceStatus:
             params: Dict[str, Any] = {}
 
             # 1) Пытаемся получить params из JSON body
-            try:
-                json_body = await webrequest.get_json()
-                if isinstance(json_body, dict) and "params" in json_body:
-                    jb_params = json_body["params"]
-                    if isinstance(jb_params, dict):
-                        params.update(jb_params)
-            except Exception:
-                pass
+            jb_params = json_body.get("params")
+            if isinstance(jb_params, dict):
+                params.update(jb_params)
 
             # 2) Обрабатываем query параметры
             try:
@@ -167,8 +771,7 @@ class AceStatus:
                     parsed = None
                     if isinstance(qp_params, str):
                         try:
-                            import json as _json
-                            parsed = _json.loads(qp_params)
+                            parsed = json.loads(qp_params)
                         except Exception:
                             # Попытка распарсить формат вида "{'INDEX': 0}"
                             try:
@@ -187,15 +790,7 @@ class AceStatus:
                     params[str(k)] = v
             
             # Формируем G-code команду
-            gcode_cmd = command
-            if params:
-                # Преобразуем значения к строке без лишних кавычек
-                def _fmt_val(val):
-                    if isinstance(val, bool):
-                        return '1' if val else '0'
-                    return str(val)
-                param_str = " ".join([f"{k}={_fmt_val(v)}" for k, v in params.items()])
-                gcode_cmd = f"{command} {param_str}"
+            gcode_cmd = self._format_gcode(command, params)
             
             # Выполняем команду через klippy_apis
             try:
@@ -217,7 +812,413 @@ class AceStatus:
         except Exception as e:
             self.logger.error(f"Error handling ACE command request: {e}")
             return {"error": str(e)}
+
+    async def _get_klippy_commands(self) -> set:
+        """Имена команд ACE, зарегистрированных в Klippy (printer.gcode.commands)"""
+        if self._klippy_commands is None:
+            result = await self.klippy_apis.query_objects({'gcode': ['commands']})
+            commands = (result.get('gcode') or {}).get('commands') or {}
+            self._klippy_commands = {name.upper() for name in commands
+                                     if name.upper().startswith('ACE_')}
+        return self._klippy_commands
+
+    def _validate_batch_entry(self, entry: Any,
+                              registered: set) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Проверить одну команду пакета. Возвращает (G-code, None) или (None, ошибка).
+        Команда - {"command": "ACE_...", "params": {...}} или строка "ACE_... KEY=VALUE".
+        registered - команды ACE, зарегистрированные в Klippy.
+        """
+        if isinstance(entry, str):
+            if '\n' in entry or '\r' in entry:
+                return None, "Command must be a single line"
+            parts = entry.split()
+            if not parts:
+                return None, "Empty command"
+            command = parts[0].upper()
+            params: Dict[str, Any] = {}
+            for part in parts[1:]:
+                key, sep, value = part.partition('=')
+                if not sep:
+                    return None, f"Parameter '{part}' must be KEY=VALUE"
+                params[key] = value
+        elif isinstance(entry, dict):
+            command = entry.get("command")
+            if not isinstance(command, str):
+                return None, "'command' is required"
+            command = command.strip().upper()
+            params = entry.get("params") or {}
+            if not isinstance(params, dict):
+                return None, "'params' must be an object"
+        else:
+            return None, "Command must be a string or an object"
+        allowed = BATCH_COMMANDS.get(command)
+        if allowed is None:
+            return None, f"'{command}' is not an ACE command available in batches"
+        if command not in registered:
+            return None, f"'{command}' is not registered in Klippy"
+        for key, value in params.items():
+            if str(key).upper() not in allowed:
+                expected = ', '.join(allowed) if allowed else 'none'
+                return None, f"Unknown parameter '{key}' for {command} (expected: {expected})"
+            if not isinstance(value, (str, int, float, bool)):
+                return None, f"Parameter {key} must be a string or a number"
+            if isinstance(value, str) and (not value or _BATCH_BAD_VALUE_RE.search(value)):
+                return None, f"Invalid value for {key}"
+        return self._format_gcode(command, {str(k).upper(): v for k, v in params.items()}), None
+
+    @staticmethod
+    def _is_error_response(line: str) -> bool:
+        # Неизвестный макрос внутри команды ACE: Klipper отвечает
+        # '// Unknown command:"..."' и не прерывает скрипт
+        return (line.startswith(_BATCH_ERROR_PREFIXES)
+                or any(marker in line for marker in _BATCH_ERROR_MARKERS))
+
+    async def handle_batch_request(self, webrequest: WebRequest) -> Dict[str, Any]:
+        """
+        Выполнение пакета команд ACE одним G-code скриптом.
+
+        Все команды проверяются до выполнения: при любой ошибке не выполняется ничего.
+        Между командами вставляется ACE_BATCH_MARK. Метки ничего не выводят: ace.py
+        собирает ответы G-code между ними и присылает их по командам одним вызовом
+        ace_batch_result - ответы консоли и других клиентов в пакет не попадают.
+        """
+        try:
+            json_body = await self._read_json_body(webrequest)
+            commands = json_body.get("commands")
+            if commands is None:
+                try:
+                    commands = webrequest.get_args().get("commands")
+                except Exception:
+                    commands = None
+                if isinstance(commands, str):
+                    try:
+                        commands = json.loads(commands)
+                    except Exception:
+                        return {"success": False, "error": "'commands' is not valid JSON"}
+            if not isinstance(commands, list) or not commands:
+                return {"success": False, "error": "'commands' must be a non-empty list"}
+            if len(commands) > BATCH_MAX_COMMANDS:
+                return {"success": False,
+                        "error": f"Too many commands ({len(commands)} > {BATCH_MAX_COMMANDS})"}
+
+            try:
+                registered = await self._get_klippy_commands()
+            except Exception as e:
+                return {"success": False, "error": f"Could not get Klippy commands: {e}"}
+            gcodes: List[str] = []
+            errors: List[Dict[str, Any]] = []
+            for index, entry in enumerate(commands):
+                gcode_cmd, error = self._validate_batch_entry(entry, registered)
+                if error is not None:
+                    errors.append({"index": index, "error": error})
+                else:
+                    gcodes.append(gcode_cmd)
+            if errors:
+                return {"success": False, "error": "Invalid batch, nothing executed",
+                        "errors": errors}
+
+            token = uuid.uuid4().hex[:12]
+            lines: List[str] = []
+            for index, gcode_cmd in enumerate(gcodes):
+                lines.append(f"ACE_BATCH_MARK TOKEN={token} INDEX={index}")
+                lines.append(gcode_cmd)
+            # Последняя метка отправляет собранные ответы
+            lines.append(f"ACE_BATCH_MARK TOKEN={token} INDEX={len(gcodes)} END=1")
+            done = self.eventloop.create_future()
+            self._batches[token] = done
+            script_error: Optional[str] = None
+            try:
+                await self.klippy_apis.run_gcode("\n".join(lines))
+            except Exception as e:
+                script_error = str(e)
+            batch_result: Dict[str, Any] = {}
+            try:
+                batch_result = await asyncio.wait_for(asyncio.shield(done), BATCH_SETTLE_TIME)
+            except asyncio.TimeoutError:
+                self.logger.info(f"ACE batch {token}: no ace_batch_result from Klippy")
+            finally:
+                self._batches.pop(token, None)
+
+            captured = batch_result.get("responses") or []
+            if script_error is not None and not batch_result.get("failed"):
+                # Скрипт прерван, но ace.py не сообщил, на какой команде (перезапуск
+                # Klippy, обрыв связи, старый ace.py). Часть команд могла уже
+                # выполниться - не угадываем
+                # The script aborted without a result from ace.py: some commands may
+                # already have run on the printer, so their outcome is unknown
+                self.logger.error(f"ACE batch aborted at an unknown command: {script_error}")
+                return {
+                    "success": False,
+                    "error": script_error,
+                    "results": [{"index": index, "command": gcode_cmd,
+                                 "success": False, "status": "unknown"}
+                                for index, gcode_cmd in enumerate(gcodes)],
+                }
+            # Klipper прерывает скрипт на первой ошибке: ace.py сообщает индекс
+            # команды, на которой это случилось, следующие не выполнялись
+            failed_index = batch_result.get("index", 0) if script_error is not None else None
+            results: List[Dict[str, Any]] = []
+            for index, gcode_cmd in enumerate(gcodes):
+                responses = captured[index] if index < len(captured) else []
+                result: Dict[str, Any] = {"index": index, "command": gcode_cmd}
+                if failed_index is not None and index > failed_index:
+                    result.update(success=False, skipped=True)
+                elif index == failed_index:
+                    result.update(success=False, error=script_error, response=responses)
+                else:
+                    failed = [line for line in responses if self._is_error_response(line)]
+                    result["success"] = not failed
+                    result["response"] = responses
+                    if failed:
+                        result["error"] = failed[0]
+                results.append(result)
+            if script_error is not None:
+                self.logger.error(f"ACE batch aborted at command {failed_index}: {script_error}")
+            return {
+                "success": all(r["success"] for r in results),
+                "results": results,
+            }
+        except Exception as e:
+            self.logger.error(f"Error handling ACE batch request: {e}")
+            return {"success": False, "error": str(e)}
+
+    def _handle_batch_result(self, token: str, index: int, failed: bool,
+                             responses: List[List[str]]) -> None:
+        """Результат пакета от ace.py: ответы G-code по командам"""
+        done = self._batches.get(token)
+        if done is not None and not done.done():
+            done.set_result({"index": index, "failed": failed, "responses": responses})
     
+    def _telemetry_sample(self, now: float) -> None:
+        """Отсчёт всех метрик из кэша статуса"""
+        status = self._last_status
+        if status is None or self._status_time == float('-inf'):
+            return
+        view = self._nested_view(status)
+        dryer = view.get('dryer') or {}
+        values = {
+            'temp': view.get('temp'),
+            'fan_speed': view.get('fan_speed'),
+            'feed_assist_count': view.get('feed_assist_count'),
+            'dryer_target_temp': dryer.get('target_temp'),
+            'dryer_remain_time': dryer.get('remain_time'),
+        }
+        slots = view.get('slots') or []
+        for i in range(4):
+            slot = slots[i] if i < len(slots) and isinstance(slots[i], dict) else {}
+            values[f'slot_{i}_status'] = SLOT_STATUS_CODES.get(slot.get('status'), -1)
+        pending = self._telemetry_pending
+        for metric, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                pending.append((metric, now, float(value)))
+
+    async def _flush_telemetry(self, now: float) -> None:
+        rows = self._telemetry_pending
+        self._telemetry_pending = []
+        self._telemetry_last_flush = now
+        try:
+            await self._run_db(self._telemetry.append, rows, now)
+        except Exception as e:
+            self.logger.error(f"Error writing ACE telemetry: {e}")
+
+    async def _handle_telemetry_timer(self, eventtime: float) -> float:
+        now = time.time()
+        self._telemetry_sample(now)
+        if now - self._telemetry_last_flush >= TELEMETRY_FLUSH_INTERVAL:
+            await self._flush_telemetry(now)
+        return eventtime + self.telemetry_sample_interval
+
+    async def handle_telemetry_request(self, webrequest: WebRequest) -> Dict[str, Any]:
+        """
+        История телеметрии: ?metrics=temp,fan_speed&start=-86400&end=&resolution=auto&max_points=1000.
+        start/end - unix-время; отрицательное start - секунды назад от end.
+        Каждая точка - [ts, avg, min, max].
+        """
+        try:
+            now = time.time()
+            metrics_arg = webrequest.get_str('metrics', None)
+            metrics = [m.strip() for m in metrics_arg.split(',') if m.strip()] \
+                if metrics_arg else list(TELEMETRY_METRICS)
+            unknown = [m for m in metrics if m not in TELEMETRY_METRICS]
+            if unknown:
+                return {"error": f"Unknown metrics: {', '.join(unknown)}",
+                        "available": list(TELEMETRY_METRICS)}
+            end = webrequest.get_float('end', now)
+            start = webrequest.get_float('start', -3600.)
+            if start < 0:
+                start = end + start
+            if start >= end:
+                return {"error": "start must be before end"}
+            max_points = min(max(webrequest.get_int('max_points', 1000), 10), 20000)
+            resolution = webrequest.get_str('resolution', 'auto')
+            if resolution == 'auto':
+                resolution = self._telemetry.choose_resolution(
+                    start, end, now, self.telemetry_sample_interval, max_points)
+            elif resolution not in self.telemetry_retention:
+                return {"error": f"Unknown resolution '{resolution}'",
+                        "available": ['auto'] + list(self.telemetry_retention)}
+            # Незаписанные отсчёты тоже нужны сырому ряду
+            if resolution == 'raw' and self._telemetry_pending:
+                await self._flush_telemetry(now)
+            series = await self._run_db(self._telemetry.query, metrics, start, end, resolution)
+            return {
+                "resolution": resolution,
+                "start": start,
+                "end": end,
+                "series": series,
+            }
+        except Exception as e:
+            self.logger.error(f"Error reading ACE telemetry: {e}")
+            return {"error": str(e)}
+
+    def _check_toolchange(self, record: Any) -> None:
+        """Новая запись last_toolchange из статуса -> журнал"""
+        if not isinstance(record, dict) or record.get('seq') is None:
+            return
+        key = (record.get('time'), record.get('seq'))
+        if key == self._last_toolchange_key:
+            return
+        self._last_toolchange_key = key
+        self.eventloop.create_task(self._store_toolchange(record))
+
+    async def _store_toolchange(self, record: Dict[str, Any]) -> None:
+        try:
+            # Повтор той же записи после переподключения отбрасывает UNIQUE (time, seq)
+            await self._run_db(self._toolchanges.add, record)
+        except Exception as e:
+            self.logger.error(f"Error storing ACE tool change: {e}")
+
+    async def _handle_job_state_changed(self, job_event: Any, prev_stats: Dict[str, Any],
+                                        new_stats: Dict[str, Any]) -> None:
+        event = str(getattr(job_event, 'name', job_event)).lower()
+        try:
+            if event == 'started' and not self._print_active:
+                self._print_active = True
+                await self._run_db(self._toolchanges.start_print,
+                                   new_stats.get('filename'), time.time())
+            elif event in ('complete', 'cancelled', 'error', 'standby') and self._print_active:
+                self._print_active = False
+                await self._run_db(self._toolchanges.end_print, event, time.time())
+        except Exception as e:
+            self.logger.error(f"Error tracking print for ACE tool changes: {e}")
+
+    async def handle_toolchanges_request(self, webrequest: WebRequest) -> Dict[str, Any]:
+        """Журнал смен инструмента: ?limit=50&before=<id>&print_id=<id>, новые первыми"""
+        try:
+            limit = min(max(webrequest.get_int('limit', 50), 1), 1000)
+            before = webrequest.get_int('before', None)
+            print_id = webrequest.get_int('print_id', None)
+            toolchanges = await self._run_db(self._toolchanges.history, limit, before, print_id)
+            return {"toolchanges": toolchanges}
+        except Exception as e:
+            self.logger.error(f"Error reading ACE tool changes: {e}")
+            return {"error": str(e)}
+
+    async def handle_toolchange_stats_request(self, webrequest: WebRequest) -> Dict[str, Any]:
+        """Статистика смен: по слоту, по режиму парковки и по последним печатям"""
+        try:
+            prints_limit = min(max(webrequest.get_int('prints', 20), 0), 500)
+            return await self._run_db(self._toolchanges.stats, prints_limit)
+        except Exception as e:
+            self.logger.error(f"Error reading ACE tool change stats: {e}")
+            return {"error": str(e)}
+
+    async def close(self) -> None:
+        if self._telemetry_timer is not None:
+            self._telemetry_timer.stop()
+        if self._telemetry is not None:
+            await self._flush_telemetry(time.time())
+        if self._db_executor is not None:
+            self._db_executor.submit(self._db.close)
+            self._db_executor.shutdown(wait=True)
+            self._db_executor = None
+
+    @staticmethod
+    def _diff(old: Any, new: Any, path: str, changes: Dict[str, Any],
+              removed: List[str]) -> None:
+        """
+        Структурное сравнение: пути вида 'slots.2.status' -> новое значение.
+        Словари и списки одинаковой длины сравниваются поэлементно,
+        остальное заменяется целиком.
+        """
+        if isinstance(old, dict) and isinstance(new, dict):
+            for key, value in new.items():
+                key_path = f"{path}.{key}" if path else str(key)
+                if key not in old:
+                    changes[key_path] = value
+                else:
+                    old_value = old[key]
+                    if old_value is not value and old_value != value:
+                        AceStatus._diff(old_value, value, key_path, changes, removed)
+            for key in old:
+                if key not in new:
+                    removed.append(f"{path}.{key}" if path else str(key))
+        elif isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+            for i, (old_value, value) in enumerate(zip(old, new)):
+                if old_value is not value and old_value != value:
+                    AceStatus._diff(old_value, value, f"{path}.{i}", changes, removed)
+        else:
+            changes[path] = new
+
+    def _schedule_emit(self) -> None:
+        """Отправить изменения сейчас или после event_min_interval с прошлого события"""
+        if self._emit_handle is not None:
+            return
+        wait = self._last_emit_time + self.event_min_interval - self.eventloop.get_loop_time()
+        if wait <= 0:
+            self._emit_changes()
+        else:
+            self._emit_handle = self.eventloop.delay_callback(wait, self._emit_changes)
+
+    def _emit_changes(self) -> None:
+        self._emit_handle = None
+        if self._last_status is None:
+            return
+        if self._status_view is None:
+            self._status_view = self._nested_view(self._last_status)
+        view = self._status_view
+        previous = self._emitted_view
+        changes: Dict[str, Any] = {}
+        removed: List[str] = []
+        if previous is None:
+            changes = dict(view)
+        else:
+            self._diff(previous, view, "", changes, removed)
+        if not changes and not removed:
+            return
+        self._emitted_view = view
+        self._delta_seq += 1
+        self._last_emit_time = self.eventloop.get_loop_time()
+        self.server.send_event("ace:status_delta", {
+            "seq": self._delta_seq,
+            "full": previous is None,
+            "changes": changes,
+            "removed": removed,
+        })
+        # Полный статус для существующих клиентов - только при изменениях
+        self.server.send_event("ace:status_update", view)
+
+    async def _handle_klippy_ready(self) -> None:
+        """Подписка на объект ace: дальше кэш обновляется через server:status_update"""
+        self._subscribed = False
+        try:
+            result = await self.klippy_apis.subscribe_objects({'ace': None})
+        except Exception as e:
+            self.logger.info(f"Could not subscribe to ACE status: {e}")
+            return
+        ace_data = result.get('ace') if isinstance(result, dict) else None
+        if ace_data and isinstance(ace_data, dict):
+            self._set_status(ace_data)
+            self._subscribed = True
+
+    async def _handle_klippy_disconnect(self) -> None:
+        # Кэш больше не обновляется - следующий запрос пойдёт в Klippy
+        self._subscribed = False
+        # После перезапуска набор команд может измениться
+        self._klippy_commands = None
+        self._status_time = float('-inf')
+
     async def _handle_status_update(self, status: Dict[str, Any]) -> None:
         """Обработка обновления статуса принтера"""
         try:
@@ -225,9 +1226,9 @@ class AceStatus:
             ace_data = status.get('ace')
             
             if ace_data:
-                self._last_status = ace_data
-                # Отправляем обновление через WebSocket
-                self.server.send_event("ace:status_update", ace_data)
+                self._set_status(ace_data, partial=True)
+                # Отправляем изменения через WebSocket (с ограничением частоты)
+                self._schedule_emit()
         except Exception as e:
             self.logger.debug(f"Error handling status update: {e}")
 
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# File: ace_bench.py — Benchmarks for the ValgAce protocol and tool-change hot paths
+#
+# Бенчмарки горячих путей ValgAce: CRC, формирование кадра, разбор потока байт,
+# обработка статуса, get_status и полная смена инструмента в виртуальном времени.
+# Результаты пишутся в JSON и сравниваются с сохранённым baseline.
+#
+# Benchmarks the ValgAce hot paths and compares them with a stored baseline.
+# Timings are also expressed relative to a fixed pure-Python calibration loop,
+# so a baseline recorded on one machine stays meaningful on another.
+#
+# Usage:
+#   python3 tools/ace_bench.py                      # run, print table
+#   python3 tools/ace_bench.py --json out.json      # machine-readable results
+#   python3 tools/ace_bench.py --compare            # fail (exit 1) on regression
+#   python3 tools/ace_bench.py --update-baseline    # rewrite tools/bench_baseline.json
+#
+# Кадры запросов дополнительно меряются по памяти (tracemalloc): пик временных
+# выделений на один вызов, рядом с прежним способом сборки кадра.
+# Request framing is also measured for transient allocation (tracemalloc peak
+# per call), next to the previous json.dumps + bytes concatenation builder.
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import struct
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Any, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ace_simulator import AceDevice, encode_frame  # noqa: E402
+from ace_harness import AceHarness, run_tool_changes  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+DEFAULT_TOLERANCE = 0.25
+
+
+class NullSerial:
+    """Write sink used to time framing without a device"""
+    is_open = True
+
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def read(self, size=1):
+        return b''
+
+    def close(self):
+        pass
+
+
+def measure(func: Callable[[], Any], inner: int, rounds: int = 7) -> Dict[str, float]:
+    """Run ``func`` ``inner`` times per round and return per-call nanoseconds"""
+    func()  # warm up
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            start = time.perf_counter_ns()
+            for _ in range(inner):
+                func()
+            samples.append((time.perf_counter_ns() - start) / inner)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return {'ns_per_op': min(samples), 'median_ns': statistics.median(samples), 'ops': inner * rounds}
+
+
+def measure_alloc(func: Callable[[], Any], calls: int = 200) -> float:
+    """Average tracemalloc peak above the starting point for one call, in bytes"""
+    func()  # warm up caches (frame templates, interned strings)
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(calls):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            func()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    return statistics.fmean(peaks)
+
+
+def _legacy_frame(ace, request: Dict[str, Any]) -> bytes:
+    """Frame builder before request templates, kept as a reference for build_frame_*"""
+    payload = json.dumps(request).encode('utf-8')
+    crc = ace._calc_crc(payload)
+    return (bytes([0xFF, 0xAA]) + struct.pack('<H', len(payload)) + payload
+            + struct.pack('<H', crc) + bytes([0xFE]))
+
+
+def _calibration():
+    # Fixed mix of dict/str/int work, representative of the code under test
+    total = 0
+    d = {}
+    for i in range(200):
+        d[str(i)] = i * 3
+        total += d[str(i)] ^ (i << 2)
+    return total
+
+
+def _status_payload(device: AceDevice) -> Dict[str, Any]:
+    device.dryer.update({'status': 'drying', 'target_temp': 50, 'duration': 240, 'remain_time': 13500})
+    response = device.handle_request({'id': 42, 'method': 'get_status'}, 1.0)
+    return response
+
+
+def _noisy_stream(frames: List[bytes], rng: random.Random) -> bytes:
+    out = bytearray()
+    for i, frame in enumerate(frames):
+        if i % 5 == 1:
+            out.extend(bytes(rng.randrange(256) for _ in range(rng.randint(1, 12))))
+        if i % 7 == 3:
+            corrupted = bytearray(frame)
+            corrupted[-3] ^= 0x5a
+            out.extend(corrupted)
+        out.extend(frame)
+    return bytes(out)
+
+
+def build_cases(harness: AceHarness) -> Dict[str, Callable[[], Any]]:
+    ace = harness.ace
+    ace.logger.setLevel(logging.ERROR)
+    device = AceDevice(seed=1)
+    rng = random.Random(1)
+
+    status_response = _status_payload(device)
+    status_frame = encode_frame(status_response)
+    status_payload = json.dumps(status_response).encode('utf-8')
+
+    frames = []
+    for i in range(20):
+        response = dict(status_response)
+        response['id'] = 1000 + i
+        frames.append(encode_frame(response))
+    clean_stream = b''.join(frames)
+    noisy_stream = _noisy_stream(frames, rng)
+    clean_chunks = [clean_stream[i:i + 16] for i in range(0, len(clean_stream), 16)]
+    noisy_chunks = [noisy_stream[i:i + 16] for i in range(0, len(noisy_stream), 16)]
+
+    sink = NullSerial()
+    # Same key order as send_request produces: id is added last
+    status_request = {'method': 'get_status', 'id': 1}
+    assist_request = {'method': 'stop_feed_assist', 'params': {'index': 2}, 'id': 1}
+    ids = iter(range(1, 1 << 62))
+
+    def crc():
+        ace._calc_crc(status_payload)
+
+    def send_status():
+        ace._serial = sink
+        ace._send_request(status_request)
+
+    def send_assist():
+        ace._serial = sink
+        ace._send_request(assist_request)
+
+    def build_status():
+        status_request['id'] = next(ids)
+        ace._build_frame(status_request)
+
+    def build_status_legacy():
+        status_request['id'] = next(ids)
+        _legacy_frame(ace, status_request)
+
+    def build_assist():
+        assist_request['id'] = next(ids)
+        ace._build_frame(assist_request)
+
+    def build_assist_legacy():
+        assist_request['id'] = next(ids)
+        _legacy_frame(ace, assist_request)
+
+    def parse_stream(chunks):
+        def run():
+            ace.read_buffer = bytearray()
+            for chunk in chunks:
+                ace.read_buffer.extend(chunk)
+                ace._process_messages()
+        return run
+
+    # _handle_response mutates the result dict, give it a fresh one each time
+    status_result = status_response['result']
+
+    def handle_status():
+        response = {'id': 7, 'code': 0, 'msg': 'success', 'result': dict(status_result)}
+        ace._handle_response(response)
+
+    # While parking every status frame also goes through the feed assist count check
+    assist_counts = iter(range(1, 1 << 62))
+
+    def handle_parking():
+        ace._park_in_progress = True
+        ace._park_index = 0
+        ace._park_start_time = harness.reactor.monotonic()
+        ace._park_count_increased = True
+        result = dict(status_result, feed_assist_count=next(assist_counts))
+        ace._handle_response({'id': 7, 'code': 0, 'msg': 'success', 'result': result})
+
+    def get_status():
+        ace.get_status(harness.reactor.monotonic())
+
+    ace._handle_response(dict(status_response))
+    return {
+        'calc_crc_status_payload': crc,
+        'send_request_get_status': send_status,
+        'send_request_stop_feed_assist': send_assist,
+        'build_frame_get_status': build_status,
+        'build_frame_get_status_legacy': build_status_legacy,
+        'build_frame_stop_feed_assist': build_assist,
+        'build_frame_stop_feed_assist_legacy': build_assist_legacy,
+        'process_messages_fragmented_20_frames': parse_stream(clean_chunks),
+        'process_messages_noisy_20_frames': parse_stream(noisy_chunks),
+        'handle_response_status': handle_status,
+        'get_status': get_status,
+        'handle_response_parking': handle_parking,   # last: leaves a parking state behind
+        '_frame_bytes': len(status_frame),
+    }
+
+
+INNER = {
+    'calc_crc_status_payload': 500,
+    'send_request_get_status': 2000,
+    'send_request_stop_feed_assist': 2000,
+    'build_frame_get_status': 5000,
+    'build_frame_get_status_legacy': 5000,
+    'build_frame_stop_feed_assist': 5000,
+    'build_frame_stop_feed_assist_legacy': 5000,
+    'process_messages_fragmented_20_frames': 20,
+    'process_messages_noisy_20_frames': 20,
+    'handle_response_status': 2000,
+    'handle_response_parking': 2000,
+    'get_status': 5000,
+}
+
+
+def run_benchmarks(quick: bool = False, changes: int = 100) -> Dict[str, Any]:
+    harness = AceHarness(seed=1)
+    harness.gcode.keep_responses = False
+    logging.getLogger('ace').setLevel(logging.ERROR)
+    if not harness.wait_connected():
+        raise RuntimeError("ValgAce did not connect to the simulator")
+
+    scale = 0.2 if quick else 1.0
+    calibration_inner = max(1, int(1000 * scale))
+    calibration = measure(_calibration, calibration_inner, rounds=15)['ns_per_op']
+    results = {}
+
+    # The end-to-end case uses its own harness so the micro cases see a steady state
+    e2e = AceHarness(seed=2)
+    e2e.gcode.keep_responses = False
+    e2e.wait_connected()
+    e2e_changes = max(5, int(changes * scale))
+    wall_start = time.perf_counter_ns()
+    tc = run_tool_changes(e2e, e2e_changes, seed=2)
+    wall_ns = (time.perf_counter_ns() - wall_start) / e2e_changes
+    results['change_tool_end_to_end'] = {
+        'ns_per_op': wall_ns,
+        'ops': e2e_changes,
+        'virtual_p50_s': tc['duration'].get('p50'),
+        'virtual_p99_s': tc['duration'].get('p99'),
+        'failed': tc['failed'],
+    }
+
+    cases = build_cases(harness)
+    frame_bytes = cases.pop('_frame_bytes')
+    for name, func in cases.items():
+        results[name] = measure(func, max(1, int(INNER[name] * scale)), rounds=11)
+        if name.startswith('build_frame_'):
+            results[name]['alloc_peak_bytes'] = measure_alloc(func)
+
+    # Calibrate again after the cases and keep the faster run, so a burst of
+    # background load during one of them does not skew every relative figure
+    calibration = min(calibration, measure(_calibration, calibration_inner, rounds=15)['ns_per_op'])
+    for result in results.values():
+        result['relative'] = result['ns_per_op'] / calibration
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'calibration_ns': calibration,
+            'status_frame_bytes': frame_bytes,
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return a list of regressions (relative time worse than baseline by > tolerance)"""
+    regressions = []
+    for name, base in baseline.get('results', {}).items():
+        cur = current['results'].get(name)
+        if cur is None:
+            continue
+        ratio = cur['relative'] / base['relative'] if base.get('relative') else 1.0
+        cur['vs_baseline'] = ratio
+        if ratio > 1.0 + tolerance:
+            regressions.append(f"{name}: {ratio:.2f}x baseline")
+    return regressions
+
+
+def print_table(report: Dict[str, Any]):
+    print(f"{'benchmark':42} {'ns/op':>12} {'relative':>9} {'vs base':>8} {'alloc B':>8}")
+    for name, r in report['results'].items():
+        vs = f"{r['vs_baseline']:.2f}x" if 'vs_baseline' in r else '-'
+        alloc = f"{r['alloc_peak_bytes']:.0f}" if 'alloc_peak_bytes' in r else '-'
+        print(f"{name:42} {r['ns_per_op']:12.0f} {r['relative']:9.3f} {vs:>8} {alloc:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ValgAce hot path benchmarks')
+    parser.add_argument('--json', metavar='PATH', help="write results as JSON ('-' for stdout)")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--compare', action='store_true', help='exit 1 if slower than baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations')
+    parser.add_argument('--changes', type=int, default=100, help='tool changes in the end-to-end case')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    report = run_benchmarks(quick=args.quick, changes=args.changes)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+
+    if args.json == '-':
+        print(json.dumps(report, indent=2))
+    else:
+        print_table(report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+
+    if regressions:
+        print("Performance regressions:", file=sys.stderr)
+        for line in regressions:
+            print(f"  {line}", file=sys.stderr)
+        if args.compare:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
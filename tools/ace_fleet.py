@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# File: ace_fleet.py — Poll /server/ace/status on many printers at once
+#
+# Опрашивает компонент Moonraker ace_status на многих принтерах параллельно
+# и выводит сводную таблицу или JSON: статус ACE, слоты, сушка, ошибки.
+# Подходит для проверки готовности слотов перед отправкой заданий в парк.
+#
+# Polls the Moonraker ace_status component on many printers concurrently and
+# prints one table (or JSON) with slot states, dryer status and errors.
+#
+# - asyncio + stdlib only: a small HTTP/1.1 client with keep-alive, so --watch
+#   reuses one connection per printer and sends if_none_match, which makes an
+#   idle printer answer with a few bytes
+# - bounded concurrency (--concurrency) and a per-host timeout (--timeout)
+# - --require-tools checks the given Klipper tool indices through slot_mapping
+# - --stub N starts N local fake Moonraker servers to try the tool without printers
+#
+# Usage:
+#   python3 tools/ace_fleet.py printer1 printer2:7125 http://10.0.0.12:7125
+#   python3 tools/ace_fleet.py --hosts-file fleet.txt --require-tools 0,2 --json
+#   python3 tools/ace_fleet.py --hosts-file fleet.txt --watch 10
+#   python3 tools/ace_fleet.py --stub 20
+#
+# Exit code 1 when a host fails or a required tool is not ready.
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from typing import Optional, Dict, Any, List, Tuple
+from urllib.parse import urlsplit, quote
+
+DEFAULT_PORT = 7125
+STATUS_PATH = '/server/ace/status'
+MAX_BODY = 4 * 1024 * 1024
+
+
+class HttpError(Exception):
+    pass
+
+
+def parse_host(spec: str) -> Tuple[str, int, str]:
+    """'host', 'host:port' or 'http://host:port' -> (host, port, name)"""
+    spec = spec.strip()
+    if '://' not in spec:
+        spec = 'http://' + spec
+    parts = urlsplit(spec)
+    if parts.scheme != 'http':
+        raise ValueError(f"only http:// is supported: {spec}")
+    if not parts.hostname:
+        raise ValueError(f"no host in {spec}")
+    port = parts.port or DEFAULT_PORT
+    return parts.hostname, port, f"{parts.hostname}:{port}"
+
+
+class HttpConnection:
+    """
+    Одно соединение HTTP/1.1 keep-alive. Запросы идут последовательно; если
+    сервер закрыл соединение между запросами, запрос повторяется на новом.
+    One keep-alive HTTP/1.1 connection, reconnected when the server closes it.
+    """
+
+    def __init__(self, host: str, port: int, headers: Optional[Dict[str, str]] = None):
+        self.host = host
+        self.port = port
+        self.headers = headers or {}
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.connects = 0
+        self.requests = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def _open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.connects += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def get(self, path: str) -> Tuple[int, Dict[str, str], bytes]:
+        reused = self.is_open
+        if not reused:
+            await self._open()
+        try:
+            return await self._request(path)
+        except (ConnectionError, asyncio.IncompleteReadError, HttpError):
+            self.close()
+            if not reused:
+                raise
+        # Сервер закрыл простаивающее соединение - один повтор на новом
+        await self._open()
+        return await self._request(path)
+
+    async def _request(self, path: str) -> Tuple[int, Dict[str, str], bytes]:
+        lines = [f"GET {path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                 "Accept: application/json", "Connection: keep-alive"]
+        lines.extend(f"{k}: {v}" for k, v in self.headers.items())
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        await self.writer.drain()
+        self.requests += 1
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise HttpError("connection closed")
+        parts = status_line.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise HttpError(f"bad status line: {status_line[:60]!r}")
+        status = int(parts[1])
+        headers: Dict[str, str] = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                body.extend(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+                if len(body) > MAX_BODY:
+                    raise HttpError("response too large")
+            body = bytes(body)
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length > MAX_BODY:
+                raise HttpError("response too large")
+            body = await self.reader.readexactly(length)
+        else:
+            body = await self.reader.read(MAX_BODY)
+            self.close()
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, headers, body
+
+
+def summarize(status: Dict[str, Any], require_tools: List[int]) -> Dict[str, Any]:
+    """Сжатый вид статуса ACE для таблицы / Condensed view of one ACE status"""
+    slots = status.get('slots') or []
+    dryer = status.get('dryer') or status.get('dryer_status') or {}
+    mapping = status.get('slot_mapping')
+    summary = {
+        'ace_status': status.get('status', 'unknown'),
+        'temp': status.get('temp'),
+        'slots': [
+            {'index': s.get('index', i), 'status': s.get('status', 'unknown'),
+             'type': s.get('type', ''), 'color': s.get('color')}
+            for i, s in enumerate(slots) if isinstance(s, dict)
+        ],
+        'dryer': {'status': dryer.get('status', 'stop'),
+                  'target_temp': dryer.get('target_temp', 0),
+                  'remain_time': dryer.get('remain_time', 0)},
+        'problems': [],
+    }
+    for tool in require_tools:
+        # slot_mapping - список: индекс инструмента -> слот (index_to_slot в ace.py);
+        # без него инструмент совпадает со слотом
+        if mapping is None:
+            slot = tool
+        elif isinstance(mapping, list) and 0 <= tool < len(mapping):
+            slot = mapping[tool]
+        else:
+            slot = None
+        if not isinstance(slot, int) or not 0 <= slot < len(summary['slots']):
+            summary['problems'].append(f"T{tool}: no slot")
+            continue
+        slot_status = summary['slots'][slot]['status']
+        if slot_status != 'ready':
+            summary['problems'].append(f"T{tool}: slot {slot} {slot_status}")
+    if require_tools and summary['dryer']['status'] == 'drying':
+        summary['problems'].append("dryer running")
+    return summary
+
+
+class FleetPoller:
+    """
+    Параллельный опрос парка. Соединения и ETag хранятся между вызовами
+    poll(), поэтому повторный опрос простаивающего принтера почти бесплатен.
+    """
+
+    def __init__(self, hosts: List[str], concurrency: int = 16, timeout: float = 5.,
+                 api_key: Optional[str] = None, require_tools: Optional[List[int]] = None):
+        headers = {'X-Api-Key': api_key} if api_key else {}
+        self.hosts: List[Tuple[str, int, str]] = [parse_host(h) for h in hosts]
+        self.timeout = timeout
+        self.require_tools = require_tools or []
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._connections = {name: HttpConnection(host, port, headers)
+                             for host, port, name in self.hosts}
+        self._etags: Dict[str, str] = {}
+        self._last: Dict[str, Dict[str, Any]] = {}
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.close()
+
+    async def _fetch(self, name: str) -> Dict[str, Any]:
+        conn = self._connections[name]
+        path = STATUS_PATH
+        etag = self._etags.get(name)
+        if etag and name in self._last:
+            path += '?if_none_match=' + quote(etag)
+        status, _, body = await conn.get(path)
+        if status != 200:
+            raise HttpError(f"HTTP {status}")
+        data = json.loads(body)
+        result = data.get('result', data) if isinstance(data, dict) else None
+        if not isinstance(result, dict):
+            raise HttpError("unexpected response")
+        if result.get('error'):
+            raise HttpError(str(result['error']))
+        if result.get('not_modified') and name in self._last:
+            return self._last[name]
+        if result.get('etag'):
+            self._etags[name] = result['etag']
+        self._last[name] = result
+        return result
+
+    async def _poll_host(self, name: str) -> Dict[str, Any]:
+        async with self._semaphore:
+            start = time.monotonic()
+            entry: Dict[str, Any] = {'host': name}
+            try:
+                status = await asyncio.wait_for(self._fetch(name), self.timeout)
+            except asyncio.TimeoutError:
+                # Ответ мог прийти частично - соединение больше не годится
+                self._connections[name].close()
+                entry.update(ok=False, error=f"timeout after {self.timeout:g}s")
+            except OSError as e:
+                self._connections[name].close()
+                entry.update(ok=False, error=str(e) or type(e).__name__)
+            except (HttpError, ValueError) as e:
+                # Ответ прочитан целиком (или соединение уже закрыто) - его можно переиспользовать
+                entry.update(ok=False, error=str(e) or type(e).__name__)
+            else:
+                entry.update(ok=True, error=None, version=status.get('version'))
+                entry.update(summarize(status, self.require_tools))
+            entry['latency_ms'] = round((time.monotonic() - start) * 1000., 1)
+            return entry
+
+    async def poll(self) -> List[Dict[str, Any]]:
+        return list(await asyncio.gather(*(self._poll_host(name) for _, _, name in self.hosts)))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'connects': sum(c.connects for c in self._connections.values()),
+            'requests': sum(c.requests for c in self._connections.values()),
+        }
+
+
+def _slot_cell(slot: Dict[str, Any]) -> str:
+    status = slot['status']
+    if status == 'ready':
+        return slot['type'] or 'ready'
+    return status
+
+
+def print_table(results: List[Dict[str, Any]], out=sys.stdout):
+    header = f"{'host':24} {'ace':8} {'T0':8} {'T1':8} {'T2':8} {'T3':8} {'dryer':14} {'ms':>7}  problems"
+    print(header, file=out)
+    for r in results:
+        if not r['ok']:
+            print(f"{r['host']:24} {'ERROR':8} {'':35} {'':14} {r['latency_ms']:7.0f}  {r['error']}",
+                  file=out)
+            continue
+        cells = [_slot_cell(s) for s in r['slots'][:4]] + [''] * (4 - min(len(r['slots']), 4))
+        dryer = r['dryer']
+        dryer_cell = 'off' if dryer['status'] != 'drying' else \
+            f"{dryer['target_temp']}C {int(dryer['remain_time'] or 0)}m"
+        problems = ', '.join(r['problems'])
+        print(f"{r['host']:24} {r['ace_status']:8} " + ' '.join(f"{c[:8]:8}" for c in cells) +
+              f" {dryer_cell:14} {r['latency_ms']:7.0f}  {problems}", file=out)
+
+
+# --- Stub Moonraker servers ---------------------------------------------------
+
+def stub_status(rng: random.Random) -> Dict[str, Any]:
+    statuses = ['ready', 'ready', 'ready', 'empty', 'busy']
+    types = ['PLA', 'PETG', 'ABS', 'TPU']
+    drying = rng.random() < .2
+    return {
+        'status': 'ready',
+        'temp': 25 + (rng.random() * 20 if drying else 0),
+        'dryer': {'status': 'drying' if drying else 'stop', 'target_temp': 50 if drying else 0,
+                  'duration': 240 if drying else 0, 'remain_time': rng.randint(0, 240) if drying else 0},
+        'slots': [{'index': i, 'status': rng.choice(statuses), 'type': rng.choice(types),
+                   'color': [rng.randrange(256) for _ in range(3)], 'sku': '', 'rfid': 0}
+                  for i in range(4)],
+        'slot_mapping': list(range(4)),
+    }
+
+
+class StubMoonraker:
+    """
+    Минимальный HTTP/1.1 сервер с /server/ace/status (keep-alive, if_none_match)
+    для проверки опроса без принтеров. ``delay`` - задержка ответа, ``fail`` -
+    отвечать 503.
+    """
+
+    def __init__(self, status: Dict[str, Any], delay: float = 0., fail: bool = False):
+        self.status = status
+        self.version = 1
+        self.delay = delay
+        self.fail = fail
+        self.connections = 0
+        self.requests = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+
+    def update(self, status: Dict[str, Any]):
+        self.status = status
+        self.version += 1
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                self.requests += 1
+                path = request_line.split()[1].decode('latin-1')
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                etag = f'"stub-{self.version}"'
+                if self.fail:
+                    code, payload = 503, {'error': {'code': 503, 'message': 'Klippy not ready'}}
+                elif not path.startswith(STATUS_PATH):
+                    code, payload = 404, {'error': {'code': 404, 'message': 'Not Found'}}
+                elif quote(etag) in path or etag in path:
+                    code, payload = 200, {'result': {'version': self.version, 'etag': etag,
+                                                     'not_modified': True}}
+                else:
+                    code, payload = 200, {'result': {**self.status, 'version': self.version,
+                                                     'etag': etag}}
+                body = json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {code} OK\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+async def start_stubs(count: int, seed: int = 1) -> List[StubMoonraker]:
+    rng = random.Random(seed)
+    stubs = []
+    for i in range(count):
+        # Один медленный и один неисправный, чтобы было видно таймаут и ошибку
+        delay = 30. if count > 2 and i == count - 1 else rng.random() * .05
+        stub = StubMoonraker(stub_status(rng), delay=delay, fail=count > 2 and i == count - 2)
+        stubs.append(await stub.start())
+    return stubs
+
+
+async def run(args) -> int:
+    stubs: List[StubMoonraker] = []
+    hosts = list(args.hosts)
+    if args.hosts_file:
+        with open(args.hosts_file) as f:
+            hosts.extend(line.split('#')[0].strip() for line in f)
+    hosts = [h for h in hosts if h]
+    if args.stub:
+        stubs = await start_stubs(args.stub)
+        hosts.extend(f"127.0.0.1:{s.port}" for s in stubs)
+    if not hosts:
+        print("No hosts given", file=sys.stderr)
+        return 2
+    require = [int(t) for t in args.require_tools.split(',') if t.strip()] if args.require_tools else []
+    poller = FleetPoller(hosts, args.concurrency, args.timeout, args.api_key, require)
+    try:
+        while True:
+            start = time.monotonic()
+            results = await poller.poll()
+            elapsed = time.monotonic() - start
+            failed = sum(1 for r in results if not r['ok'])
+            not_ready = sum(1 for r in results if r['ok'] and r['problems'])
+            if args.json:
+                print(json.dumps({'time': time.time(), 'elapsed': round(elapsed, 3),
+                                  'hosts': results, **poller.stats()}, indent=None if args.watch else 2))
+            else:
+                print_table(results)
+                print(f"{len(results)} hosts in {elapsed:.2f}s: {failed} failed, {not_ready} with problems "
+                      f"({poller.stats()['connects']} connections, {poller.stats()['requests']} requests)")
+            if not args.watch:
+                return 1 if failed or not_ready else 0
+            await asyncio.sleep(max(0., args.watch - elapsed))
+            if not args.json:
+                print()
+    finally:
+        poller.close()
+        for stub in stubs:
+            stub.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Poll ValgACE status on many Moonraker hosts')
+    parser.add_argument('hosts', nargs='*', help='host, host:port or http://host:port')
+    parser.add_argument('--hosts-file', help='file with one host per line (# comments allowed)')
+    parser.add_argument('--concurrency', type=int, default=16, help='parallel requests (default 16)')
+    parser.add_argument('--timeout', type=float, default=5., help='per-host timeout, seconds')
+    parser.add_argument('--api-key', help='Moonraker API key (X-Api-Key)')
+    parser.add_argument('--require-tools', metavar='0,2,3',
+                        help='report hosts where these tools are not ready or the dryer runs')
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help='poll again every SECONDS, reusing connections')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--stub', type=int, default=0, metavar='N',
+                        help='also start N local stub Moonraker servers and poll them')
+    args = parser.parse_args(argv)
+    try:
+        return asyncio.run(run(args))
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,645 @@
+#!/usr/bin/env python3
+# File: ace_harness.py — Virtual-time harness for running ValgAce outside Klipper
+#
+# Загружает extras/ace.py без изменений и запускает его с поддельными объектами
+# Klipper (reactor, gcode, toolhead, save_variables, filament sensor) и
+# эмулятором ACE из ace_simulator.py. Время виртуальное: reactor сразу
+# перескакивает к следующему таймеру, поэтому тысячи смен инструмента
+# выполняются за секунды.
+#
+# Loads extras/ace.py unchanged and runs it against fake Klipper objects and
+# the in-process ACE simulator. Time is virtual: the reactor jumps straight to
+# the next due timer, so thousands of tool changes run in seconds.
+#
+# Usage:
+#   python3 tools/ace_harness.py --changes 1000
+#   python3 tools/ace_harness.py --changes 500 --aggressive --sensor --json
+
+import argparse
+import heapq
+import importlib.util
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+from typing import Optional, Dict, Any, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ace_simulator import AceDevice, FaultConfig, SimulatedLink  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ACE_MODULE_PATH = os.path.join(REPO_ROOT, 'extras', 'ace.py')
+
+_SENTINEL = object()
+
+
+def load_ace_module(path: str = ACE_MODULE_PATH):
+    """Import extras/ace.py as a standalone module (each call gives a fresh copy)"""
+    spec = importlib.util.spec_from_file_location('ace', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class ConfigError(Exception):
+    pass
+
+
+class GCodeError(Exception):
+    pass
+
+
+# ============================================================
+# Reactor
+# ============================================================
+
+class VirtualTimer:
+    def __init__(self, callback, waketime):
+        self.callback = callback
+        self.waketime = waketime
+
+
+class VirtualReactor:
+    """
+    Single-threaded stand-in for Klipper's reactor running on virtual time.
+    ``pause`` runs every timer due before the wake time and then jumps the
+    clock, which is what Klipper's greenlet-based pause looks like from the
+    point of view of a G-code handler.
+    """
+    NOW = 0.
+    NEVER = 9999999999999999.
+
+    def __init__(self, start_time: float = 100.0):
+        self._now = start_time
+        self._heap = []
+        self._seq = 0
+        self.timer_calls = 0
+
+    def monotonic(self) -> float:
+        return self._now
+
+    def register_timer(self, callback, waketime=NEVER):
+        timer = VirtualTimer(callback, waketime)
+        self._push(timer)
+        return timer
+
+    def update_timer(self, timer, waketime):
+        timer.waketime = waketime
+        self._push(timer)
+
+    def unregister_timer(self, timer):
+        timer.waketime = self.NEVER
+        timer.callback = None
+
+    def register_fd(self, fd, callback):
+        return None
+
+    def unregister_fd(self, handle):
+        pass
+
+    def _push(self, timer):
+        if timer.waketime < self.NEVER:
+            self._seq += 1
+            heapq.heappush(self._heap, (timer.waketime, self._seq, timer))
+
+    def timer_count(self) -> int:
+        return len({id(t) for _, _, t in self._heap if t.callback is not None and t.waketime < self.NEVER})
+
+    def pause(self, waketime: float) -> float:
+        self.run_until(waketime)
+        return self._now
+
+    def run_until(self, end_time: float):
+        heap = self._heap
+        while heap and heap[0][0] <= end_time:
+            waketime, _, timer = heapq.heappop(heap)
+            if timer.callback is None or timer.waketime != waketime:
+                continue  # unregistered or rescheduled since it was pushed
+            if waketime > self._now:
+                self._now = waketime
+            # Mark as running so a nested pause does not fire it again
+            timer.waketime = self.NEVER
+            self.timer_calls += 1
+            next_time = timer.callback(self._now)
+            if timer.callback is not None and timer.waketime == self.NEVER:
+                timer.waketime = next_time
+                self._push(timer)
+        if end_time > self._now:
+            self._now = end_time
+
+    def run_for(self, duration: float):
+        self.run_until(self._now + duration)
+
+
+# ============================================================
+# Fake Klipper objects
+# ============================================================
+
+class FakeConfig:
+    def __init__(self, printer, name: str, options: Dict[str, Any]):
+        self._printer = printer
+        self._name = name
+        self._options = options
+
+    def get_printer(self):
+        return self._printer
+
+    def get_name(self):
+        return self._name
+
+    def _get(self, option, default, parser, minval=None, maxval=None):
+        if option in self._options:
+            value = parser(self._options[option])
+        elif default is _SENTINEL:
+            raise ConfigError(f"Option '{option}' in section '{self._name}' must be specified")
+        else:
+            return default
+        if minval is not None and value < minval:
+            raise ConfigError(f"Option '{option}' must have minimum of {minval}")
+        if maxval is not None and value > maxval:
+            raise ConfigError(f"Option '{option}' must have maximum of {maxval}")
+        return value
+
+    def get(self, option, default=_SENTINEL):
+        return self._get(option, default, str)
+
+    def getint(self, option, default=_SENTINEL, minval=None, maxval=None):
+        return self._get(option, default, int, minval, maxval)
+
+    def getfloat(self, option, default=_SENTINEL, minval=None, maxval=None,
+                 above=None, below=None):
+        return self._get(option, default, float, minval, maxval)
+
+    def getboolean(self, option, default=_SENTINEL):
+        def parse(value):
+            if isinstance(value, str):
+                return value.strip().lower() in ('1', 'true', 'yes', 'on')
+            return bool(value)
+        return self._get(option, default, parse)
+
+    def getchoice(self, option, choices, default=_SENTINEL):
+        def parse(value):
+            if value not in choices:
+                raise ConfigError(f"Choice '{value}' for option '{option}' in section '{self._name}' is not a valid choice")
+            return choices[value]
+        return self._get(option, default, parse)
+
+    def get_prefix_options(self, prefix):
+        return [o for o in self._options if o.startswith(prefix)]
+
+
+class FakeGCodeCommand:
+    error = GCodeError
+
+    def __init__(self, gcode, command: str, params: Dict[str, str]):
+        self._gcode = gcode
+        self._command = command
+        self._params = params
+
+    def get_command(self):
+        return self._command
+
+    def get_command_parameters(self):
+        return dict(self._params)
+
+    def get(self, name, default=_SENTINEL, parser=str, minval=None, maxval=None):
+        value = self._params.get(name)
+        if value is None:
+            if default is _SENTINEL:
+                raise GCodeError(f"Error on '{self._command}': missing {name}")
+            return default
+        try:
+            value = parser(value)
+        except (ValueError, TypeError):
+            raise GCodeError(f"Error on '{self._command}': unable to parse {name}")
+        if minval is not None and value < minval:
+            raise GCodeError(f"Error on '{self._command}': {name} must have minimum of {minval}")
+        if maxval is not None and value > maxval:
+            raise GCodeError(f"Error on '{self._command}': {name} must have maximum of {maxval}")
+        return value
+
+    def get_int(self, name, default=_SENTINEL, minval=None, maxval=None):
+        return self.get(name, default, int, minval, maxval)
+
+    def get_float(self, name, default=_SENTINEL, minval=None, maxval=None,
+                  above=None, below=None):
+        return self.get(name, default, float, minval, maxval)
+
+    def respond_info(self, msg, log=True):
+        self._gcode.respond_info(msg)
+
+    def respond_raw(self, msg):
+        self._gcode.respond_raw(msg)
+
+
+class FakeGCode:
+    """Dispatches registered commands, records everything else as a macro call"""
+    def __init__(self, printer=None):
+        self.printer = printer
+        self.commands = {}
+        self.responses: List[str] = []
+        self.errors: List[str] = []
+        self.macro_calls: List[str] = []
+        self.keep_responses = True
+        self.output_handlers = []
+
+    def register_command(self, name, func, when_not_ready=False, desc=None):
+        self.commands[name.upper()] = func
+
+    def register_output_handler(self, cb):
+        self.output_handlers.append(cb)
+
+    def respond_info(self, msg, log=True):
+        if self.keep_responses:
+            self.responses.append(msg)
+        lines = [line.strip() for line in msg.strip().split('\n')]
+        self._output("// " + "\n// ".join(lines))
+
+    def respond_raw(self, msg):
+        if self.keep_responses:
+            self.responses.append(msg)
+        if 'Error' in msg or 'error' in msg or 'CRITICAL' in msg:
+            self.errors.append(msg)
+        self._output(msg)
+
+    def _output(self, msg):
+        for cb in self.output_handlers:
+            cb(msg)
+
+    def _parse(self, line: str):
+        parts = line.split()
+        command = parts[0].upper()
+        params = {}
+        for part in parts[1:]:
+            if '=' in part:
+                key, value = part.split('=', 1)
+                params[key.upper()] = value.strip('"')
+        return command, params
+
+    def run_script_from_command(self, script: str):
+        for line in script.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            command, params = self._parse(line)
+            func = self.commands.get(command)
+            if func is None:
+                self.macro_calls.append(line)
+                continue
+            try:
+                func(FakeGCodeCommand(self, command, params))
+            except GCodeError as e:
+                # Like Klipper: report, notify, abort the rest of the script
+                self.respond_raw(f"!! {e}")
+                if self.printer is not None:
+                    self.printer.send_event('gcode:command_error')
+                raise
+
+    run_script = run_script_from_command
+
+
+class FakeWebhooks:
+    """Records remote method calls (action_call_remote_method) for Moonraker"""
+    def __init__(self):
+        self.remote_calls: List[Tuple[str, Dict[str, Any]]] = []
+
+    def call_remote_method(self, method, **kwargs):
+        self.remote_calls.append((method, kwargs))
+
+
+class FakeSaveVariables:
+    def __init__(self, gcode: FakeGCode):
+        self.allVariables = {}
+        gcode.register_command('SAVE_VARIABLE', self.cmd_SAVE_VARIABLE)
+
+    def cmd_SAVE_VARIABLE(self, gcmd):
+        name = gcmd.get('VARIABLE')
+        value = gcmd.get('VALUE')
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        self.allVariables[name] = value
+
+
+class FakeToolhead:
+    def __init__(self, reactor: VirtualReactor):
+        self.reactor = reactor
+        self.wait_moves_calls = 0
+
+    def wait_moves(self):
+        self.wait_moves_calls += 1
+
+    def dwell(self, delay: float):
+        self.reactor.pause(self.reactor.monotonic() + delay)
+
+    def get_last_move_time(self):
+        return self.reactor.monotonic()
+
+
+class FakeFilamentSensor:
+    """Filament switch sensor backed by the simulator's filament positions"""
+    def __init__(self, device: AceDevice):
+        self.device = device
+        self.enabled = True
+
+    def get_status(self, eventtime):
+        return {'filament_detected': self.device.filament_at_sensor(), 'enabled': self.enabled}
+
+
+class FakePrintStats:
+    def __init__(self):
+        self.state = 'standby'
+        self.filename = ''
+
+    def get_status(self, eventtime):
+        return {'state': self.state, 'filename': self.filename}
+
+
+class FakeIdleTimeout:
+    def __init__(self, print_stats: FakePrintStats):
+        self.print_stats = print_stats
+
+    def get_status(self, eventtime):
+        return {'state': 'Printing' if self.print_stats.state == 'printing' else 'Idle'}
+
+
+class FakeMCU:
+    def __init__(self, reactor):
+        self.reactor = reactor
+
+    def estimated_print_time(self, eventtime):
+        return eventtime
+
+
+class FakePrinter:
+    config_error = ConfigError
+    command_error = GCodeError
+
+    def __init__(self, reactor: VirtualReactor):
+        self.reactor = reactor
+        self.objects = {}
+        self.event_handlers = {}
+        self.shutdown_reason = None
+
+    def get_reactor(self):
+        return self.reactor
+
+    def get_start_args(self):
+        return {}
+
+    def add_object(self, name, obj):
+        self.objects[name] = obj
+
+    def lookup_object(self, name, default=_SENTINEL):
+        if name in self.objects:
+            return self.objects[name]
+        if default is _SENTINEL:
+            raise ConfigError(f"Unknown config object '{name}'")
+        return default
+
+    def lookup_objects(self, module=None):
+        if module is None:
+            return list(self.objects.items())
+        prefix = module + ' '
+        return [(n, o) for n, o in self.objects.items() if n == module or n.startswith(prefix)]
+
+    def register_event_handler(self, event, callback):
+        self.event_handlers.setdefault(event, []).append(callback)
+
+    def send_event(self, event, *params):
+        return [cb(*params) for cb in self.event_handlers.get(event, [])]
+
+    def invoke_shutdown(self, msg):
+        self.shutdown_reason = msg
+
+
+class FakeSerial:
+    """pyserial-compatible port backed by a SimulatedLink"""
+    def __init__(self, link: SimulatedLink):
+        self.link = link
+        self.is_open = True
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    @property
+    def in_waiting(self):
+        return self.link.available()
+
+    def read(self, size=1):
+        data = self.link.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self.link.write(bytes(data))
+
+    def close(self):
+        self.is_open = False
+
+
+# ============================================================
+# Harness
+# ============================================================
+
+class AceHarness:
+    """
+    Wires a ValgAce instance to fake Klipper objects and an in-process AceDevice.
+    ``config`` overrides [ace] options; ``device_options`` are passed to AceDevice.
+    ``link`` replaces the simulated device with any object offering
+    ``write``/``read``/``available`` (see ace_replay.ReplayLink), and
+    ``filament_sensor`` replaces the simulated sensor.
+    """
+    def __init__(self, config: Optional[Dict[str, Any]] = None, seed: int = 0,
+                 faults: Optional[FaultConfig] = None, sensor: bool = False,
+                 device_options: Optional[Dict[str, Any]] = None, ace_module=None,
+                 start_time: float = 100.0, link=None, filament_sensor=None):
+        self.reactor = VirtualReactor(start_time)
+        self.printer = FakePrinter(self.reactor)
+        self.gcode = FakeGCode(self.printer)
+        self.printer.add_object('gcode', self.gcode)
+        self.webhooks = FakeWebhooks()
+        self.printer.add_object('webhooks', self.webhooks)
+        self.save_variables = FakeSaveVariables(self.gcode)
+        self.printer.add_object('save_variables', self.save_variables)
+        self.toolhead = FakeToolhead(self.reactor)
+        self.printer.add_object('toolhead', self.toolhead)
+        self.print_stats = FakePrintStats()
+        self.printer.add_object('print_stats', self.print_stats)
+        self.printer.add_object('idle_timeout', FakeIdleTimeout(self.print_stats))
+        self.printer.add_object('mcu', FakeMCU(self.reactor))
+
+        if link is None:
+            self.device = AceDevice(seed=seed, faults=faults, **(device_options or {}))
+            self.link = SimulatedLink(self.device, self.reactor.monotonic)
+        else:
+            self.device = None
+            self.link = link
+        self.serial_ports: List[FakeSerial] = []
+
+        options = {'serial': '/dev/ttyACE_SIM',
+                   'flight_recorder_file': os.path.join(tempfile.gettempdir(), 'ace_harness_trace.bin')}
+        if sensor and filament_sensor is None:
+            filament_sensor = FakeFilamentSensor(self.device)
+        if filament_sensor is not None:
+            self.printer.add_object('filament_switch_sensor sim_sensor', filament_sensor)
+            options['filament_sensor'] = 'sim_sensor'
+        options.update(config or {})
+
+        self.module = ace_module or load_ace_module()
+        # Only the port constructor is replaced; pyserial itself is still required
+        self.module.serial = types.SimpleNamespace(Serial=self._open_serial)
+        self.ace = self.module.load_config(FakeConfig(self.printer, 'ace', options))
+        self.printer.add_object('ace', self.ace)
+        self.printer.send_event('klippy:connect')
+        self.printer.send_event('klippy:ready')
+
+    def _open_serial(self, port=None, baudrate=None, timeout=None, write_timeout=None, **kw):
+        port_obj = FakeSerial(self.link)
+        self.serial_ports.append(port_obj)
+        return port_obj
+
+    def run_for(self, duration: float):
+        self.reactor.run_for(duration)
+
+    def wait_connected(self, timeout: float = 10.0) -> bool:
+        end = self.reactor.monotonic() + timeout
+        while not self.ace._connected and self.reactor.monotonic() < end:
+            self.reactor.run_for(0.1)
+        # Let the first status frame arrive
+        self.reactor.run_for(1.5)
+        return self.ace._connected
+
+    def run_gcode(self, script: str):
+        self.gcode.run_script_from_command(script)
+
+    def change_tool(self, tool: int) -> Dict[str, Any]:
+        """
+        Run ACE_CHANGE_TOOL and report virtual duration and outcome. A change
+        fails on an error response, on a last_toolchange record with
+        success=False, or when a park error was flagged even if nothing
+        was reported to the console
+        """
+        errors_before = len(self.gcode.errors)
+        seq_before = self.ace._toolchange_seq
+        start = self.reactor.monotonic()
+        self.run_gcode(f"ACE_CHANGE_TOOL TOOL={tool}")
+        duration = self.reactor.monotonic() - start
+        errors = self.gcode.errors[errors_before:]
+        record = self.ace._last_toolchange if self.ace._toolchange_seq != seq_before else None
+        if errors:
+            error = errors[0]
+        elif record is not None and not record['success']:
+            error = f"last_toolchange error: {record['error']}"
+        elif self.ace._park_error:
+            error = "park error flagged"
+        else:
+            error = None
+        return {'tool': tool, 'duration': duration, 'ok': error is None, 'error': error}
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+    return {
+        'count': len(ordered),
+        'min': ordered[0],
+        'mean': statistics.fmean(ordered),
+        'p50': pct(50),
+        'p90': pct(90),
+        'p99': pct(99),
+        'max': ordered[-1],
+    }
+
+
+def run_tool_changes(harness: AceHarness, changes: int, seed: int = 0) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    durations, failures = [], []
+    wall_start = time.perf_counter()
+    virtual_start = harness.reactor.monotonic()
+    current = harness.ace.variables.get('ace_current_index', -1)
+    for _ in range(changes):
+        ready = [i for i in range(4) if harness.device.slots[harness.ace._get_real_slot(i)]['status'] == 'ready']
+        choices = [i for i in ready if i != current] or [-1]
+        tool = rng.choice(choices)
+        result = harness.change_tool(tool)
+        if result['ok']:
+            durations.append(result['duration'])
+            current = tool
+        else:
+            failures.append(result)
+            # Recover like an operator would: clear flags and re-sync the index
+            harness.ace._park_in_progress = False
+            harness.ace._park_error = False
+            current = harness.ace.variables.get('ace_current_index', -1)
+    return {
+        'changes': changes,
+        'ok': len(durations),
+        'failed': len(failures),
+        'errors': sorted({f['error'] for f in failures if f['error']}),
+        'duration': summarize(durations),
+        'virtual_seconds': harness.reactor.monotonic() - virtual_start,
+        'wall_seconds': time.perf_counter() - wall_start,
+        'timer_calls': harness.reactor.timer_calls,
+        'device': dict(harness.device.stats),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run simulated ValgAce tool changes on virtual time')
+    parser.add_argument('--changes', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--aggressive', action='store_true', help='enable aggressive_parking')
+    parser.add_argument('--sensor', action='store_true', help='attach a simulated filament sensor')
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--crc-error-rate', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--set', action='append', default=[], metavar='OPTION=VALUE',
+                        help='override an [ace] config option')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if not args.verbose:
+        logging.getLogger('ace').setLevel(logging.ERROR)
+    config = {'aggressive_parking': args.aggressive}
+    for item in args.set:
+        key, _, value = item.partition('=')
+        config[key.strip()] = value.strip()
+    faults = FaultConfig(drop_rate=args.drop_rate, crc_error_rate=args.crc_error_rate,
+                         latency=args.latency)
+    harness = AceHarness(config=config, seed=args.seed, faults=faults, sensor=args.sensor)
+    harness.gcode.keep_responses = False
+    if not harness.wait_connected():
+        print("ValgAce did not connect to the simulator", file=sys.stderr)
+        return 1
+    results = run_tool_changes(harness, args.changes, args.seed)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    d = results['duration']
+    print(f"Tool changes: {results['changes']} ok={results['ok']} failed={results['failed']}")
+    if d.get('count'):
+        print(f"Duration (virtual s): min={d['min']:.2f} mean={d['mean']:.2f} p50={d['p50']:.2f} "
+              f"p90={d['p90']:.2f} p99={d['p99']:.2f} max={d['max']:.2f}")
+    for error in results['errors']:
+        print(f"  error: {error}")
+    print(f"Simulated {results['virtual_seconds']:.0f}s in {results['wall_seconds']:.2f}s wall, "
+          f"{results['timer_calls']} timer calls")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
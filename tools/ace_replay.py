@@ -0,0 +1,617 @@
+#!/usr/bin/env python3
+# File: ace_replay.py — Replay flight recorder traces against the current ValgAce code
+#
+# Воспроизводит запись бортового самописца (ACE_DUMP_TRACE / ace_trace.bin)
+# на текущей версии extras/ace.py в виртуальном времени и сообщает, где
+# поведение расходится с записанным: например, парковка, завершившаяся на
+# принтере, на воспроизведении заканчивается таймаутом.
+#
+# Replays a flight recorder trace against the current extras/ace.py on virtual
+# time and reports where behaviour diverges from what was recorded.
+#
+# Two passes per trace:
+#   parser    the captured RX bytes, chunk by chunk exactly as they were read,
+#             go through ValgAce._process_messages and are checked against an
+#             independent length-based decoder
+#   timeline  the recorded tool changes are re-issued at their recorded times;
+#             requests from the code under test are answered with the recorded
+#             responses (ids rewritten, recorded latency kept), so parking,
+#             infinity spool and the status machinery run on field data
+#
+# Usage:
+#   python3 tools/ace_replay.py ~/printer_data/logs/ace_trace.bin
+#   python3 tools/ace_replay.py traces/*.jsonl --printing --json
+#   git bisect run python3 tools/ace_replay.py --ace extras/ace.py field.bin
+#
+# Exit code 1 when any trace diverges, so the tool can drive ``git bisect run``.
+
+import argparse
+import bisect
+import collections
+import heapq
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from typing import Optional, Dict, Any, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ace_simulator import FrameDecoder, FRAME_HEADER, FRAME_END, calc_crc, encode_frame  # noqa: E402
+from ace_harness import AceHarness, ACE_MODULE_PATH, load_ace_module  # noqa: E402
+
+# Методы, ответы на которые сопоставляются по времени, а не по порядку
+# Methods answered by the recorded reply closest in time instead of in order
+TIME_MATCHED_METHODS = ('get_status',)
+MAX_PAYLOAD = 4096
+READER_IDLE_GAP = 0.015     # reads closer together than this mean the reader had a backlog
+TIMING_TOLERANCE = 0.5      # relative duration difference reported as a timing divergence
+TIMING_MIN_DELTA = 2.0      # seconds; shorter differences are never reported
+
+
+# ============================================================
+# Trace loading
+# ============================================================
+
+def load_trace(path: str, module) -> Dict[str, Any]:
+    """Read a .bin ring file or an ACE_DUMP_TRACE .jsonl export"""
+    if path.endswith('.jsonl'):
+        kinds = {name: kind for kind, name in module.TRACE_KIND_NAMES.items()}
+        records, wall_offset = [], 0.0
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                kind = kinds[entry['kind']]
+                if 'text' in entry:
+                    payload = entry['text'].encode('utf-8')
+                else:
+                    payload = bytes.fromhex(entry['hex'])
+                wall_offset = entry['wall'] - entry['t']
+                records.append((entry['t'], kind, payload))
+        return {'wall_offset': wall_offset, 'records': records}
+    return module.AceFlightRecorder.read_file(os.path.expanduser(path))
+
+
+def parse_event(text: str) -> Tuple[str, Dict[str, str]]:
+    """'park_error slot=1 reason=timeout' -> ('park_error', {'slot': '1', 'reason': 'timeout'})"""
+    name, *fields = text.split()
+    return name, dict(field.partition('=')[::2] for field in fields)
+
+
+def split_rx_stream(chunks: List[Tuple[float, bytes]]) -> List[Dict[str, Any]]:
+    """
+    Cut the captured RX bytes into frames and junk.
+    Each token gets the time of the chunk that delivered its last byte.
+    Frames are found by their length field, the same way the device does it.
+    """
+    data = bytearray()
+    ends = []   # cumulative end offset of each chunk
+    times = []
+    for t, raw in chunks:
+        data.extend(raw)
+        ends.append(len(data))
+        times.append(t)
+
+    def chunk_at(offset):
+        return min(bisect.bisect_right(ends, offset), len(times) - 1)
+
+    def time_at(offset):
+        return times[chunk_at(offset)]
+
+    def queued(offset):
+        # The reader was still draining earlier bytes when this frame started,
+        # so its read time says nothing about when the device sent it
+        i = chunk_at(offset)
+        if i == 0:
+            return False
+        return ends[i - 1] != offset or times[i] - times[i - 1] < READER_IDLE_GAP
+
+    tokens = []
+    pos = 0
+    junk_start = 0
+
+    def flush_junk(upto):
+        if upto > junk_start:
+            tokens.append({'t': time_at(upto - 1), 'raw': bytes(data[junk_start:upto]),
+                           'frame': False, 'id': None, 'valid': False})
+
+    while True:
+        start = data.find(FRAME_HEADER, pos)
+        if start == -1 or start + 4 > len(data):
+            break
+        payload_len = struct.unpack_from('<H', data, start + 2)[0]
+        end = start + 4 + payload_len + 3
+        if payload_len > MAX_PAYLOAD or end > len(data) or data[end - 1] != FRAME_END:
+            pos = start + 1
+            continue
+        flush_junk(start)
+        raw = bytes(data[start:end])
+        payload = raw[4:4 + payload_len]
+        crc = struct.unpack_from('<H', raw, 4 + payload_len)[0]
+        message = None
+        if crc == calc_crc(payload):
+            try:
+                message = json.loads(payload.decode('utf-8'))
+            except ValueError:
+                message = None
+        tokens.append({'t': time_at(end - 1), 'first_t': time_at(start), 'queued': queued(start),
+                       'raw': raw, 'frame': True,
+                       'id': message.get('id') if isinstance(message, dict) else None,
+                       'valid': message is not None, 'message': message})
+        pos = junk_start = end
+    flush_junk(len(data))
+    return tokens
+
+
+def split_trace(trace: Dict[str, Any], module) -> Dict[str, Any]:
+    """
+    Split the last Klipper session of a trace into requests, RX chunks and events.
+    The ring keeps earlier sessions too, but their reactor clocks are unrelated.
+    """
+    records = trace['records']
+    for i in range(len(records) - 1, -1, -1):
+        if records[i][1] == module.TRACE_EVENT and records[i][2].startswith(b'session_start'):
+            records = records[i:]
+            break
+    tx, rx_chunks, events = [], [], []
+    for t, kind, payload in records:
+        if kind == module.TRACE_TX:
+            decoded = FrameDecoder().feed(payload)
+            if decoded:
+                request = decoded[0]
+                tx.append({'t': t, 'id': request.get('id'), 'method': request.get('method'),
+                           'params': request.get('params')})
+        elif kind == module.TRACE_RX:
+            rx_chunks.append((t, payload))
+        elif kind == module.TRACE_EVENT:
+            name, fields = parse_event(payload.decode('utf-8', 'replace'))
+            events.append({'t': t, 'name': name, **fields})
+    span = (records[0][0], records[-1][0]) if records else (0.0, 0.0)
+    return {'tx': tx, 'rx_chunks': rx_chunks, 'events': events, 'span': span, 'records': len(records)}
+
+
+# ============================================================
+# Parser pass
+# ============================================================
+
+def check_parser(harness: AceHarness, rx_chunks, tokens) -> Dict[str, Any]:
+    """Feed the captured chunks through _process_messages and compare with the reference split"""
+    ace = harness.ace
+    accepted = []
+    resets = []
+    ace._handle_response = lambda response: accepted.append(response.get('id'))
+    ace._reset_connection = lambda: resets.append(len(accepted))
+    ace.read_buffer = bytearray()
+    for t, raw in rx_chunks:
+        ace.read_buffer.extend(raw)
+        ace._process_messages()
+
+    reference = [tok for tok in tokens if tok['valid']]
+    remaining = collections.Counter(accepted)
+    dropped = []
+    for tok in reference:
+        if remaining[tok['id']]:
+            remaining[tok['id']] -= 1
+        else:
+            dropped.append(tok)
+    divergences = [{'kind': 'parser', 't': tok['t'], 'id': tok['id'],
+                    'detail': f"valid frame id={tok['id']} ({len(tok['raw'])} bytes) not delivered to _handle_response"}
+                   for tok in dropped]
+    extra = sum(remaining.values())
+    if extra:
+        divergences.append({'kind': 'parser', 't': None, 'id': None,
+                            'detail': f"{extra} frames delivered that the reference decoder rejects"})
+    return {
+        'reference_frames': len(reference),
+        'accepted_frames': len(accepted),
+        'corrupt_frames': sum(1 for tok in tokens if tok['frame'] and not tok['valid']),
+        'junk_bytes': sum(len(tok['raw']) for tok in tokens if not tok['frame']),
+        'resets': len(resets),
+        'divergences': divergences,
+    }
+
+
+# ============================================================
+# Timeline pass
+# ============================================================
+
+class ReplayLink:
+    """
+    Answers the code under test with recorded replies.
+    Field and replay request ids differ, so requests are matched to recorded
+    ones by method (in order, or closest in time for status polls) and the
+    recorded reply is delivered with the new id after the recorded latency.
+    Junk bytes, corrupted frames and unsolicited frames keep their recorded
+    time and bytes.
+
+    The recorded read time of a reply includes any backlog in the host reader,
+    which the code under test reproduces by itself, so replies that were read
+    from a backlog use the method's fastest observed latency instead. Replies
+    leave in request order, like on a single UART.
+    """
+    def __init__(self, clock, tx: List[Dict[str, Any]], tokens: List[Dict[str, Any]]):
+        self.clock = clock
+        self.decoder = FrameDecoder()
+        self.offset = None
+        self.field_origin = tx[0]['t'] if tx else (tokens[0]['t'] if tokens else 0.0)
+        field_ids = {req['id'] for req in tx}
+        self.replies = {tok['id']: tok for tok in tokens if tok['valid'] and tok['id'] in field_ids}
+        self.passthrough = [tok for tok in tokens if not (tok['valid'] and tok['id'] in field_ids)]
+        self.pending = collections.defaultdict(collections.deque)
+        fastest = {}
+        for req in tx:
+            self.pending[req['method']].append(req)
+            reply = self.replies.get(req['id'])
+            if reply is not None and not reply['queued']:
+                latency = max(0.0, reply['first_t'] - req['t'])
+                reply['latency'] = latency
+                fastest[req['method']] = min(latency, fastest.get(req['method'], latency))
+        for req in tx:
+            reply = self.replies.get(req['id'])
+            if reply is not None and 'latency' not in reply:
+                reply['latency'] = fastest.get(req['method'], 0.0)
+        self.stats = collections.Counter()
+        self.extra = collections.Counter()
+        self.param_mismatches = []
+        self._outgoing = []   # heap of (deliver_at, seq, bytes)
+        self._seq = 0
+        self._last_reply_at = 0.0
+        self._rx = bytearray()
+
+    def to_replay_time(self, field_time: float) -> float:
+        return field_time + (self.offset or 0.0)
+
+    def _schedule(self, at: float, raw: bytes):
+        self._seq += 1
+        heapq.heappush(self._outgoing, (at, self._seq, raw))
+
+    def _match(self, method: str, now: float) -> Optional[Dict[str, Any]]:
+        queue = self.pending.get(method)
+        if not queue:
+            return None
+        if method in TIME_MATCHED_METHODS:
+            # Skip recorded polls that are already in the past on the replay clock
+            while len(queue) > 1 and self.to_replay_time(queue[1]['t']) <= now:
+                queue.popleft()
+                self.stats['skipped'] += 1
+        return queue.popleft()
+
+    def write(self, data: bytes) -> int:
+        now = self.clock()
+        for request in self.decoder.feed(bytes(data)):
+            if self.offset is None:
+                self.offset = now - self.field_origin
+                for tok in self.passthrough:
+                    self._schedule(self.to_replay_time(tok['t']), tok['raw'])
+            method = request.get('method')
+            recorded = self._match(method, now)
+            if recorded is None:
+                self.extra[method] += 1
+                continue
+            self.stats['matched'] += 1
+            if method not in TIME_MATCHED_METHODS and recorded['params'] != request.get('params'):
+                self.param_mismatches.append({'t': now, 'method': method,
+                                              'field': recorded['params'], 'replay': request.get('params')})
+            reply = self.replies.get(recorded['id'])
+            if reply is None:
+                # The device never answered in the field
+                self.stats['unanswered'] += 1
+                continue
+            raw = reply['raw']
+            if reply['id'] != request['id']:
+                message = dict(reply['message'])
+                message['id'] = request['id']
+                raw = encode_frame(message)
+            self._last_reply_at = max(now + reply['latency'], self._last_reply_at)
+            self._schedule(self._last_reply_at, raw)
+        return len(data)
+
+    def available(self) -> int:
+        now = self.clock()
+        return len(self._rx) + sum(len(raw) for at, _, raw in self._outgoing if at <= now)
+
+    def read(self, size: int = -1) -> bytes:
+        now = self.clock()
+        while self._outgoing and self._outgoing[0][0] <= now:
+            self._rx.extend(heapq.heappop(self._outgoing)[2])
+        if size < 0 or size >= len(self._rx):
+            data = bytes(self._rx)
+            self._rx.clear()
+        else:
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+        return data
+
+    def missing(self) -> Dict[str, int]:
+        """Recorded requests the replay never sent (status polls excluded)"""
+        return {method: len(queue) for method, queue in self.pending.items()
+                if queue and method not in TIME_MATCHED_METHODS}
+
+
+class ReplaySensor:
+    """
+    Filament sensor that reproduces the recorded sensor-parking triggers:
+    the n-th sensor park sees filament after the same delay as in the field.
+    """
+    def __init__(self, delays: List[float]):
+        self.delays = collections.deque(delays)
+        self.trigger_at = None
+        self.enabled = True
+        self.now = 0.0
+
+    def arm(self, park_start: float):
+        self.trigger_at = park_start + self.delays.popleft() if self.delays else None
+
+    def reset(self):
+        self.trigger_at = None
+
+    def get_status(self, eventtime):
+        detected = self.trigger_at is not None and eventtime >= self.trigger_at
+        return {'filament_detected': detected, 'enabled': self.enabled}
+
+
+def group_tool_changes(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Collapse an event list into one record per tool change"""
+    changes = []
+    current = None
+    infsp_pending = False
+    for ev in events:
+        name = ev['name']
+        if name == 'infsp_start':
+            infsp_pending = True
+        elif name == 'toolchange_start':
+            current = {'t': ev['t'], 'from': int(ev.get('from', -1)), 'to': int(ev.get('to', -1)),
+                       'infsp': infsp_pending, 'park': None, 'outcome': None, 'duration': None}
+            infsp_pending = False
+            changes.append(current)
+        elif current is None:
+            continue
+        elif name == 'park_start':
+            current['park_mode'] = ev.get('mode')
+            current['park_t'] = ev['t']
+        elif name == 'park_phase' and ev.get('phase') == 'sensor_triggered':
+            current['sensor_delay'] = ev['t'] - current.get('park_t', ev['t'])
+        elif name in ('park_complete', 'park_error'):
+            current['park'] = name if name == 'park_complete' else f"park_error {ev.get('reason', '')}".strip()
+        elif name in ('toolchange_done', 'toolchange_error'):
+            current['outcome'] = 'done' if name == 'toolchange_done' else f"error {ev.get('reason', '')}".strip()
+            current['duration'] = ev['t'] - current['t']
+            current = None
+    return changes
+
+
+def compare_tool_changes(field: List[Dict[str, Any]], replay: List[Dict[str, Any]],
+                         offset: float) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    divergences, timing = [], []
+    for n, f in enumerate(field):
+        label = f"#{n + 1} T{f['from']}->T{f['to']}"
+        if n >= len(replay):
+            divergences.append({'kind': 'toolchange', 't': f['t'],
+                                'detail': f"{label}: not reached on replay (field: {f['outcome']})"})
+            continue
+        r = replay[n]
+        if (r['from'], r['to']) != (f['from'], f['to']):
+            divergences.append({'kind': 'toolchange', 't': f['t'],
+                                'detail': f"{label}: replay changed T{r['from']}->T{r['to']}"})
+            continue
+        if f['outcome'] is None:
+            continue    # the trace ends inside this tool change
+        if (r['outcome'], r['park']) != (f['outcome'], f['park']):
+            divergences.append({'kind': 'toolchange', 't': f['t'],
+                                'detail': f"{label}: field {f['park'] or 'no park'}/{f['outcome']}, "
+                                          f"replay {r['park'] or 'no park'}/{r['outcome']}"})
+        elif f['duration'] is not None and r['duration'] is not None:
+            delta = r['duration'] - f['duration']
+            if abs(delta) > max(TIMING_MIN_DELTA, TIMING_TOLERANCE * f['duration']):
+                timing.append({'kind': 'timing', 't': f['t'],
+                               'detail': f"{label}: {f['duration']:.1f}s in field, {r['duration']:.1f}s on replay"})
+    for r in replay[len(field):]:
+        divergences.append({'kind': 'toolchange', 't': r['t'] - offset,
+                            'detail': f"extra tool change on replay T{r['from']}->T{r['to']} ({r['outcome']})"})
+    return divergences, timing
+
+
+def replay_timeline(parts: Dict[str, Any], tokens, options: Dict[str, Any], printing: bool,
+                    variables: Dict[str, Any], ace_path: str, settle: float = 5.0) -> Dict[str, Any]:
+    field_events = parts['events']
+    field_changes = group_tool_changes(field_events)
+    sensor_delays = [c['sensor_delay'] for c in field_changes if 'sensor_delay' in c]
+    use_sensor = options.get('filament_sensor') or any(c.get('park_mode') == 'sensor' for c in field_changes)
+
+    module = load_ace_module(ace_path)
+    harness_box = {}
+    link = ReplayLink(lambda: harness_box['h'].reactor.monotonic(), parts['tx'], tokens)
+    sensor = ReplaySensor(sensor_delays) if use_sensor else None
+    config = {'flight_recorder': False}
+    config.update(options)
+    config.pop('filament_sensor', None)
+    harness = AceHarness(config=config, ace_module=module, link=link, filament_sensor=sensor)
+    harness_box['h'] = harness
+    harness.gcode.keep_responses = False
+    ace = harness.ace
+    ace.variables.update(variables)
+
+    replay_events = []
+    original_trace_event = ace._trace_event
+
+    def tee(text):
+        name, fields = parse_event(text)
+        now = harness.reactor.monotonic()
+        replay_events.append({'t': now, 'name': name, **fields})
+        if sensor is not None:
+            if name == 'toolchange_start':
+                sensor.reset()
+            elif name == 'park_start' and fields.get('mode') == 'sensor':
+                sensor.arm(now)
+        original_trace_event(text)
+    ace._trace_event = tee
+
+    if printing:
+        harness.print_stats.state = 'printing'
+
+    wall_start = time.perf_counter()
+    virtual_start = harness.reactor.monotonic()
+    connected = harness.wait_connected()
+    drift = 0.0
+    if field_changes and 'ace_current_index' not in variables:
+        ace.variables['ace_current_index'] = field_changes[0]['from']
+    if connected:
+        for change in field_changes:
+            if change['infsp']:
+                continue    # issued by the replayed infinity spool logic itself
+            due = link.to_replay_time(change['t'])
+            now = harness.reactor.monotonic()
+            if due > now:
+                harness.reactor.run_until(due)
+            else:
+                drift = max(drift, now - due)
+            harness.change_tool(change['to'])
+        end = link.to_replay_time(parts['span'][1]) + settle
+        if end > harness.reactor.monotonic():
+            harness.reactor.run_until(end)
+
+    replay_changes = group_tool_changes(replay_events)
+    offset = link.offset or 0.0
+    divergences, timing = compare_tool_changes(field_changes, replay_changes, offset)
+    if not connected:
+        divergences.insert(0, {'kind': 'connect', 't': None, 'detail': "ValgAce did not connect on replay"})
+
+    field_infsp = [e['name'] for e in field_events if e['name'].startswith('infsp_')]
+    replay_infsp = [e['name'] for e in replay_events if e['name'].startswith('infsp_')]
+    if field_infsp != replay_infsp:
+        divergences.append({'kind': 'infinity_spool', 't': None,
+                            'detail': f"field {field_infsp or 'none'}, replay {replay_infsp or 'none'}"})
+    for method, count in sorted(link.missing().items()):
+        divergences.append({'kind': 'request', 't': None,
+                            'detail': f"{count} recorded {method} requests were not sent on replay"})
+    for method, count in sorted(link.extra.items()):
+        if method not in TIME_MATCHED_METHODS:
+            divergences.append({'kind': 'request', 't': None,
+                                'detail': f"{count} {method} requests sent on replay had no recorded reply"})
+    for mismatch in link.param_mismatches:
+        divergences.append({'kind': 'request', 't': mismatch['t'] - offset,
+                            'detail': f"{mismatch['method']} params {mismatch['replay']} (field {mismatch['field']})"})
+
+    virtual = harness.reactor.monotonic() - virtual_start
+    wall = time.perf_counter() - wall_start
+    return {
+        'tool_changes': len(field_changes),
+        'replayed_tool_changes': len(replay_changes),
+        'virtual_seconds': virtual,
+        'wall_seconds': wall,
+        'speedup': virtual / wall if wall > 0 else None,
+        'max_drift': drift,
+        'requests': dict(link.stats),
+        'divergences': divergences,
+        'timing': timing,
+    }
+
+
+
+# ============================================================
+# Entry points
+# ============================================================
+
+def replay_file(path: str, options: Dict[str, Any], printing: bool = False,
+                variables: Optional[Dict[str, Any]] = None,
+                ace_path: str = ACE_MODULE_PATH, parser_pass: bool = True) -> Dict[str, Any]:
+    module = load_ace_module(ace_path)
+    trace = load_trace(path, module)
+    parts = split_trace(trace, module)
+    tokens = split_rx_stream(parts['rx_chunks'])
+
+    parser = {'reference_frames': 0, 'accepted_frames': 0, 'corrupt_frames': 0,
+              'junk_bytes': 0, 'resets': 0, 'divergences': [], 'skipped': True}
+    if parser_pass:
+        parser_harness = AceHarness(config={'flight_recorder': False}, ace_module=load_ace_module(ace_path),
+                                    link=ReplayLink(lambda: 0.0, [], []))
+        parser = check_parser(parser_harness, parts['rx_chunks'], tokens)
+    timeline = replay_timeline(parts, tokens, options, printing, variables or {}, ace_path)
+
+    divergences = parser['divergences'] + timeline['divergences']
+    for d in divergences + timeline['timing']:
+        if d.get('t') is not None:
+            d['t_rel'] = d['t'] - parts['span'][0]
+    return {
+        'trace': path,
+        'records': parts['records'],
+        'span_seconds': parts['span'][1] - parts['span'][0],
+        'parser': parser,
+        'timeline': timeline,
+        'diverged': bool(divergences),
+    }
+
+
+def _parse_value(value: str):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def print_report(result: Dict[str, Any], verbose: bool = False):
+    parser, timeline = result['parser'], result['timeline']
+    print(f"{result['trace']}: {result['records']} records, {result['span_seconds']:.0f}s")
+    if parser.get('skipped'):
+        print("  parser:   skipped")
+    else:
+        print(f"  parser:   {parser['accepted_frames']}/{parser['reference_frames']} frames, "
+              f"{parser['corrupt_frames']} corrupt, {parser['junk_bytes']} junk bytes, {parser['resets']} resets")
+    speedup = f"{timeline['speedup']:.0f}x" if timeline['speedup'] else '-'
+    print(f"  timeline: {timeline['replayed_tool_changes']}/{timeline['tool_changes']} tool changes, "
+          f"{timeline['virtual_seconds']:.0f}s virtual in {timeline['wall_seconds']:.2f}s ({speedup}), "
+          f"requests {timeline['requests'].get('matched', 0)} matched")
+    items = parser['divergences'] + timeline['divergences']
+    if verbose:
+        items = items + timeline['timing']
+    for d in items:
+        at = f"+{d['t_rel']:.1f}s " if 't_rel' in d else ''
+        print(f"  DIVERGED {d['kind']}: {at}{d['detail']}" if d['kind'] != 'timing'
+              else f"  timing: {at}{d['detail']}")
+    if not result['diverged']:
+        print("  OK")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay ValgAce flight recorder traces on virtual time')
+    parser.add_argument('traces', nargs='+', help='ace_trace.bin or ACE_DUMP_TRACE .jsonl files')
+    parser.add_argument('--ace', default=ACE_MODULE_PATH, help='ace.py to replay against')
+    parser.add_argument('--set', action='append', default=[], metavar='OPTION=VALUE',
+                        help='[ace] option used in the field (aggressive_parking, infinity_spool_mode, ...)')
+    parser.add_argument('--var', action='append', default=[], metavar='NAME=VALUE',
+                        help='save_variables value at the start of the trace (ace_infsp_order, ...)')
+    parser.add_argument('--printing', action='store_true', help='replay as if a print was running')
+    parser.add_argument('--no-parser', action='store_true', help='skip the parser pass')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('-v', '--verbose', action='store_true', help='also list timing differences')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('ace').setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+    options = {}
+    for item in args.set:
+        key, _, value = item.partition('=')
+        options[key.strip()] = value.strip()
+    variables = {}
+    for item in args.var:
+        key, _, value = item.partition('=')
+        variables[key.strip()] = _parse_value(value.strip())
+
+    results = [replay_file(path, options, args.printing, variables, args.ace, not args.no_parser)
+               for path in args.traces]
+    if args.json:
+        print(json.dumps(results, indent=2, default=str))
+    else:
+        for result in results:
+            print_report(result, args.verbose)
+        diverged = sum(1 for r in results if r['diverged'])
+        if len(results) > 1:
+            print(f"{len(results)} traces, {diverged} diverged")
+    return 1 if any(r['diverged'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+# File: ace_simulator.py — Deterministic ACE Pro device simulator
+#
+# Эмулятор устройства ACE Pro поверх псевдотерминала (PTY) для локального
+# тестирования и бенчмарков ValgACE без реального железа.
+# ACE Pro device simulator over a pseudo-terminal (PTY) for local testing and
+# benchmarking ValgACE without real hardware.
+#
+# Usage:
+#   python3 tools/ace_simulator.py --link /tmp/ttyACE0
+#   python3 tools/ace_simulator.py --link /tmp/ttyACE0 --seed 7 \
+#       --crc-error-rate 0.01 --drop-rate 0.01 --latency 0.02
+#
+# Then point the [ace] section at the link:
+#   [ace]
+#   serial: /tmp/ttyACE0
+#
+# The framing and methods follow docs/Protocol.md. The device model is driven
+# by an explicit clock (``now`` arguments), so the same seed and the same
+# request sequence always produce the same byte stream.
+
+import argparse
+import json
+import logging
+import os
+import random
+import select
+import struct
+import sys
+import time
+import tty
+from typing import Optional, Dict, Any, List
+
+FRAME_HEADER = b'\xff\xaa'
+FRAME_END = 0xFE
+AMBIENT_TEMP = 25.0
+
+
+def calc_crc(buffer: bytes, crc: int = 0xffff) -> int:
+    """CRC-16/MCRF4XX, same algorithm as ValgAce._calc_crc"""
+    for byte in buffer:
+        data = byte ^ (crc & 0xff)
+        data ^= (data & 0x0f) << 4
+        crc = (((data << 8) | (crc >> 8)) ^ (data >> 4) ^ (data << 3)) & 0xffff
+    return crc & 0xffff
+
+
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    """Pack a JSON message into a 0xFF 0xAA ... 0xFE frame"""
+    payload = json.dumps(message).encode('utf-8')
+    return (FRAME_HEADER + struct.pack('<H', len(payload)) + payload +
+            struct.pack('<H', calc_crc(payload)) + bytes([FRAME_END]))
+
+
+class FrameDecoder:
+    """
+    Device-side frame parser.
+    Unlike the host parser it relies on the length field instead of the
+    terminator, so 0xFE bytes inside the payload are handled correctly.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.crc_errors = 0
+        self.garbage_bytes = 0
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        self.buffer.extend(data)
+        messages = []
+        while True:
+            start = self.buffer.find(FRAME_HEADER)
+            if start == -1:
+                # Keep a trailing 0xFF, it may be the first half of a header
+                keep = 1 if self.buffer[-1:] == b'\xff' else 0
+                self.garbage_bytes += len(self.buffer) - keep
+                del self.buffer[:len(self.buffer) - keep]
+                break
+            if start:
+                self.garbage_bytes += start
+                del self.buffer[:start]
+            if len(self.buffer) < 4:
+                break
+            payload_len = struct.unpack_from('<H', self.buffer, 2)[0]
+            frame_len = 4 + payload_len + 3
+            if len(self.buffer) < frame_len:
+                break
+            payload = bytes(self.buffer[4:4 + payload_len])
+            crc = struct.unpack_from('<H', self.buffer, 4 + payload_len)[0]
+            terminator = self.buffer[frame_len - 1]
+            if crc != calc_crc(payload) or terminator != FRAME_END:
+                # Drop the header and resynchronise on the next one
+                self.crc_errors += 1
+                del self.buffer[:2]
+                continue
+            del self.buffer[:frame_len]
+            try:
+                messages.append(json.loads(payload.decode('utf-8')))
+            except ValueError:
+                self.crc_errors += 1
+        return messages
+
+
+class FaultConfig:
+    """Injectable faults, all drawn from the simulator's seeded RNG"""
+    def __init__(self, crc_error_rate: float = 0.0, drop_rate: float = 0.0,
+                 latency: float = 0.0, latency_jitter: float = 0.0,
+                 noise_rate: float = 0.0):
+        self.crc_error_rate = crc_error_rate    # probability a reply has a corrupted CRC
+        self.drop_rate = drop_rate              # probability a reply is never sent
+        self.latency = latency                  # base reply latency, seconds
+        self.latency_jitter = latency_jitter    # uniform extra latency, seconds
+        self.noise_rate = noise_rate            # probability of garbage bytes before a reply
+
+
+class AceDevice:
+    """
+    Behavioural model of an ACE Pro.
+
+    Filament position is tracked per slot in millimetres from the hub
+    (0) to the toolhead (``path_length``); loaded spools start at
+    ``rest_position``. Feeding and unwinding move it at
+    the requested speed, feed assist pushes it at ``assist_speed`` and
+    increments ``feed_assist_count`` every ``assist_step`` millimetres until the
+    filament reaches the toolhead, after which the count stops changing -
+    exactly what the ValgAce parking logic waits for.
+    """
+    def __init__(self, seed: int = 0, faults: Optional[FaultConfig] = None,
+                 path_length: float = 400.0, sensor_distance: float = 350.0,
+                 assist_speed: float = 50.0, assist_step: float = 5.0,
+                 rest_position: float = 300.0,
+                 empty_slots: Optional[List[int]] = None):
+        self.rng = random.Random(seed)
+        self.faults = faults or FaultConfig()
+        self.path_length = path_length
+        self.sensor_distance = sensor_distance
+        self.assist_speed = assist_speed
+        self.assist_step = assist_step
+
+        self.model = 'Anycubic Color Engine Pro'
+        self.firmware = 'V1.3.84'
+        self.boot_firmware = 'V1.0.1'
+        self.enable_rfid = 1
+        self.fan_speed = 7000
+        self.temp = AMBIENT_TEMP
+        self.dryer = {'status': 'stop', 'target_temp': 0, 'duration': 0, 'remain_time': 0}
+        self._dryer_end = 0.0
+        self.feed_assist_count = 0
+        self.cont_assist_time = 0.0
+
+        empty_slots = empty_slots or []
+        colors = [[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 255]]
+        self.slots = []
+        for i in range(4):
+            empty = i in empty_slots
+            self.slots.append({
+                'index': i,
+                'status': 'empty' if empty else 'ready',
+                'sku': '' if empty else f'SIM-PLA-0{i}',
+                'type': '' if empty else 'PLA',
+                'color': [0, 0, 0] if empty else colors[i],
+                'rfid': 0 if empty else 2,
+            })
+        # Loaded spools start with filament resting at the splitter
+        self.positions = [0.0 if i in empty_slots else rest_position for i in range(4)]
+
+        # Active motion: None or dict(kind, index, remaining, speed)
+        self._motion = None
+        self._assist_index = -1
+        self._assist_travel = 0.0
+        self._now = 0.0
+
+        self.stats = {'requests': 0, 'replies': 0, 'dropped': 0, 'corrupted': 0}
+
+    # ---- model ----
+
+    def advance(self, now: float):
+        """Integrate the physical model up to ``now``"""
+        dt = now - self._now
+        if dt <= 0:
+            return
+        self._now = now
+
+        if self._motion is not None:
+            motion = self._motion
+            step = min(motion['remaining'], motion['speed'] * dt)
+            motion['remaining'] -= step
+            idx = motion['index']
+            if motion['kind'] == 'feeding':
+                self.positions[idx] = min(self.path_length, self.positions[idx] + step)
+            else:
+                self.positions[idx] = max(0.0, self.positions[idx] - step)
+            if motion['remaining'] <= 1e-9:
+                self._motion = None
+
+        if self._assist_index >= 0 and self._motion is None:
+            idx = self._assist_index
+            if self.slots[idx]['status'] == 'ready' and self.positions[idx] < self.path_length:
+                step = min(self.path_length - self.positions[idx], self.assist_speed * dt)
+                self.positions[idx] += step
+                self._assist_travel += step
+                self.cont_assist_time += dt * 1000.0
+                while self._assist_travel >= self.assist_step:
+                    self._assist_travel -= self.assist_step
+                    self.feed_assist_count += 1
+
+        if self.dryer['status'] == 'drying':
+            remain = max(0.0, self._dryer_end - now)
+            self.dryer['remain_time'] = int(remain)
+            if remain <= 0:
+                self.dryer.update({'status': 'stop', 'target_temp': 0, 'duration': 0, 'remain_time': 0})
+            else:
+                self.temp = min(self.dryer['target_temp'], self.temp + 0.5 * dt)
+        if self.dryer['status'] != 'drying' and self.temp > AMBIENT_TEMP:
+            self.temp = max(AMBIENT_TEMP, self.temp - 0.2 * dt)
+
+    def run_out(self, index: int):
+        """Simulate the spool in ``index`` running out"""
+        slot = self.slots[index]
+        slot.update({'status': 'empty', 'sku': '', 'type': '', 'color': [0, 0, 0], 'rfid': 0})
+        self.positions[index] = 0.0
+        if self._assist_index == index:
+            self._assist_index = -1
+
+    def load_spool(self, index: int, material: str = 'PLA', color=None,
+                   position: float = 0.0):
+        """Simulate a user inserting a spool into ``index``"""
+        self.positions[index] = position
+        self.slots[index].update({
+            'status': 'ready', 'type': material, 'sku': f'SIM-{material}-0{index}',
+            'color': color or [128, 128, 128], 'rfid': 2,
+        })
+
+    def filament_at_sensor(self) -> bool:
+        """Whether any slot has pushed filament past the toolhead sensor"""
+        return any(pos >= self.sensor_distance for pos in self.positions)
+
+    def _status_result(self) -> Dict[str, Any]:
+        action = self._motion['kind'] if self._motion else ''
+        return {
+            'status': 'busy' if self._motion else 'ready',
+            'action': action,
+            'dryer_status': dict(self.dryer),
+            'temp': int(round(self.temp)),
+            'enable_rfid': self.enable_rfid,
+            'fan_speed': self.fan_speed,
+            'feed_assist_count': self.feed_assist_count,
+            'cont_assist_time': round(self.cont_assist_time, 1),
+            'slots': [dict(slot) for slot in self.slots],
+        }
+
+    # ---- protocol ----
+
+    def handle_request(self, request: Dict[str, Any], now: float) -> Dict[str, Any]:
+        """Apply one request at time ``now`` and build the reply"""
+        self.advance(now)
+        self.stats['requests'] += 1
+        method = request.get('method')
+        params = request.get('params') or {}
+        code, msg, result = 0, 'success', None
+        index = params.get('index', 0)
+
+        if 'index' in params and not (isinstance(index, int) and 0 <= index <= 3):
+            code, msg = -1, 'invalid index'
+        elif method == 'get_info':
+            result = {'id': 0, 'slots': 4, 'model': self.model,
+                      'firmware': self.firmware, 'boot_firmware': self.boot_firmware}
+        elif method == 'get_status':
+            result = self._status_result()
+        elif method == 'get_filament_info':
+            slot = self.slots[index]
+            result = {
+                'index': index, 'sku': slot['sku'], 'brand': 'Simulator',
+                'type': slot['type'], 'color': slot['color'], 'rfid': slot['rfid'],
+                'extruder_temp': {'min': 190, 'max': 230},
+                'hotbed_temp': {'min': 50, 'max': 70},
+                'diameter': 1.75, 'total': 330, 'current': 0,
+            }
+        elif method in ('enable_rfid', 'disable_rfid'):
+            self.enable_rfid = 1 if method == 'enable_rfid' else 0
+        elif method in ('feed_filament', 'unwind_filament'):
+            if self.slots[index]['status'] != 'ready':
+                code, msg = -1, f'slot {index} is empty'
+            else:
+                self._motion = {
+                    'kind': 'feeding' if method == 'feed_filament' else 'unwinding',
+                    'index': index,
+                    'remaining': float(params.get('length', 0)),
+                    'speed': float(max(1, params.get('speed', 25))),
+                }
+                if method == 'unwind_filament' and self._assist_index == index:
+                    self._assist_index = -1
+        elif method in ('update_feeding_speed', 'update_unwinding_speed'):
+            if self._motion and self._motion['index'] == index:
+                self._motion['speed'] = float(max(1, params.get('speed', 25)))
+        elif method in ('stop_feed_filament', 'stop_unwind_filament'):
+            if self._motion and self._motion['index'] == index:
+                self._motion = None
+        elif method == 'start_feed_assist':
+            if self.slots[index]['status'] != 'ready':
+                code, msg = -1, f'slot {index} is empty'
+            else:
+                self._assist_index = index
+                self._assist_travel = 0.0
+                self.feed_assist_count = 0
+                self.cont_assist_time = 0.0
+                result = {'feed_assist_count': 0}
+        elif method == 'stop_feed_assist':
+            if self._assist_index == index:
+                self._assist_index = -1
+            msg = ''
+        elif method == 'drying':
+            temp = params.get('temp', 0)
+            duration = params.get('duration', 240)
+            self.fan_speed = params.get('fan_speed', 7000)
+            self.dryer.update({'status': 'drying', 'target_temp': temp,
+                               'duration': duration, 'remain_time': duration * 60})
+            self._dryer_end = now + duration * 60
+            msg = 'drying'
+        elif method == 'drying_stop':
+            self.dryer.update({'status': 'stop', 'target_temp': 0, 'duration': 0, 'remain_time': 0})
+        else:
+            code, msg = -1, f'unknown method {method}'
+
+        response = {'id': request.get('id', 0), 'code': code, 'msg': msg}
+        if result is not None:
+            response['result'] = result
+        return response
+
+    def encode_reply(self, response: Dict[str, Any]) -> Optional[bytes]:
+        """Frame a reply, applying drop / corruption / noise faults"""
+        faults = self.faults
+        if faults.drop_rate and self.rng.random() < faults.drop_rate:
+            self.stats['dropped'] += 1
+            return None
+        frame = bytearray(encode_frame(response))
+        if faults.crc_error_rate and self.rng.random() < faults.crc_error_rate:
+            frame[-3] ^= 0x5a
+            self.stats['corrupted'] += 1
+        if faults.noise_rate and self.rng.random() < faults.noise_rate:
+            noise = bytes(self.rng.randrange(256) for _ in range(self.rng.randint(1, 8)))
+            frame[0:0] = noise
+        self.stats['replies'] += 1
+        return bytes(frame)
+
+    def reply_delay(self) -> float:
+        faults = self.faults
+        delay = faults.latency
+        if faults.latency_jitter:
+            delay += self.rng.uniform(0.0, faults.latency_jitter)
+        return delay
+
+
+class SimulatedLink:
+    """
+    Clock-driven byte link between a host and an AceDevice.
+    The host writes request frames with ``write`` and collects reply bytes with
+    ``read``; replies become readable once their latency has elapsed.
+    Used directly by in-process harnesses and by the PTY server below.
+    """
+    def __init__(self, device: AceDevice, clock):
+        self.device = device
+        self.clock = clock
+        self.decoder = FrameDecoder()
+        self._outgoing = []  # list of (deliver_at, bytes), ordered by deliver_at
+        self._rx = bytearray()
+
+    def write(self, data: bytes) -> int:
+        now = self.clock()
+        for request in self.decoder.feed(data):
+            response = self.device.handle_request(request, now)
+            frame = self.device.encode_reply(response)
+            if frame is None:
+                continue
+            deliver_at = now + self.device.reply_delay()
+            # Replies stay in order even with jitter, like a single UART
+            if self._outgoing and self._outgoing[-1][0] > deliver_at:
+                deliver_at = self._outgoing[-1][0]
+            self._outgoing.append((deliver_at, frame))
+        return len(data)
+
+    def available(self) -> int:
+        """Number of reply bytes readable right now"""
+        now = self.clock()
+        return len(self._rx) + sum(len(frame) for at, frame in self._outgoing if at <= now)
+
+    def pending_until(self) -> Optional[float]:
+        return self._outgoing[0][0] if self._outgoing else None
+
+    def read(self, size: int = -1) -> bytes:
+        now = self.clock()
+        self.device.advance(now)
+        while self._outgoing and self._outgoing[0][0] <= now:
+            self._rx.extend(self._outgoing.pop(0)[1])
+        if size < 0 or size >= len(self._rx):
+            data = bytes(self._rx)
+            self._rx.clear()
+        else:
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+        return data
+
+
+class PtyServer:
+    """Expose a SimulatedLink on a pseudo-terminal"""
+    def __init__(self, link: SimulatedLink, link_path: Optional[str] = None):
+        self.link = link
+        self.link_path = link_path
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.slave_name = os.ttyname(self.slave_fd)
+        if link_path:
+            if os.path.islink(link_path):
+                os.unlink(link_path)
+            os.symlink(self.slave_name, link_path)
+
+    def close(self):
+        if self.link_path and os.path.islink(self.link_path):
+            os.unlink(self.link_path)
+        for fd in (self.master_fd, self.slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def serve_forever(self, tick: float = 0.01):
+        logger = logging.getLogger('ace_simulator')
+        while True:
+            timeout = tick
+            pending = self.link.pending_until()
+            if pending is not None:
+                timeout = max(0.0, min(tick, pending - self.link.clock()))
+            readable, _, _ = select.select([self.master_fd], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(self.master_fd, 4096)
+                except OSError as e:
+                    logger.info(f"PTY read error: {e}")
+                    time.sleep(tick)
+                    continue
+                if data:
+                    self.link.write(data)
+            out = self.link.read()
+            if out:
+                os.write(self.master_fd, out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ACE Pro device simulator over a PTY')
+    parser.add_argument('--link', default='/tmp/ttyACE0', help='symlink to create for the PTY slave')
+    parser.add_argument('--seed', type=int, default=0, help='RNG seed for fault injection')
+    parser.add_argument('--crc-error-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--noise-rate', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0, help='reply latency, seconds')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='extra uniform latency, seconds')
+    parser.add_argument('--path-length', type=float, default=400.0, help='hub to toolhead distance, mm')
+    parser.add_argument('--sensor-distance', type=float, default=350.0, help='hub to filament sensor distance, mm')
+    parser.add_argument('--rest-position', type=float, default=300.0, help='initial filament position of loaded slots, mm')
+    parser.add_argument('--assist-speed', type=float, default=50.0, help='feed assist speed, mm/s')
+    parser.add_argument('--empty', type=int, action='append', default=[], help='slot that starts empty (repeatable)')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(name)s: %(message)s')
+    faults = FaultConfig(crc_error_rate=args.crc_error_rate, drop_rate=args.drop_rate,
+                         latency=args.latency, latency_jitter=args.latency_jitter,
+                         noise_rate=args.noise_rate)
+    device = AceDevice(seed=args.seed, faults=faults, path_length=args.path_length,
+                       sensor_distance=args.sensor_distance, assist_speed=args.assist_speed,
+                       rest_position=args.rest_position,
+                       empty_slots=args.empty)
+    start = time.monotonic()
+    link = SimulatedLink(device, lambda: time.monotonic() - start)
+    server = PtyServer(link, args.link)
+    logging.getLogger('ace_simulator').info(
+        f"ACE simulator listening on {server.slave_name} (link {args.link}), seed={args.seed}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        logging.getLogger('ace_simulator').info(f"Stats: {device.stats}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -251,6 +251,11 @@ createApp({
             // Connection
             wsConnected: false,
             ws: null,
+            // Версия статуса от /server/ace/status: повторные запросы с тем же
+            // ETag возвращают короткий ответ not_modified
+            statusEtag: null,
+            statusVersion: null,
+            longPollActive: false,
             apiBase: ACE_DASHBOARD_CONFIG?.apiBase || window.location.origin,
             
             // Device Status
@@ -302,7 +307,8 @@ createApp({
         this.loadStatus();
         this.updateDocumentTitle();
         
-            // Auto-refresh
+        // Auto-refresh: при подключенном WebSocket обновления приходят событиями,
+        // периодический запрос с if_none_match лишь сверяет версию и почти ничего не стоит
         const refreshInterval = ACE_DASHBOARD_CONFIG?.autoRefreshInterval || 5000;
         setInterval(() => {
             if (this.wsConnected) {
@@ -368,6 +374,8 @@ createApp({
             this.ws.onclose = () => {
                 this.wsConnected = false;
                 this.showNotification(this.t('notifications.websocketDisconnected'), 'error');
+                // Пока WebSocket недоступен - долгий опрос вместо событий
+                this.startLongPoll();
                 // Reconnect after configured timeout
                 const reconnectTimeout = ACE_DASHBOARD_CONFIG?.wsReconnectTimeout || 3000;
                 setTimeout(() => this.connectWebSocket(), reconnectTimeout);
@@ -398,10 +406,35 @@ createApp({
             }
         },
         
+        // Долгий опрос: сервер держит запрос, пока версия статуса не изменится
+        async startLongPoll() {
+            if (this.longPollActive) return;
+            this.longPollActive = true;
+            try {
+                while (!this.wsConnected) {
+                    const ok = await this.loadStatus({ wait: true });
+                    if (!ok) {
+                        // Moonraker недоступен - не крутим цикл впустую
+                        await new Promise(resolve => setTimeout(resolve, ACE_DASHBOARD_CONFIG?.wsReconnectTimeout || 3000));
+                    }
+                }
+            } finally {
+                this.longPollActive = false;
+            }
+        },
+
         // API Calls
-        async loadStatus() {
+        async loadStatus({ wait = false } = {}) {
             try {
-                const response = await fetch(`${this.apiBase}/server/ace/status`);
+                const query = new URLSearchParams();
+                if (wait && this.statusVersion !== null) {
+                    query.set('wait_for_version', this.statusVersion);
+                    query.set('timeout', 30);
+                } else if (this.statusEtag) {
+                    query.set('if_none_match', this.statusEtag);
+                }
+                const qs = query.toString();
+                const response = await fetch(`${this.apiBase}/server/ace/status${qs ? '?' + qs : ''}`);
                 
                 if (!response.ok) {
                     throw new Error(`HTTP ${response.status}: ${response.statusText}`);
@@ -416,13 +449,21 @@ createApp({
                 if (result.error) {
                     console.error('API error:', result.error);
                     this.showNotification(this.t('notifications.apiError', { error: result.error }), 'error');
-                    return;
+                    return false;
                 }
                 
                 // API может возвращать данные напрямую или в result.result
                 // Обрабатываем оба случая
                 const statusData = result.result || result;
                 
+                if (statusData && statusData.etag !== undefined) {
+                    this.statusEtag = statusData.etag;
+                    this.statusVersion = statusData.version;
+                }
+                if (statusData && statusData.not_modified) {
+                    return true;
+                }
+                
                 // Проверяем, что это действительно данные статуса (есть хотя бы одно из полей)
                 if (statusData && typeof statusData === 'object' && 
                     (statusData.status !== undefined || statusData.slots !== undefined || statusData.dryer !== undefined)) {
@@ -430,9 +471,11 @@ createApp({
                 } else {
                     console.warn('Invalid status data in response:', result);
                 }
+                return true;
             } catch (error) {
                 console.error('Error loading status:', error);
                 this.showNotification(this.t('notifications.loadError', { error: error.message }), 'error');
+                return false;
             }
         },
         